@@ -1,4 +1,5 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*- 
 # Author: Ben Chen
-from .generic import PadchatClient
\ No newline at end of file
+from .generic import PadchatClient
+from .fleet import PadchatFleet
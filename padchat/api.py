@@ -1,14 +1,14 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*- 
 # Author: Ben Chen
-import base64
 import io
 from typing import Union
 
-from tornado import gen
 
 from .constant import LoginType
+from .contacts import ContactStream
 from .exceptions import UnknowLoginType, InvalidateValueError, InstanceNotInit
+from .media import Media, encode_media
 from .utils import send_app_msg_xml_template
 from .logger import logger
 
@@ -16,25 +16,22 @@ from .logger import logger
 class PadChatAPIMixin:
     # cmd 命令 #################################################################
 
-    @gen.coroutine
-    def init(self):
+    async def init(self):
         '''
         初始化机器人
         '''
-        result = yield self.send('init', self.cmd_id)
+        result = await self.send('init', self.cmd_id)
         return result
 
-    @gen.coroutine
-    def get_wx_data(self):
+    async def get_wx_data(self):
         '''
         获取设备实例数据
         '''
-        result = yield self.send('getWxData', self.cmd_id)
+        result = await self.send('getWxData', self.cmd_id)
         return result
 
-    @gen.coroutine
-    def login(self, type, token=None, phone=None,
-              code=None, username=None, password=None):
+    async def login(self, type, token=None, phone=None,
+                    code=None, username=None, password=None):
         '''
         登录函数
         :param type: 登录类型
@@ -98,54 +95,57 @@ class PadChatAPIMixin:
                     'wxData': self._wx_data
                 })
 
-        result = yield self.send('login', cmd_id=self.cmd_id, data=data)
+        result = await self.send('login', cmd_id=self.cmd_id, data=data)
         return result
 
-    @gen.coroutine
-    def get_login_token(self):
+    async def get_login_token(self):
         '''
         获取登录token
         :return: 
         '''
-        result = yield self.send('getLoginToken', self.cmd_id)
+        result = await self.send('getLoginToken', self.cmd_id)
         token = result['data'].get('token')
         self._token = token
         return result
 
-    @gen.coroutine
-    def logout(self):
+    async def logout(self):
         '''
         注销
         :return: 
         '''
-        result = yield self.send('logout', self.cmd_id)
+        result = await self.send('logout', self.cmd_id)
         logger.info('微信账号已注销退出成功')
 
-    @gen.coroutine
-    def close(self):
+    async def close(self):
         '''
         关闭机器人实例（非退出微信）
         :return: 
         '''
-        result = yield self.send('close', self.cmd_id)
+        result = await self.send('close', self.cmd_id)
         logger.info('退出机器人实例')
 
     # 用户管理 接口 #############################################################
-    @gen.coroutine
-    def get_contact(self, username: str):
+    async def get_contact(self, username: str, refresh=False):
         '''
-        获取用户资料
+        获取用户资料，优先从本地通讯录获取
         :param username: 对方wxid
+        :param refresh: 为True时忽略本地通讯录，从服务器获取
         :return: 
         '''
+        if not refresh:
+            contact = self.directory.contact(username)
+            if contact is not None:
+                return {'success': True, 'data': contact}
         data = {
             'userId': username
         }
-        result = yield self.send('getContact', self.cmd_id, data=data)
+        result = await self.send('getContact', self.cmd_id, data=data)
+        if result.get('success') is True and \
+                isinstance(result.get('data'), dict):
+            self.directory.update_contact(result['data'])
         return result
 
-    @gen.coroutine
-    def search_contact(self, username: str):
+    async def search_contact(self, username: str):
         '''
         搜索用户资料
         :param username: 对方wxid
@@ -154,11 +154,10 @@ class PadChatAPIMixin:
         data = {
             'userId': username
         }
-        result = yield self.send('searchContact', self.cmd_id, data=data)
+        result = await self.send('searchContact', self.cmd_id, data=data)
         return result
 
-    @gen.coroutine
-    def accept_user(self, stranger: str, ticket: str):
+    async def accept_user(self, stranger: str, ticket: str):
         '''
         通过好友请求
         :param stranger: 用户stranger数据
@@ -169,11 +168,10 @@ class PadChatAPIMixin:
             'stranger': stranger,
             'ticket': ticket,
         }
-        result = yield self.send('acceptUser', self.cmd_id, data=data)
+        result = await self.send('acceptUser', self.cmd_id, data=data)
         return result
 
-    @gen.coroutine
-    def add_contact(self, stranger: str, ticket: str, type=3, content=""):
+    async def add_contact(self, stranger: str, ticket: str, type=3, content=""):
         '''
         主动添加好友
         :param stranger: 用户stranger数据
@@ -188,11 +186,10 @@ class PadChatAPIMixin:
             'type': type,
             'content': content,
         }
-        result = yield self.send('addContact', self.cmd_id, data=data)
+        result = await self.send('addContact', self.cmd_id, data=data)
         return result
 
-    @gen.coroutine
-    def say_hello(self, stranger: str, ticket: str, content: str):
+    async def say_hello(self, stranger: str, ticket: str, content: str):
         '''
         打招呼
         :param stranger: 用户stranger数据
@@ -205,11 +202,10 @@ class PadChatAPIMixin:
             'ticket': ticket,
             'content': content,
         }
-        result = yield self.send('sayHello', self.cmd_id, data=data)
+        result = await self.send('sayHello', self.cmd_id, data=data)
         return result
 
-    @gen.coroutine
-    def delete_contact(self, username: str):
+    async def delete_contact(self, username: str):
         '''
         删除好友
         :param username: 用户wxid
@@ -218,11 +214,12 @@ class PadChatAPIMixin:
         data = {
             'userId': username
         }
-        result = yield self.send('deleteContact', self.cmd_id, data=data)
+        result = await self.send('deleteContact', self.cmd_id, data=data)
+        if result.get('success') is True:
+            self.directory.remove_contact(username)
         return result
 
-    @gen.coroutine
-    def set_remark(self, username: str, remark: str):
+    async def set_remark(self, username: str, remark: str):
         '''
         设置好友备注
         :param username: 用户wxid
@@ -233,36 +230,33 @@ class PadChatAPIMixin:
             'userId': username,
             'remark': remark
         }
-        result = yield self.send('setRemark', self.cmd_id, data=data)
+        result = await self.send('setRemark', self.cmd_id, data=data)
+        if result.get('success') is True:
+            self.directory.set_remark(username, remark)
         return result
 
-    @gen.coroutine
-    def set_head_img(self, file: Union[io.FileIO, str]):
+    async def set_head_img(self, file: Union[io.FileIO, bytes, str, Media]):
         '''
         设置头像
-        :param file: 二进制文件或base64字符串
+        :param file: 文件路径、二进制文件、bytes或base64字符串
         :param callback: 
         :return: 
         '''
-        if hasattr(file, 'read'):
-            file = base64.encodebytes(file.read()).decode()
-        data = {
-            'file': file,
-        }
-        result = yield self.send('setHeadImg', self.cmd_id, data=data)
+        # 编码结果只放在指令数据中，发送后即释放
+        result = await self.send('setHeadImg', self.cmd_id, data={
+            'file': encode_media(file, self.upload_cache),
+        })
         return result
 
-    @gen.coroutine
-    def sync_msg(self):
+    async def sync_msg(self):
         '''
         主动同步消息
         :return: 
         '''
-        result = yield self.send('syncMsg', self.cmd_id)
+        result = await self.send('syncMsg', self.cmd_id)
         return result
 
-    @gen.coroutine
-    def sync_contact(self, reset=False):
+    async def sync_contact(self, reset=False):
         '''
         同步通讯录
         :param reset: 若设置为true，会重置同步状态
@@ -271,11 +265,37 @@ class PadChatAPIMixin:
         data = {
             'reset': bool(reset)
         }
-        result = yield self.send('syncContact', self.cmd_id, data=data)
+        result = await self.send('syncContact', self.cmd_id, data=data)
         return result
 
-    @gen.coroutine
-    def get_user_qrcode(self, username=None, style=0):
+    def sync_contacts_stream(self, reset=None, batch_size=200, sink=None,
+                             progress=None, idle_timeout=60):
+        '''
+        流式同步通讯录，迭代返回每批联系人
+        :param reset: 是否全量同步，None为sink未完成过同步时全量，之后增量
+        :param batch_size: 每批联系人数量
+        :param sink: 联系人写入位置MemorySink、SQLiteSink，默认为本地通讯录
+        :param progress: 每批写入后的回调 progress(stream)
+        :param idle_timeout: 多少秒没有收到联系人视为同步失败
+        :return: ContactStream
+
+        eg.
+            async for batch in self.sync_contacts_stream():
+                ...
+        '''
+        return ContactStream(self, reset=reset, batch_size=batch_size,
+                             sink=sink, progress=progress,
+                             idle_timeout=idle_timeout)
+
+    async def iter_contacts(self, **kwargs):
+        '''
+        流式同步通讯录，逐个返回联系人，参数同sync_contacts_stream
+        '''
+        async for batch in self.sync_contacts_stream(**kwargs):
+            for contact in batch:
+                yield contact
+
+    async def get_user_qrcode(self, username=None, style=0):
         '''
         获取个人二维码(仅限自己)
         :param username: 用户wxid
@@ -286,21 +306,19 @@ class PadChatAPIMixin:
             'userId': username or self.user.wx_id,
             'style': style,
         }
-        result = yield self.send('getUserQrcode', self.cmd_id, data=data)
+        result = await self.send('getUserQrcode', self.cmd_id, data=data)
         return result
 
-    @gen.coroutine
-    def get_my_info(self):
+    async def get_my_info(self):
         '''
         获取个人资料
         :return: 
         '''
-        result = yield self.send('getMyInfo', self.cmd_id)
+        result = await self.send('getMyInfo', self.cmd_id)
         return result
 
     # 群管理 接口 ###############################################################
-    @gen.coroutine
-    def create_room(self, user_list: list):
+    async def create_room(self, user_list: list):
         '''
         创建群
         备注：必须多于2个人（含2个），才会建群成功
@@ -310,24 +328,30 @@ class PadChatAPIMixin:
         data = {
             'userList': user_list
         }
-        result = yield self.send('createRoom', self.cmd_id, data=data)
+        result = await self.send('createRoom', self.cmd_id, data=data)
         return result
 
-    @gen.coroutine
-    def get_room_members(self, group_id: str):
+    async def get_room_members(self, group_id: str, refresh=False):
         '''
-        获取群成员
+        获取群成员，优先从本地通讯录获取
         :param group_id: 群id
+        :param refresh: 为True时忽略本地通讯录，从服务器获取
         :return: 
         '''
+        if not refresh:
+            members = self.directory.room_members(group_id)
+            if members is not None:
+                return {'success': True, 'data': members}
         data = {
             'groupId': group_id
         }
-        result = yield self.send('getRoomMembers', self.cmd_id, data=data)
+        result = await self.send('getRoomMembers', self.cmd_id, data=data)
+        if result.get('success') is True and \
+                isinstance(result.get('data'), dict):
+            self.directory.update_room_members(group_id, result['data'])
         return result
 
-    @gen.coroutine
-    def add_room_member(self, group_id: str, username: str):
+    async def add_room_member(self, group_id: str, username: str):
         '''
         添加群成员
         :param group_id: 群id
@@ -338,11 +362,11 @@ class PadChatAPIMixin:
             'groupId': group_id,
             'userId': username,
         }
-        result = yield self.send('addRoomMember', self.cmd_id, data=data)
+        result = await self.send('addRoomMember', self.cmd_id, data=data)
+        self.directory.invalidate(group_id)
         return result
 
-    @gen.coroutine
-    def invite_room_member(self, group_id: str, username: str):
+    async def invite_room_member(self, group_id: str, username: str):
         '''
         邀请群成员
         :param group_id: 群id
@@ -353,11 +377,11 @@ class PadChatAPIMixin:
             'groupId': group_id,
             'userId': username,
         }
-        result = yield self.send('inviteRoomMember', self.cmd_id, data=data)
-        return  result
+        result = await self.send('inviteRoomMember', self.cmd_id, data=data)
+        self.directory.invalidate(group_id)
+        return result
 
-    @gen.coroutine
-    def delete_room_member(self, group_id: str, username: str):
+    async def delete_room_member(self, group_id: str, username: str):
         '''
         删除群成员
         :param group_id: 群id
@@ -368,11 +392,11 @@ class PadChatAPIMixin:
             'groupId': group_id,
             'userId': username,
         }
-        result = yield self.send('deleteRoomMember', self.cmd_id, data=data)
+        result = await self.send('deleteRoomMember', self.cmd_id, data=data)
+        self.directory.invalidate(group_id)
         return result
 
-    @gen.coroutine
-    def quit_room(self, group_id: str):
+    async def quit_room(self, group_id: str):
         '''
         退群
         :param group_id: 群id
@@ -381,11 +405,12 @@ class PadChatAPIMixin:
         data = {
             'groupId': group_id
         }
-        result = yield self.send('quitRoom', self.cmd_id, data=data)
+        result = await self.send('quitRoom', self.cmd_id, data=data)
+        if result.get('success') is True:
+            self.directory.remove_contact(group_id)
         return result
 
-    @gen.coroutine
-    def set_room_announcement(self, group_id: str, content: str):
+    async def set_room_announcement(self, group_id: str, content: str):
         '''
         设置群公告
         :param group_id: 群id
@@ -396,11 +421,10 @@ class PadChatAPIMixin:
             'groupId': group_id,
             'content': content
         }
-        result = yield self.send('setRoomAnnouncement', self.cmd_id, data=data)
+        result = await self.send('setRoomAnnouncement', self.cmd_id, data=data)
         return result
 
-    @gen.coroutine
-    def set_room_name(self, group_id: str, content: str):
+    async def set_room_name(self, group_id: str, content: str):
         '''
         设置群名称
         :param groupd_id: 群id
@@ -411,11 +435,11 @@ class PadChatAPIMixin:
             'groupId': group_id,
             'content': content
         }
-        result = yield self.send('setRoomName', self.cmd_id, data=data)
+        result = await self.send('setRoomName', self.cmd_id, data=data)
+        self.directory.invalidate(group_id)
         return result
 
-    @gen.coroutine
-    def get_room_qrcode(self, group_id: str):
+    async def get_room_qrcode(self, group_id: str):
         '''
         获取群二维码
         :param group_id: 群id
@@ -424,12 +448,11 @@ class PadChatAPIMixin:
         data = {
             'groupId': group_id
         }
-        result = yield self.send('getRoomQrcode', self.cmd_id, data=data)
+        result = await self.send('getRoomQrcode', self.cmd_id, data=data)
         return result
 
     # 消息 接口 #################################################################
-    @gen.coroutine
-    def send_msg(self, to_user_name: str, content: str, at_list: list=None):
+    async def send_msg(self, to_user_name: str, content: str, at_list: list=None):
         '''
         发送消息
         :param to_user_name: 接收者wx_id，可个人，可群组
@@ -443,12 +466,11 @@ class PadChatAPIMixin:
         }
         if at_list:
             context.update({'atList': at_list})
-        result = yield self.send('sendMsg', self.cmd_id, data=context)
+        result = await self.send('sendMsg', self.cmd_id, data=context)
         return result
 
-    @gen.coroutine
-    def send_app_msg(self, username: str, title: str, des: str, url: str,
-                   thumburl: str, appid=None, sdkver=None):
+    async def send_app_msg(self, username: str, title: str, des: str, url: str,
+                         thumburl: str, appid=None, sdkver=None):
         '''
         发送App消息
         :param username: 接收者wxid
@@ -472,48 +494,41 @@ class PadChatAPIMixin:
             'toUserName': username,
             'content': send_app_msg_xml_template(context),
         }
-        result = yield self.send('sendAppMsg', self.cmd_id, data=data)
+        result = await self.send('sendAppMsg', self.cmd_id, data=data)
         return result
 
-    @gen.coroutine
-    def send_image(self, username: str, file: Union[io.FileIO, str]):
+    async def send_image(self, username: str,
+                         file: Union[io.FileIO, bytes, str, Media]):
         '''
         发送图片
         :param username: 接收者wxid
-        :param file: 二进制文件或base64字符串
+        :param file: 文件路径、二进制文件、bytes或base64字符串
         :return: 
         '''
-        if hasattr(file, 'read'):
-            file = base64.encodebytes(file.read()).decode()
-        data = {
+        result = await self.send('sendImage', self.cmd_id, data={
             'toUserName': username,
-            'file': file
-        }
-        result = yield self.send('sendImage', self.cmd_id, data=data)
+            'file': encode_media(file, self.upload_cache),
+        })
         return result
 
-    @gen.coroutine
-    def send_voice(self, username: str, file: Union[io.FileIO, str], time: int):
+    async def send_voice(self, username: str,
+                         file: Union[io.FileIO, bytes, str, Media], time: int):
         '''
         发送语音
         :param username: 接收者id
-        :param file: 二进制文件或base64字符串，silk格式的语音文件
+        :param file: 文件路径、二进制文件、bytes或base64字符串，silk格式的语音文件
         :param time: 语音时长，毫秒单位
         :param callback: 
         :return: 
         '''
-        if hasattr(file, 'read'):
-            file = base64.encodebytes(file.read()).decode()
-        data = {
+        result = await self.send('sendVoice', self.cmd_id, data={
             'toUserName': username,
-            'file': file,
+            'file': encode_media(file, self.upload_cache),
             'time': time,
-        }
-        result = yield self.send('sendVoice', self.cmd_id, data=data)
+        })
         return result
 
-    @gen.coroutine
-    def share_card(self, username: str, content: str, user_id: str):
+    async def share_card(self, username: str, content: str, user_id: str):
         '''
         分享名片
         :param username: 接收者id
@@ -526,49 +541,78 @@ class PadChatAPIMixin:
             'content': content,
             'userId': user_id
         }
-        result = yield self.send('shareCard', self.cmd_id, data=data)
+        result = await self.send('shareCard', self.cmd_id, data=data)
         return result
 
     # 获取图片、文件接口 #########################################################
-    @gen.coroutine
-    def get_msg_image(self, raw_data):
+    async def get_msg_image(self, raw_data):
         '''
-        获取图片
+        获取图片，返回服务器的base64数据，不经过缓存；需要本地文件时使用
+        download_msg_image
         :param raw_data: 拿到的push数据，就是raw_data，不用做任何处理
         :return: 
         '''
         if 'rawMsgData' not in raw_data:
             raw_data = {'rawMsgData': raw_data}
-        result = yield self.send('getMsgImage', self.cmd_id, data=raw_data)
+        result = await self.send('getMsgImage', self.cmd_id, data=raw_data)
         return result
 
-    @gen.coroutine
-    def get_msg_video(self, raw_data):
+    async def get_msg_video(self, raw_data):
         '''
-        获取视频
+        获取视频，返回服务器的base64数据，不经过缓存；需要本地文件时使用
+        download_msg_video
         :param raw_data: 拿到的push数据，就是raw_data，不用做任何处理
         :return: 
         '''
         if 'rawMsgData' not in raw_data:
             raw_data = {'rawMsgData': raw_data}
-        result = yield self.send('getMsgVideo', self.cmd_id, data=raw_data)
+        result = await self.send('getMsgVideo', self.cmd_id, data=raw_data)
         return result
 
-    @gen.coroutine
-    def get_msg_voice(self, raw_data):
+    async def get_msg_voice(self, raw_data):
         '''
-        获取音频
+        获取音频，返回服务器的base64数据，不经过缓存；需要本地文件时使用
+        download_msg_voice
         :param raw_data: 拿到的push数据，就是raw_data，不用做任何处理
         :return: 
         '''
         if 'rawMsgData' not in raw_data:
             raw_data = {'rawMsgData': raw_data}
-        result = yield self.send('getMsgVoice', self.cmd_id, data=raw_data)
+        result = await self.send('getMsgVoice', self.cmd_id, data=raw_data)
         return result
 
+    async def download_msg_image(self, raw_data):
+        '''
+        下载图片到本地缓存，相同图片只下载一次
+        :param raw_data: 拿到的push数据，就是raw_data，不用做任何处理
+        :return: 图片文件路径，下载失败返回None
+        '''
+        path = await self.media_cache.fetch('image', raw_data,
+                                            self.get_msg_image)
+        return path
+
+    async def download_msg_video(self, raw_data):
+        '''
+        下载视频到本地缓存，相同视频只下载一次
+        :param raw_data: 拿到的push数据，就是raw_data，不用做任何处理
+        :return: 视频文件路径，下载失败返回None
+        '''
+        path = await self.media_cache.fetch('video', raw_data,
+                                            self.get_msg_video)
+        return path
+
+    async def download_msg_voice(self, raw_data):
+        '''
+        下载语音到本地缓存
+        :param raw_data: 拿到的push数据，就是raw_data，不用做任何处理
+        :return: silk语音文件路径，下载失败返回None
+        '''
+        path = await self.media_cache.fetch('voice', raw_data,
+                                            self.get_msg_voice)
+        return path
+
     # 转账 接口 #################################################################
-    @gen.coroutine
-    def query_transfer(self, raw_data):
+    async def query_transfer(self, raw_data):
         '''
         查看转账消息
         :param raw_data: 拿到的push数据，就是raw_data，不用做任何处理
@@ -577,11 +621,10 @@ class PadChatAPIMixin:
         raise DeprecationWarning('this method has deprecation')
         if 'rawMsgData' not in raw_data:
             raw_data = {'rawMsgData': raw_data}
-        result = yield self.send('queryTransfer', self.cmd_id, data=raw_data)
+        result = await self.send('queryTransfer', self.cmd_id, data=raw_data)
         return result
 
-    @gen.coroutine
-    def accept_transfer(self, raw_data):
+    async def accept_transfer(self, raw_data):
         '''
         接受转账
         :param raw_data: 拿到的push msg消息，就是raw_data，不用做任何处理
@@ -590,12 +633,11 @@ class PadChatAPIMixin:
         raise DeprecationWarning('this method has deprecation')
         if 'rawMsgData' not in raw_data:
             raw_data = {'rawMsgData': raw_data}
-        result = yield self.send('acceptTransfer', self.cmd_id, data=raw_data)
+        result = await self.send('acceptTransfer', self.cmd_id, data=raw_data)
         return result
 
     # 红包 接口 #################################################################
-    @gen.coroutine
-    def receive_red_packet(self, raw_data):
+    async def receive_red_packet(self, raw_data):
         '''
         接收红包
         该接口并未正式领取红包，但领取红包前必须调用该函数，然后在该指令的回调函数中，或稍后
@@ -606,11 +648,10 @@ class PadChatAPIMixin:
         '''
         if 'rawMsgData' not in raw_data:
             raw_data = {'rawMsgData': raw_data}
-        result = yield self.send('receiveRedPacket', self.cmd_id, data=raw_data)
+        result = await self.send('receiveRedPacket', self.cmd_id, data=raw_data)
         return result
 
-    @gen.coroutine
-    def open_red_packet(self, raw_data, key):
+    async def open_red_packet(self, raw_data, key):
         '''
         领取红包
         :param raw_data: 拿到的push数据，就是raw_data，不用做任何处理
@@ -622,11 +663,10 @@ class PadChatAPIMixin:
                 'rawMsgData': raw_data,
             }
         raw_data.update({'key': key})
-        result = yield self.send('openRedPacket', self.cmd_id, data=raw_data)
+        result = await self.send('openRedPacket', self.cmd_id, data=raw_data)
         return result
 
-    @gen.coroutine
-    def query_red_packet(self, raw_data, key):
+    async def query_red_packet(self, raw_data, key):
         '''
         查看红包信息
         :param raw_data: 拿到的push数据，就是raw_data，不用做任何处理
@@ -635,6 +675,6 @@ class PadChatAPIMixin:
         '''
         if 'rawMsgData' not in raw_data:
             raw_data = {'rawMsgData': raw_data}
-        result = yield self.send('queryRedPacket', self.cmd_id, data=raw_data)
+        result = await self.send('queryRedPacket', self.cmd_id, data=raw_data)
         return result
 
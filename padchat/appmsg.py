@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+from xml.etree import ElementTree
+from xml.parsers import expat
+
+
+class _Found(Exception):
+    pass
+
+
+def app_msg_type(content: str):
+    '''
+    读取app消息的<appmsg><type>，读到后立即停止解析
+    :param content: app消息xml，群消息需先去除发送者前缀
+    :return: 类型字符串，如'2000'转账、'2001'红包、'5'收款，解析失败返回None
+    '''
+    path = []
+    text = []
+
+    def start(name, attrs):
+        path.append(name)
+
+    def end(name):
+        if name == 'type' and len(path) >= 2 and path[-2] == 'appmsg':
+            raise _Found(''.join(text).strip())
+        path.pop()
+
+    def data(value):
+        if len(path) >= 2 and path[-1] == 'type' and path[-2] == 'appmsg':
+            text.append(value)
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.CharacterDataHandler = data
+    try:
+        parser.Parse(content, True)
+    except _Found as found:
+        return found.args[0]
+    except expat.ExpatError:
+        return None
+    return None
+
+
+class AppMsg:
+    '''
+    app消息，type按需流式读取，其他字段在首次访问时解析
+    '''
+    __slots__ = ('content', '_type', '_element')
+
+    def __init__(self, content: str):
+        self.content = content
+        self._type = False
+        self._element = False
+
+    @property
+    def type(self):
+        if self._type is False:
+            self._type = app_msg_type(self.content)
+        return self._type
+
+    @property
+    def element(self):
+        '''
+        <appmsg>节点，解析失败返回None
+        '''
+        if self._element is False:
+            try:
+                root = ElementTree.fromstring(self.content)
+            except ElementTree.ParseError:
+                root = None
+            if root is not None and root.tag != 'appmsg':
+                root = root.find('appmsg')
+            self._element = root
+        return self._element
+
+    def get(self, path, default=None):
+        '''
+        读取<appmsg>下的字段
+        :param path: 字段路径，如'title'、'wcpayinfo/feedesc'
+        '''
+        element = self.element
+        if element is None:
+            return default
+        value = element.findtext(path)
+        return default if value is None else value
+
+    @property
+    def title(self):
+        return self.get('title')
+
+    @property
+    def des(self):
+        return self.get('des')
+
+    @property
+    def url(self):
+        return self.get('url')
+
+    @property
+    def appid(self):
+        element = self.element
+        return element.get('appid') if element is not None else None
+
+    def __repr__(self):
+        return '<AppMsg type={}>'.format(self.type)
@@ -1,17 +1,28 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*- 
 # Author: Ben Chen
-from tornado import gen
+import asyncio
+import time
+
 from tornado import httpclient
 from tornado import httputil
-from tornado import ioloop
 from tornado import websocket
-from tornado.concurrent import Future
-
-import json
 
+from .cache import MediaCache
+from .codec import default_codec
+from .command import CommandRouter
+from .dedup import MessageDeduplicator
+from .directory import ContactDirectory
+from .dispatch import HandlerRegistry
+from .exceptions import ConnectionClosed, RequestTimeout
+from .executor import HandlerExecutors, LoopProxy
+from .media import UploadCache
+from .metrics import ClientMetrics, default_registry
+from .reconnect import ReconnectPolicy
+from .request import MsgQueue
+from .scheduler import SendScheduler
 from .user import UserProfile
-from .logger import logger
+from .logger import logger, WireLog
 
 
 
@@ -20,19 +31,33 @@ APPLICATION_JSON = 'application/json'
 DEFAULT_CONNECT_TIMEOUT = 60
 DEFAULT_REQUEST_TIMEOUT = 60
 
+# 指令回应超时，秒
+DEFAULT_CMD_TIMEOUT = 60
+CMD_TIMEOUTS = {
+    'sendImage': 120,
+    'sendVoice': 120,
+    'setHeadImg': 120,
+    'getMsgImage': 120,
+    'getMsgVoice': 120,
+    'getMsgVideo': 300,
+}
 
-class PadchatSocketProtocol13(websocket.WebSocketProtocol13):
-    pass
 
-
-class PadchatSocketClientConnection(websocket.WebSocketClientConnection):
-    def get_websocket_protocol(self):
-        return PadchatSocketProtocol13(self, mask_outgoing=True,
-                                   compression_options=self.compression_options)
+def _current_task():
+    try:
+        return asyncio.current_task()
+    except AttributeError:
+        # python < 3.7
+        return asyncio.Task.current_task()
+    except RuntimeError:
+        return None
 
 
 class WebSocketClient:
     """Base for web socket clients.
+
+    Runs on the current asyncio event loop (uvloop included), tornado is
+    only used as the websocket transport.
     """
 
     def __init__(self, *, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
@@ -43,45 +68,90 @@ class WebSocketClient:
         self.ping_interval = ping_interval
 
         self._url = None
-
-        def periodic_ping(_self):
-            super(PadchatSocketProtocol13, _self).periodic_ping()
-            self._ping()
-        PadchatSocketProtocol13.periodic_ping = periodic_ping
+        self._ws_connection = None
+        self._tasks = set()
+        self._heartbeat_task = None
+        # 主动断开后不再重连
+        self._closing = False
+        self._connected = False
 
     def run(self):
-        ioloop.IOLoop.instance().start()
+        asyncio.get_event_loop().run_forever()
+
+    def spawn(self, coro):
+        """Run a coroutine in the background, errors are logged.
+        :return: asyncio.Task
+        """
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+        return task
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('后台任务出错', exc_info=task.exception())
 
     def connect(self, url):
         """Connect to the server.
         :param str url: server URL.
         """
         self._url = url
-        self._connect()
+        self._closing = False
+        return self.spawn(self._connect())
 
-    def _connect(self):
+    def disconnect(self):
+        """Close the connection without reconnecting and cancel background
+        tasks.
+        """
+        self._closing = True
+        if self._ws_connection is not None:
+            self._ws_connection.close()
+        # 读取任务会被取消，在此执行断线处理
+        self._closed()
+        current = _current_task()
+        for task in list(self._tasks):
+            if task is not current:
+                task.cancel()
+
+    async def _connect(self):
 
         headers = httputil.HTTPHeaders({'Content-Type': APPLICATION_JSON})
         request = httpclient.HTTPRequest(url=self._url,
                                          connect_timeout=self.connect_timeout,
                                          request_timeout=self.request_timeout,
                                          headers=headers)
-        ws_conn = PadchatSocketClientConnection(request,
-                                                ping_interval=self.ping_interval)
-        self._ws_connection = ws_conn
-        ws_conn.connect_future.add_done_callback(self._connect_callback)
+        # 仅使用tornado的公开接口，兼容tornado 5及以上版本
+        try:
+            self._ws_connection = await websocket.websocket_connect(
+                request, ping_interval=self.ping_interval)
+        except Exception as e:
+            self._on_connection_error(e)
+            return
+        self._connected = True
+        if self.ping_interval:
+            self._heartbeat_task = self.spawn(self._heartbeat())
+        self._on_connection_success()
+        await self._read_messages()
+
+    async def _heartbeat(self):
+        # websocket的ping帧由tornado发送，此处为客户端自身的心跳回调
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            self._ping()
 
     def _ping(self):
         pass
 
     def send(self, data):
         """Send message to the server
-        :param str data: message.
+        :param data: message, str or utf-8 encoded bytes.
+        :return: Future resolved once the frame is written to the socket.
         """
         if not self._ws_connection:
             raise RuntimeError('Web socket connection is closed.')
 
-        self._ws_connection.write_message(data)
+        return self._ws_connection.write_message(data)
 
     def close(self):
         """Close connection.
@@ -92,34 +162,29 @@ class WebSocketClient:
 
         self._ws_connection.close()
 
-    def _connect_callback(self, future):
-        if future.exception() is None:
-            self._ws_connection = future.result()
-            self._on_connection_success()
-            self._read_messages()
-        else:
-            self._on_connection_error(future.exception())
-
-    @gen.coroutine
-    def _read_messages(self):
+    async def _read_messages(self):
         while True:
-            msg = yield self._ws_connection.read_message(
-                callback=self.__on_message)
+            msg = await self._ws_connection.read_message()
             if msg is None:
-                self._on_connection_close()
+                self._closed()
                 break
-
-            # self._on_message(msg)
-
-    @gen.coroutine
-    def __on_message(self, future):
-        msg = future.result()
-        if msg is not None:
-            self._on_message(msg)
+            try:
+                self._on_message(msg)
+            except Exception:
+                logger.error('处理消息出错', exc_info=True)
+
+    def _closed(self):
+        # 读取结束或主动断开，只处理一次
+        if self._connected:
+            self._connected = False
+            if self._heartbeat_task is not None:
+                self._heartbeat_task.cancel()
+                self._heartbeat_task = None
+            self._on_connection_close()
 
     def _on_message(self, msg):
         """This is called when new message is available from the server.
-        :param str msg: server message.
+        :param msg: server message, str for text frames.
         """
         pass
 
@@ -141,7 +206,29 @@ class WebSocketClient:
 
 
 class BasePadchatClient(WebSocketClient):
-    def __init__(self, user=None, wx_data=None, token=None, *args, **kwargs):
+    def __init__(self, user=None, wx_data=None, token=None, *args,
+                 cmd_timeout=DEFAULT_CMD_TIMEOUT, cmd_timeouts=None,
+                 max_inflight=None, scheduler=None, media_cache=None,
+                 upload_cache=None, directory=None, codec=None,
+                 wire_log=None, executors=None, reconnect=None, metrics=None,
+                 dedup=None, journal=None, outbox=None, **kwargs):
+        '''
+        :param cmd_timeout: 指令回应默认超时秒数，None为不超时
+        :param cmd_timeouts: 按指令设置的超时秒数，覆盖CMD_TIMEOUTS
+        :param max_inflight: 最大同时等待回应的指令数量，None为不限制
+        :param scheduler: 发送调度器SendScheduler，默认不限速
+        :param media_cache: 媒体下载缓存MediaCache，默认在首次下载时创建
+        :param upload_cache: 媒体上传编码缓存UploadCache，默认仅缓存在内存
+        :param directory: 本地通讯录ContactDirectory
+        :param codec: json编解码JSONCodec，默认选择已安装的最快实现
+        :param wire_log: 收发指令日志WireLog，默认截断内容并隐藏base64数据
+        :param executors: 处理函数执行器HandlerExecutors，可在多个客户端间共用
+        :param reconnect: 断线重连策略ReconnectPolicy
+        :param metrics: 指标注册表MetricsRegistry，默认为进程内共用的注册表
+        :param dedup: 推送消息去重MessageDeduplicator，默认仅在内存中记录
+        :param journal: 推送消息日志PushJournal，默认不记录
+        :param outbox: 发件箱Outbox，未登录时指令排队，默认不排队直接失败
+        '''
         super().__init__(*args, **kwargs)
 
         # 微信实例变量
@@ -154,7 +241,43 @@ class BasePadchatClient(WebSocketClient):
         self.user = user
 
         # 消息回调队列
-        self._msg_queue = {}
+        self._msg_queue = MsgQueue(timeout=cmd_timeout,
+                                   max_inflight=max_inflight)
+        self._cmd_timeouts = dict(CMD_TIMEOUTS, **(cmd_timeouts or {}))
+        # 发送调度
+        self._scheduler = scheduler or SendScheduler()
+        # 媒体下载缓存
+        self._media_cache = media_cache
+        # 媒体上传编码缓存
+        self.upload_cache = upload_cache or UploadCache()
+        # 本地通讯录
+        self.directory = directory or ContactDirectory()
+        # 进行中的流式通讯录同步
+        self._contact_streams = set()
+        # json编解码
+        self.codec = codec or default_codec()
+        # 收发指令日志
+        self.wire_log = wire_log or WireLog()
+        # 事件处理函数注册表
+        self.handlers = HandlerRegistry()
+        # 文字命令路由
+        self.commands = CommandRouter()
+        # 处理函数线程池、进程池
+        self.executors = executors or HandlerExecutors()
+        self._proxy = None
+        # 断线重连
+        self.reconnect = reconnect or ReconnectPolicy()
+        # 推送消息去重
+        self.dedup = dedup or MessageDeduplicator()
+        # 推送消息日志
+        self.journal = journal
+        # 发件箱
+        self.outbox = outbox
+        # 指标
+        self.metrics = metrics or default_registry
+        self._metrics = ClientMetrics(
+            self.metrics, self.user.wx_id if self.user else str(id(self)))
+        self.metrics.add_collector(self._collect_metrics)
 
         # 状态变量
         self._init = False
@@ -162,6 +285,21 @@ class BasePadchatClient(WebSocketClient):
         self._is_scan_tip = False
         self._alive = False
 
+    @property
+    def media_cache(self):
+        if self._media_cache is None:
+            self._media_cache = MediaCache()
+        return self._media_cache
+
+    @property
+    def proxy(self):
+        '''
+        线程安全的客户端代理，在线程池处理函数中调用接口
+        '''
+        if self._proxy is None:
+            self._proxy = LoopProxy(self)
+        return self._proxy
+
     @property
     def cmd_id(self):
         # 自增长命令ID，用于标记每一条指令发送的唯一ID，在回调中根据命令ID返回对应事件
@@ -169,12 +307,46 @@ class BasePadchatClient(WebSocketClient):
         return str(self._cmd_id)
 
     def _on_connection_success(self):
+        reconnects = self.reconnect.reconnects
+        self.reconnect.connected()
+        if self.reconnect.reconnects != reconnects:
+            self._metrics.reconnects.inc()
+            self._metrics.reconnect_time.observe(
+                self.reconnect.last_reconnect_time)
         logger.info('连接Padchat服务器成功……')
 
+    def _collect_metrics(self):
+        account = {'account': self._metrics.account}
+        for lane, depth in self._scheduler.stats()['depth'].items():
+            yield ('padchat_send_queue_depth', '发送排队数量',
+                   dict(account, lane=lane), depth)
+        yield ('padchat_reconnect_failures', '连续重连失败次数', account,
+               self.reconnect.failures)
+        yield ('padchat_alive', '是否已登录', account, int(bool(self._alive)))
+        # 缓存、执行器可能被多个客户端共用，附带对象由注册表去重
+        caches = [('upload', self.upload_cache)]
+        if self._media_cache is not None:
+            caches.append(('media', self._media_cache))
+        for name, cache in caches:
+            stats = cache.stats()
+            for key in ('size', 'hits', 'misses'):
+                yield ('padchat_cache_' + key, '缓存' + key,
+                       dict(account, cache=name), stats[key], cache)
+        for policy, stats in self.executors.stats().items():
+            yield ('padchat_executor_pending', '处理函数排队数量',
+                   dict(account, policy=policy), stats['pending'],
+                   self.executors)
+        if self.outbox is not None:
+            yield ('padchat_outbox_size', '发件箱排队数量', account,
+                   len(self.outbox))
+
     def _on_message(self, raw_msg):
-        msg = json.loads(raw_msg)
-        logger.info(msg)
+        msg = self.codec.loads(raw_msg)
+        self.wire_log.inbound(msg, raw_msg)
         msg_type = msg.get('type')
+        kind = msg.get('event') or msg_type
+        self._metrics.frames.inc(kind)
+        self._metrics.bytes.inc(kind, amount=len(raw_msg))
         if msg_type == 'cmdRet':
             self.cmd_msg_callback_route(msg)
         elif msg_type == 'userEvent':
@@ -185,13 +357,41 @@ class BasePadchatClient(WebSocketClient):
 
     def _on_connection_close(self):
         logger.info('与Padchat服务器连接已中断')
-        logger.info('重新连接Padchat服务器……')
-        self._connect()
+        self._init = False
+        self._alive = False
+        self._fail_msg_queue()
+        for stream in list(self._contact_streams):
+            stream.fail(ConnectionClosed('Padchat server connection closed'))
+        self.dedup.save()
+        if self.journal is not None:
+            self.journal.sync_soon()
+        if self._closing:
+            return
+        self.reconnect.disconnected()
+        self._schedule_reconnect()
 
     def _on_connection_error(self, exception):
-        logger.error('异常出错', exc_info=True)
-        logger.info('重新连接Padchat服务器……')
-        self._connect()
+        logger.error('连接Padchat服务器失败: {}'.format(exception))
+        self._fail_msg_queue()
+        if self._closing:
+            return
+        self.reconnect.failure()
+        self._schedule_reconnect()
+
+    def _schedule_reconnect(self):
+        delay = self.reconnect.next_delay()
+        logger.info('{:.1f}秒后重新连接Padchat服务器……'.format(delay))
+        self.spawn(self._reconnect(delay))
+
+    async def _reconnect(self, delay):
+        await asyncio.sleep(delay)
+        await self._connect()
+
+    def _fail_msg_queue(self):
+        count = self._msg_queue.fail_all(
+            ConnectionClosed('Padchat server connection closed'))
+        if count:
+            logger.warning('连接中断，{}条指令未收到回应'.format(count))
 
     def _ping(self):
         if self._alive:
@@ -210,18 +410,53 @@ class BasePadchatClient(WebSocketClient):
         payload = msg.get('payload')
 
         msg_task = self.pop_msg_queue(cmd_id)
-        _future = msg_task.get('future')
-        if _future:
-            _future.set_result(payload)
+        if msg_task is None:
+            logger.warning('未知或已超时的指令回应: cmd id: {}'.format(cmd_id))
+            return
+        self._metrics.latency.observe(time.monotonic() - msg_task.start,
+                                      msg_task.cmd)
+        if not msg_task.future.done():
+            msg_task.future.set_result(payload)
+        if msg_task.cmd == 'syncContact':
+            # 之后的loaded事件属于本次同步
+            for stream in list(self._contact_streams):
+                stream.answered(payload)
 
     def event_msg_route(self, msg):
         raise NotImplementedError
 
-    @gen.coroutine
-    def send(self, cmd: str, cmd_id, type='user', authkey=None, data=None):
+    async def send(self, cmd: str, cmd_id, type='user', authkey=None, data=None,
+                   timeout=None, priority=None):
+        '''
+        发送指令，设置了发件箱时未登录的指令在发件箱排队
+        :param timeout: 回应超时秒数，默认按指令取cmd_timeouts或cmd_timeout
+        :param priority: 发送优先级Priority，默认按指令取
         '''
-        发送指令
+        outbox = self.outbox
+        if outbox is None or outbox.bypass(cmd):
+            return await self._send(cmd, cmd_id, type, data, timeout, priority)
+        if not self._alive or outbox.busy:
+            return await outbox.put(cmd, type, data, timeout, priority)
+        try:
+            return await self._send(cmd, cmd_id, type, data, timeout, priority)
+        except ConnectionClosed:
+            if cmd not in outbox.idempotent:
+                raise
+            return await outbox.retry(cmd, type, data, timeout, priority)
+
+    async def _send_queued(self, cmd, type, data, timeout, priority):
+        return await self._send(cmd, self.cmd_id, type, data, timeout,
+                                priority)
+
+    def flush_outbox(self):
         '''
+        登录后发送发件箱中排队的指令
+        '''
+        if self.outbox is not None and self.outbox.busy:
+            self.spawn(self.outbox.flush(self._send_queued,
+                                         lambda: self._alive))
+
+    async def _send(self, cmd, cmd_id, type, data, timeout, priority):
         payload = {
             'cmd': cmd,
             'type': type,
@@ -233,26 +468,71 @@ class BasePadchatClient(WebSocketClient):
         else:
             payload['payload'] = {}
 
-        content = json.dumps(payload, ensure_ascii=False)
-
-        logger.info(content)
-        future = Future()
-        self.store_msg_queue(cmd_id, data, future)
-        super().send(content)
-        result = yield future
+        content, media = self.codec.dumps_frame(payload)
+
+        self.wire_log.outbound(cmd, cmd_id, content)
+        if media:
+            content = self.codec.splice(content, media)
+        recipient = data.get('toUserName') if data else None
+        # 释放请求内容，等待回应期间不再持有
+        payload = data = media = None
+
+        await self._scheduler.acquire(cmd, recipient, priority)
+
+        if timeout is None:
+            timeout = self._cmd_timeouts.get(cmd)
+        future = asyncio.get_event_loop().create_future()
+        await self._msg_queue.acquire()
+        self.store_msg_queue(cmd_id, cmd, future, timeout)
+        try:
+            written = super().send(content)
+        except Exception as e:
+            self.pop_msg_queue(cmd_id)
+            if isinstance(e, (RuntimeError, websocket.WebSocketClosedError)):
+                self._metrics.commands.inc(cmd, 'closed')
+                raise ConnectionClosed('Padchat server connection closed')
+            raise
+        finally:
+            content = None
+        if written is not None:
+            written.add_done_callback(
+                lambda f: self._on_write_done(cmd_id, f))
+        self._metrics.inflight.inc()
+        try:
+            result = await future
+        except RequestTimeout:
+            self._metrics.commands.inc(cmd, 'timeout')
+            raise
+        except ConnectionClosed:
+            self._metrics.commands.inc(cmd, 'closed')
+            raise
+        finally:
+            self._metrics.inflight.dec()
+        self._metrics.commands.inc(cmd, 'ok')
         return result
 
+    def _on_write_done(self, cmd_id, written):
+        # 写入失败时不再等待回应，以ConnectionClosed结束
+        if written.cancelled() or written.exception() is None:
+            return
+        logger.warning('指令写入失败: cmd id: {} {}'.format(
+            cmd_id, written.exception()))
+        request = self.pop_msg_queue(cmd_id)
+        if request is not None and not request.future.done():
+            request.future.set_exception(
+                ConnectionClosed('Padchat server connection closed'))
+
     def pop_msg_queue(self, cmd_id):
         '''
-        返回对应cmd id的回调函数
+        返回对应cmd id的等待项，不存在或已超时返回None
         '''
         return self._msg_queue.pop(cmd_id)
 
-    def store_msg_queue(self, cmd_id, payload=None, future=None):
+    def store_msg_queue(self, cmd_id, cmd=None, future=None, timeout=None):
         '''
         存储cmd id对应的回调数据
         '''
-        self._msg_queue[cmd_id] = {'payload': payload, 'future': future}
+        self._msg_queue.store(cmd_id, cmd, future, timeout)
 
     def save_user(self):
         if self.user:
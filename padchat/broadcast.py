@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import os
+
+from .exceptions import ConnectionClosed, InvalidateValueError
+from .logger import logger
+from .media import encode_media
+
+
+class BroadcastCheckpoint:
+    '''
+    群发断点记录，每发送成功一个接收者追加一行，重新群发时跳过已成功的接收者
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.isfile(path):
+            with open(path, encoding='utf-8') as file:
+                self.done = {line.strip() for line in file if line.strip()}
+        self._file = None
+
+    def __contains__(self, target):
+        return target in self.done
+
+    def add(self, target):
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self.done.add(target)
+        self._file.write(target + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BroadcastResult:
+    '''
+    群发结果汇总
+    '''
+
+    def __init__(self):
+        self.succeeded = []
+        self.failed = {}
+        self.skipped = 0
+
+    @property
+    def total(self):
+        return len(self.succeeded) + len(self.failed) + self.skipped
+
+    def __repr__(self):
+        return '<BroadcastResult succeeded={} failed={} skipped={}>'.format(
+            len(self.succeeded), len(self.failed), self.skipped)
+
+
+class PadchatBroadcastMixin:
+    async def broadcast(self, targets, content=None, image=None, voice=None,
+                        voice_time=None, app=None, concurrency=10,
+                        checkpoint=None, callback=None):
+        '''
+        群发消息，同一时间最多concurrency条指令等待回应
+        :param targets: 接收者wxid列表，可个人，可群组
+        :param content: 文字内容
+        :param image: 图片，文件路径、二进制文件、bytes或base64字符串
+        :param voice: 语音，文件路径、二进制文件、bytes或base64字符串，silk格式
+        :param voice_time: 语音时长，毫秒单位
+        :param app: App消息参数dict，同send_app_msg
+        :param concurrency: 并发窗口大小
+        :param checkpoint: 断点记录文件路径，中断后再次调用将跳过已发送成功的接收者
+        :param callback: 每个接收者发送完成时回调 callback(target, result)，
+            result为服务器返回结果或异常
+        :return: BroadcastResult
+
+        eg. 群发文字
+            result = await self.broadcast(wxids, content='通知', checkpoint='notice.ckpt')
+        '''
+        if sum(i is not None for i in (content, image, voice, app)) != 1:
+            raise InvalidateValueError(
+                'one of content, image, voice, app is required')
+        send = self._broadcast_sender(content, image, voice, voice_time, app)
+
+        if checkpoint is not None and \
+                not isinstance(checkpoint, BroadcastCheckpoint):
+            checkpoint = BroadcastCheckpoint(checkpoint)
+        result = BroadcastResult()
+        pending = iter(targets)
+        aborted = []
+
+        async def worker():
+            for target in pending:
+                if aborted:
+                    return
+                if checkpoint is not None and target in checkpoint:
+                    result.skipped += 1
+                    continue
+                try:
+                    response = await send(target)
+                except ConnectionClosed as e:
+                    aborted.append(e)
+                    response = e
+                except Exception as e:
+                    response = e
+                if isinstance(response, dict) and \
+                        response.get('success') is True:
+                    result.succeeded.append(target)
+                    if checkpoint is not None:
+                        checkpoint.add(target)
+                else:
+                    result.failed[target] = response
+                if callback is not None:
+                    try:
+                        callback(target, response)
+                    except Exception:
+                        logger.error('群发回调出错', exc_info=True)
+
+        try:
+            await asyncio.gather(
+                *[worker() for _ in range(max(1, concurrency))])
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+        logger.info('群发完成: {!r}'.format(result))
+        if aborted:
+            raise aborted[0]
+        return result
+
+    def _broadcast_sender(self, content, image, voice, voice_time, app):
+        # 媒体只编码一次，所有接收者共用
+        if content is not None:
+            return lambda target: self.send_msg(target, content)
+        if app is not None:
+            return lambda target: self.send_app_msg(target, **app)
+        if image is not None:
+            image = encode_media(image, self.upload_cache)
+            return lambda target: self.send_image(target, image)
+        voice = encode_media(voice, self.upload_cache)
+        return lambda target: self.send_voice(target, voice, voice_time)
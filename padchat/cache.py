@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import base64
+import collections
+import hashlib
+import os
+import re
+import tempfile
+
+from .logger import logger
+
+
+# 媒体类型 -> (接口返回字段, 文件后缀, 推送xml中的唯一标识)
+MEDIA_TYPES = {
+    'image': ('image', '.jpg',
+              re.compile(r'<img\b[^>]*?\bmd5="([0-9a-fA-F]+)"')),
+    'video': ('video', '.mp4',
+              re.compile(r'<videomsg\b[^>]*?\bmd5="([0-9a-fA-F]+)"')),
+    'voice': ('voice', '.silk',
+              re.compile(r'<voicemsg\b[^>]*?\bclientmsgid="([^"]+)"')),
+}
+
+# 分块解码大小，需为4的倍数
+DECODE_CHUNK_SIZE = 4 * 64 * 1024
+
+
+def media_key(kind, raw_data):
+    '''
+    根据推送内容生成媒体缓存key，优先使用xml中的md5，其次为消息id
+    :param kind: image、video或voice
+    :param raw_data: 推送数据
+    :return: key，无法识别时返回None
+    '''
+    raw_data = raw_data.get('rawMsgData', raw_data)
+    content = raw_data.get('content') or ''
+    match = MEDIA_TYPES[kind][2].search(content)
+    if match:
+        return '{}-{}'.format(kind, match.group(1).lower())
+    msg_id = raw_data.get('msg_id')
+    if msg_id:
+        return '{}-msg{}'.format(kind, msg_id)
+    return None
+
+
+class MediaCache:
+    '''
+    媒体下载缓存
+
+    以媒体内容标识为key将解码后的文件存放在本地目录，按总大小LRU淘汰；
+    同一媒体的并发请求只下载一次
+    '''
+
+    def __init__(self, directory=None, max_size=512 * 1024 * 1024):
+        '''
+        :param directory: 缓存目录，默认为当前目录下的media
+        :param max_size: 缓存总大小上限，字节
+        '''
+        self.directory = directory or os.path.join(os.getcwd(), 'media')
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._files = collections.OrderedDict()
+        self._inflight = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.isdir(self.directory):
+            return
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.tmp'):
+                os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[os.path.splitext(name)[0]] = (name, size)
+            self.size += size
+
+    def path(self, key):
+        '''
+        已缓存媒体的文件路径，未缓存返回None
+        '''
+        entry = self._files.get(key)
+        if entry is None:
+            return None
+        path = os.path.join(self.directory, entry[0])
+        if not os.path.isfile(path):
+            self._discard(key)
+            return None
+        self._files.move_to_end(key)
+        os.utime(path)
+        return path
+
+    async def fetch(self, kind, raw_data, loader):
+        '''
+        获取媒体文件，未缓存时调用loader下载
+        :param kind: image、video或voice
+        :param raw_data: 推送数据
+        :param loader: 下载接口，如client.get_msg_image
+        :return: 文件路径，下载失败返回None
+        '''
+        key = media_key(kind, raw_data)
+        if key is None:
+            path = await self._download(kind, None, raw_data, loader)
+            return path
+        while True:
+            path = self.path(key)
+            if path is not None:
+                self.hits += 1
+                return path
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            # 同一媒体正在下载，等待其结果；shield避免等待方取消时影响其他等待方
+            future = inflight[0]
+            inflight[1] += 1
+            try:
+                path = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # 下载方被取消，重新下载
+                    continue
+                raise
+            finally:
+                inflight[1] -= 1
+            self.hits += 1
+            return path
+
+        self.misses += 1
+        # [结果future, 等待数量]
+        inflight = self._inflight[key] = \
+            [asyncio.get_event_loop().create_future(), 0]
+        future = inflight[0]
+        try:
+            path = await self._download(kind, key, raw_data, loader)
+        except BaseException as e:
+            if inflight[1] and not isinstance(e, asyncio.CancelledError):
+                future.set_exception(e)
+            else:
+                # 被取消或没有等待方
+                future.cancel()
+            raise
+        else:
+            future.set_result(path)
+        finally:
+            del self._inflight[key]
+        return path
+
+    async def _download(self, kind, key, raw_data, loader):
+        field, suffix, _ = MEDIA_TYPES[kind]
+        result = await loader(raw_data)
+        encoded = (result or {}).get('data', {}).get(field) \
+            if (result or {}).get('success') is True else None
+        result = None
+        if not encoded:
+            logger.error('下载媒体失败: {}'.format(key or kind))
+            return None
+        # 解码及写入文件在线程池中执行，不阻塞事件循环
+        key, name, size = await asyncio.get_event_loop().run_in_executor(
+            None, self._write, kind, key, suffix, encoded)
+        encoded = None
+        self._discard(key)
+        self._files[key] = (name, size)
+        self.size += size
+        self._evict()
+        return os.path.join(self.directory, name)
+
+    def _write(self, kind, key, suffix, encoded):
+        '''
+        分块解码后直接写入文件，不在内存中保留解码结果；推送中没有唯一
+        标识时以内容的sha1为key
+        :return: (key, 文件名, 大小)
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        encoded = ''.join(encoded.split()) if '\n' in encoded else encoded
+        digest = hashlib.sha1()
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with open(fd, 'wb') as file:
+                for start in range(0, len(encoded), DECODE_CHUNK_SIZE):
+                    chunk = base64.b64decode(
+                        encoded[start:start + DECODE_CHUNK_SIZE])
+                    digest.update(chunk)
+                    file.write(chunk)
+                size = file.tell()
+            if key is None:
+                key = '{}-sha1{}'.format(kind, digest.hexdigest())
+            name = key + suffix
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return key, name, size
+
+    def _discard(self, key):
+        entry = self._files.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+        return entry
+
+    def _evict(self):
+        while self.size > self.max_size and len(self._files) > 1:
+            key = next(iter(self._files))
+            name, _ = self._discard(key)
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            'files': len(self._files),
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'inflight': len(self._inflight),
+        }
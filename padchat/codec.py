@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import json
+
+from .media import Media
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+class JSONCodec:
+    '''
+    指令及推送的json编解码，使用标准库json
+
+    指令序列化为utf-8 bytes，tornado直接作为文本帧发送，不再重复编码
+    '''
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def dumps_frame(self, payload: dict):
+        '''
+        序列化指令，媒体数据以占位文本代替，避免完整复制进json
+        :return: (utf-8编码的json, 媒体列表)
+        '''
+        data = payload['payload']
+        media = [value for value in data.values() if isinstance(value, Media)]
+        if media:
+            payload = dict(payload, payload={
+                key: value.placeholder if isinstance(value, Media) else value
+                for key, value in data.items()})
+        return self.dumps(payload), media
+
+    @staticmethod
+    def splice(content: bytes, media: list) -> bytes:
+        '''
+        替换占位文本为媒体数据，base64字符无需json转义
+        '''
+        parts = []
+        for item in media:
+            head, _, content = content.partition(
+                item.placeholder.encode('ascii'))
+            parts.append(head)
+            parts.append(item.data)
+        parts.append(content)
+        return b''.join(parts)
+
+
+class UJSONCodec(JSONCodec):
+    name = 'ujson'
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        return ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+class OrjsonCodec(JSONCodec):
+    name = 'orjson'
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj) -> bytes:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # 超出64位的整数等orjson不支持的数据
+            return super().dumps(obj)
+
+
+def default_codec():
+    '''
+    按orjson、ujson、json的顺序选择已安装的实现
+    '''
+    if orjson is not None:
+        return OrjsonCodec()
+    if ujson is not None:
+        return UJSONCodec()
+    return JSONCodec()
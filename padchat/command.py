@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import re
+
+
+class CommandScope:
+    person = 'person' # 好友消息
+    group = 'group' # 群消息
+    self = 'self' # 自己发送的消息
+
+    # 未指定范围时匹配好友及群消息
+    default = (person, group)
+
+
+class CommandMatch:
+    '''
+    命令匹配结果
+    '''
+    __slots__ = ('command', 'scope', 'room', 'sender', 'body', 'args',
+                 'match')
+
+    def __init__(self, command, scope, room, sender, body, args, match=None):
+        self.command = command  # 注册的命令文本或正则
+        self.scope = scope      # 消息范围 CommandScope
+        self.room = room        # 群id，非群消息为None
+        self.sender = sender    # 发送者wxid
+        self.body = body        # 消息正文，已去除群消息的发送者前缀
+        self.args = args        # 命令之后的文本
+        self.match = match      # 正则命令的re.Match
+
+    def __repr__(self):
+        return '<CommandMatch {!r} sender={} room={} args={!r}>'.format(
+            self.command, self.sender, self.room, self.args)
+
+
+class _Command:
+    __slots__ = ('handler', 'command', 'scopes', 'rooms', 'users', 'pattern')
+
+    def __init__(self, handler, command, scopes, rooms, users, pattern=None):
+        self.handler = handler
+        self.command = command
+        self.scopes = scopes
+        self.rooms = rooms
+        self.users = users
+        self.pattern = pattern
+
+    def accept(self, scope, room, sender):
+        if scope not in self.scopes:
+            return False
+        if self.rooms is not None and room not in self.rooms:
+            return False
+        if self.users is not None and sender not in self.users:
+            return False
+        return True
+
+
+class CommandRouter:
+    '''
+    文字命令路由
+
+    完全匹配使用dict，前缀匹配使用字典树，正则合并为一个表达式，
+    匹配耗时与命令数量无关。优先级：完全匹配 > 最长前缀 > 正则（按注册顺序）
+    '''
+
+    def __init__(self):
+        self._exact = {}        # 命令 -> [_Command]
+        self._prefix = {}       # 字典树，节点为dict，None键存放命令
+        self._regex = []        # [_Command]
+        self._combined = None
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, handler, exact=None, prefix=None, regex=None, scope=None,
+            rooms=None, users=None):
+        '''
+        注册命令，exact、prefix、regex三选一
+        :param handler: 处理函数 handler(context, match)，match为CommandMatch
+        :param exact: 完全匹配的命令
+        :param prefix: 前缀匹配的命令
+        :param regex: 正则命令，使用re.match匹配正文开头
+        :param scope: 消息范围CommandScope或其列表，默认好友及群消息
+        :param rooms: 仅在这些群内生效
+        :param users: 仅响应这些发送者
+        '''
+        if sum(i is not None for i in (exact, prefix, regex)) != 1:
+            raise ValueError('one of exact, prefix, regex is required')
+        if scope is None:
+            scopes = frozenset(CommandScope.default)
+        elif isinstance(scope, str):
+            scopes = frozenset((scope,))
+        else:
+            scopes = frozenset(scope)
+        rooms = frozenset(rooms) if rooms is not None else None
+        users = frozenset(users) if users is not None else None
+
+        if exact is not None:
+            command = _Command(handler, exact, scopes, rooms, users)
+            self._exact.setdefault(exact, []).append(command)
+        elif prefix is not None:
+            command = _Command(handler, prefix, scopes, rooms, users)
+            node = self._prefix
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(command)
+        else:
+            pattern = re.compile(regex) if isinstance(regex, str) else regex
+            if _NUMBERED_BACKREF.search(pattern.pattern):
+                raise ValueError('numbered backreference is not supported, '
+                                 'use named group instead')
+            command = _Command(handler, pattern.pattern, scopes, rooms, users,
+                               pattern)
+            self._regex.append(command)
+            self._combined = None
+        self._count += 1
+        return handler
+
+    def command(self, exact=None, prefix=None, regex=None, scope=None,
+                rooms=None, users=None):
+        '''
+        注册命令的装饰器，参数同add
+        '''
+        def decorator(handler):
+            return self.add(handler, exact=exact, prefix=prefix, regex=regex,
+                            scope=scope, rooms=rooms, users=users)
+        return decorator
+
+    def _combined_regex(self):
+        # 带flags的正则无法合并，匹配时逐个检查
+        if self._combined is None:
+            self._combined = re.compile('|'.join(
+                '(?P<_{}>{})'.format(i, _rename_groups(command.command, i))
+                for i, command in enumerate(self._regex)
+                if command.pattern.flags == _DEFAULT_FLAGS) or '(?!)')
+        return self._combined
+
+    def match(self, context: dict, scope: str):
+        '''
+        匹配命令
+        :param context: 文字消息推送
+        :param scope: 消息范围CommandScope
+        :return: (处理函数, CommandMatch)，无匹配命令返回None
+        '''
+        room = None
+        if hasattr(context, 'body'):
+            # PushMessage已拆分发送者及正文
+            sender, content = context.sender, context.body
+            if scope == CommandScope.group:
+                room = context.get('from_user')
+        else:
+            content = context.get('content') or ''
+            sender = context.get('from_user')
+            if scope == CommandScope.group:
+                room = sender
+                sender, _, content = content.partition(':\n')
+
+        for command in self._exact.get(content, ()):
+            if command.accept(scope, room, sender):
+                return command.handler, CommandMatch(
+                    command.command, scope, room, sender, content, '')
+
+        node = self._prefix
+        candidates = []
+        for char in content:
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                candidates.append(node[None])
+        for commands in reversed(candidates):
+            for command in commands:
+                if command.accept(scope, room, sender):
+                    args = content[len(command.command):].strip()
+                    return command.handler, CommandMatch(
+                        command.command, scope, room, sender, content, args)
+
+        if self._regex:
+            found = self._combined_regex().match(content)
+            start = int(found.lastgroup[1:]) if found is not None \
+                else len(self._regex)
+            for i, command in enumerate(self._regex):
+                if i < start and command.pattern.flags == _DEFAULT_FLAGS:
+                    # 合并表达式已确认不匹配
+                    continue
+                match = command.pattern.match(content)
+                if match is not None and command.accept(scope, room, sender):
+                    return command.handler, CommandMatch(
+                        command.command, scope, room, sender, content,
+                        content[match.end():].strip(), match)
+        return None
+
+
+_DEFAULT_FLAGS = re.compile('').flags
+_NUMBERED_BACKREF = re.compile(r'\\[1-9]')
+
+
+def _rename_groups(pattern, index):
+    # 合并表达式中为分组名加上序号，避免重名
+    pattern = re.sub(r'\(\?P<(\w+)>', r'(?P<_{}_\1>'.format(index), pattern)
+    return re.sub(r'\(\?P=(\w+)\)', r'(?P=_{}_\1)'.format(index), pattern)
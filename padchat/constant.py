@@ -11,3 +11,11 @@ class LoginType:
     user = 'user' # 账号密码登录
 
     unknow = 'unknow'
+
+
+class Priority:
+    high = 0 # 登录、同步等控制指令
+    normal = 1 # 查询、管理类指令
+    bulk = 2 # 消息发送
+
+    lanes = (high, normal, bulk)
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import collections
+import json
+import os
+import sqlite3
+import time
+
+from .exceptions import RequestTimeout
+from .logger import logger
+
+
+def is_room(contact):
+    return (contact.get('user_name') or '').endswith('@chatroom')
+
+
+class MemorySink:
+    '''
+    同步到本地通讯录ContactDirectory，同步状态保存在通讯录上
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    @property
+    def synced(self):
+        return self.directory.synced
+
+    def write(self, contacts):
+        for contact in contacts:
+            self.directory.update_contact(contact)
+
+    def finish(self):
+        self.directory.synced = True
+
+
+class SQLiteSink:
+    '''
+    同步到SQLite，每批联系人在一个事务中写入；记录是否完成过全量同步，
+    之后的同步只获取增量
+    '''
+
+    def __init__(self, path=None):
+        '''
+        :param path: 数据库文件，默认为当前目录下的contacts.db
+        '''
+        self.path = path or os.path.join(os.getcwd(), 'contacts.db')
+        self._db = sqlite3.connect(self.path)
+        with self._db:
+            self._db.execute('''
+                CREATE TABLE IF NOT EXISTS contact (
+                    user_name TEXT PRIMARY KEY,
+                    nick_name TEXT,
+                    remark TEXT,
+                    is_room INTEGER,
+                    data TEXT NOT NULL,
+                    updated REAL
+                )''')
+            self._db.execute('CREATE INDEX IF NOT EXISTS contact_remark '
+                             'ON contact (remark)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS meta '
+                             '(key TEXT PRIMARY KEY, value TEXT)')
+
+    @property
+    def synced(self):
+        return self._db.execute(
+            "SELECT 1 FROM meta WHERE key = 'synced'").fetchone() is not None
+
+    def write(self, contacts):
+        now = time.time()
+        with self._db:
+            self._db.executemany('''
+                INSERT OR REPLACE INTO contact
+                (user_name, nick_name, remark, is_room, data, updated)
+                VALUES (?, ?, ?, ?, ?, ?)''', [
+                (contact['user_name'], contact.get('nick_name'),
+                 contact.get('remark'), int(is_room(contact)),
+                 json.dumps(contact, ensure_ascii=False), now)
+                for contact in contacts])
+
+    def finish(self):
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES "
+                             "('synced', ?)", (str(time.time()),))
+
+    def contact(self, user_name):
+        row = self._db.execute('SELECT data FROM contact WHERE user_name = ?',
+                               (user_name,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def by_remark(self, remark):
+        row = self._db.execute('SELECT data FROM contact WHERE remark = ?',
+                               (remark,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM contact').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+class ContactStream:
+    '''
+    流式同步通讯录
+
+    发送syncContact后，contact事件中的联系人按batch_size分批写入sink并交给
+    迭代方，syncContact回应之后的loaded事件时结束；每批写入后调用
+    progress(stream)。登录等其他原因产生的loaded事件不会结束同步
+
+        async for batch in client.sync_contacts_stream():
+            ...
+    '''
+
+    def __init__(self, client, reset=None, batch_size=200, sink=None,
+                 progress=None, idle_timeout=60):
+        '''
+        :param reset: 是否重置同步状态全量同步，None为sink未完成过同步时全量
+        :param batch_size: 每批联系人数量
+        :param sink: 联系人写入位置，默认为客户端的本地通讯录
+        :param progress: 每批写入后的回调 progress(stream)
+        :param idle_timeout: 多少秒没有收到联系人视为同步失败
+        '''
+        self.client = client
+        self.sink = sink if sink is not None \
+            else MemorySink(client.directory)
+        self.reset = not self.sink.synced if reset is None else reset
+        self.batch_size = batch_size
+        self.progress = progress
+        self.idle_timeout = idle_timeout
+        # 统计
+        self.count = 0
+        self.rooms = 0
+        self.batches = 0
+        self.started = None
+        self.finished = None
+
+        self._batch = []
+        self._ready = collections.deque()
+        self._keep = True       # 为False时不保留已写入的批次
+        self._requested = False  # 已发送syncContact
+        self._answered = False  # syncContact已回应
+        self._done = False
+        self._error = None
+        self._waiter = None
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0
+        return (self.finished or time.monotonic()) - self.started
+
+    def _start(self):
+        self.started = time.monotonic()
+        self.client._contact_streams.add(self)
+        self.client.spawn(self._request())
+
+    async def _request(self):
+        self._requested = True
+        try:
+            result = await self.client.sync_contact(reset=self.reset)
+        except Exception as e:
+            self.fail(e)
+            return
+        if result.get('success') is not True:
+            self.fail(RuntimeError('syncContact failed: {}'.format(
+                result.get('msg'))))
+            return
+        self._answered = True
+
+    # 事件 ####################################################################
+
+    def feed(self, contact):
+        '''
+        contact事件中的联系人
+        '''
+        if not isinstance(contact, dict) or not contact.get('user_name'):
+            return
+        self._batch.append(contact)
+        self.count += 1
+        if is_room(contact):
+            self.rooms += 1
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+
+    def answered(self, result):
+        '''
+        收到syncContact回应，在回应帧处理时即调用，早于_request恢复执行
+        '''
+        if self._requested and isinstance(result, dict) and \
+                result.get('success') is True:
+            self._answered = True
+
+    def loaded(self):
+        '''
+        loaded事件，syncContact回应之前的事件不属于本次同步
+        '''
+        if self._answered:
+            self.finish()
+
+    def finish(self):
+        '''
+        同步完成，sink记录已完成同步
+        '''
+        if self._done:
+            return
+        self._flush()
+        if self._done:
+            return
+        try:
+            self.sink.finish()
+        except Exception as e:
+            self.fail(e)
+            return
+        self._done = True
+        self.finished = time.monotonic()
+        self.client._contact_streams.discard(self)
+        logger.info('同步通讯录{}个联系人，{}个群，耗时{:.1f}秒'.format(
+            self.count, self.rooms, self.elapsed))
+        self._wake()
+
+    def fail(self, exception):
+        if self._done:
+            return
+        self._done = True
+        self._error = exception
+        self.finished = time.monotonic()
+        self.client._contact_streams.discard(self)
+        self._wake()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        try:
+            self.sink.write(batch)
+        except Exception as e:
+            self.fail(e)
+            return
+        self.batches += 1
+        if self._keep:
+            self._ready.append(batch)
+        if self.progress is not None:
+            try:
+                self.progress(self)
+            except Exception:
+                logger.error('同步通讯录进度回调出错', exc_info=True)
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    # 迭代 ####################################################################
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.started is None:
+            self._start()
+        while not self._ready:
+            if self._done:
+                if self._error is not None:
+                    raise self._error
+                raise StopAsyncIteration
+            count = self.count
+            self._waiter = asyncio.get_event_loop().create_future()
+            try:
+                await asyncio.wait_for(self._waiter, self.idle_timeout)
+            except asyncio.TimeoutError:
+                if self.count == count:
+                    self.fail(RequestTimeout(
+                        'no contact received in {} seconds'.format(
+                            self.idle_timeout)))
+            finally:
+                self._waiter = None
+        return self._ready.popleft()
+
+    async def wait(self):
+        '''
+        不逐批处理，等待同步完成
+        :return: 联系人数量
+        '''
+        self._keep = False
+        async for _ in self:
+            pass
+        return self.count
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import collections
+import hashlib
+import math
+import os
+import struct
+import time
+
+from .logger import logger
+
+
+class BloomFilter:
+    '''
+    布隆过滤器，使用双重散列计算k个位置
+    '''
+    _header = struct.Struct('<QIId')
+
+    def __init__(self, capacity, error_rate=1e-6):
+        '''
+        :param capacity: 预计容纳的数量
+        :param error_rate: 达到容量时的误判率
+        '''
+        self.capacity = capacity
+        self.bits = max(8, int(-capacity * math.log(error_rate) /
+                               math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.count = 0
+        self.created = time.time()
+        self._data = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('<QQ', digest)
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def __contains__(self, key):
+        data = self._data
+        return all(data[i >> 3] & (1 << (i & 7)) for i in self._positions(key))
+
+    def add(self, key):
+        data = self._data
+        for i in self._positions(key):
+            data[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def dumps(self):
+        return self._header.pack(self.bits, self.hashes, self.count,
+                                 self.created) + bytes(self._data)
+
+    @classmethod
+    def loads(cls, data, capacity):
+        bits, hashes, count, created = cls._header.unpack_from(data)
+        bloom = cls.__new__(cls)
+        bloom.capacity = capacity
+        bloom.bits = bits
+        bloom.hashes = hashes
+        bloom.count = count
+        bloom.created = created
+        bloom._data = bytearray(data[cls._header.size:])
+        if len(bloom._data) != (bits + 7) // 8:
+            raise ValueError('bloom filter data is truncated')
+        return bloom
+
+
+class RollingBloomFilter:
+    '''
+    分代的布隆过滤器
+
+    新id写入最新一代，查询时检查所有代；最新一代写满capacity或超过
+    max_age/generations秒后新建一代并丢弃最旧的一代，内存固定为
+    generations个过滤器。指定path时保存到文件，重启后继续使用
+    '''
+    _magic = b'PDBF'
+
+    def __init__(self, capacity=100000, error_rate=1e-6, generations=2,
+                 max_age=None, path=None):
+        '''
+        :param capacity: 每一代容纳的数量
+        :param error_rate: 每一代的误判率
+        :param generations: 保留的代数
+        :param max_age: 记录保留的秒数，None为只按数量滚动
+        :param path: 保存文件，None为只保存在内存
+        '''
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.generations = generations
+        self.max_age = max_age
+        self.path = path
+        self._filters = collections.deque(maxlen=generations)
+        self._dirty = False
+        if path and os.path.isfile(path):
+            self._load()
+        if not self._filters:
+            self._filters.append(BloomFilter(capacity, error_rate))
+
+    def __contains__(self, key):
+        return any(key in bloom for bloom in self._filters)
+
+    def add(self, key):
+        current = self._filters[-1]
+        if current.count >= self.capacity or (
+                self.max_age and time.time() - current.created >
+                self.max_age / self.generations):
+            self._filters.append(BloomFilter(self.capacity, self.error_rate))
+            self.save()
+        self._filters[-1].add(key)
+        self._dirty = True
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            if data[:4] != self._magic:
+                raise ValueError('unknow file format')
+            offset = 4
+            while offset < len(data):
+                size, = struct.unpack_from('<Q', data, offset)
+                offset += 8
+                self._filters.append(BloomFilter.loads(
+                    data[offset:offset + size], self.capacity))
+                offset += size
+        except Exception:
+            logger.error('读取消息去重记录失败: {}'.format(self.path),
+                         exc_info=True)
+            self._filters.clear()
+            return
+        if self.max_age:
+            expired = time.time() - self.max_age
+            while self._filters and self._filters[0].created < expired:
+                self._filters.popleft()
+
+    def save(self):
+        '''
+        写入临时文件后替换，未指定path或没有变化时不做任何处理
+        '''
+        if not self.path or not self._dirty:
+            return
+        parts = [self._magic]
+        for bloom in self._filters:
+            data = bloom.dumps()
+            parts.append(struct.pack('<Q', len(data)))
+            parts.append(data)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(b''.join(parts))
+        os.replace(tmp, self.path)
+        self._dirty = False
+
+
+class MessageDeduplicator:
+    '''
+    推送消息去重
+
+    最近的msg_id保存在有界的LRU中，淘汰的id由可选的RollingBloomFilter
+    继续记录；重连、sync_msg、重新登录后重复推送的消息在分发前丢弃
+    '''
+
+    def __init__(self, size=10000, max_age=None, bloom=None, save_every=1000):
+        '''
+        :param size: LRU保存的msg_id数量
+        :param max_age: LRU中记录保留的秒数，None为只按数量淘汰
+        :param bloom: 持久化的RollingBloomFilter，None为只使用LRU
+        :param save_every: 每记录多少条保存一次bloom
+        '''
+        self.size = size
+        self.max_age = max_age
+        self.bloom = bloom
+        self.save_every = save_every
+        self.duplicates = 0
+        self._recent = collections.OrderedDict()
+        self._unsaved = 0
+
+    def __len__(self):
+        return len(self._recent)
+
+    def seen(self, msg_id):
+        '''
+        检查并记录msg_id
+        :return: 已处理过返回True
+        '''
+        recent = self._recent
+        now = time.monotonic()
+        added = recent.get(msg_id)
+        if added is not None and (self.max_age is None or
+                                  now - added <= self.max_age):
+            recent.move_to_end(msg_id)
+            self.duplicates += 1
+            return True
+        if added is None and self.bloom is not None and msg_id in self.bloom:
+            self.duplicates += 1
+            return True
+        recent[msg_id] = now
+        recent.move_to_end(msg_id)
+        if len(recent) > self.size:
+            recent.popitem(last=False)
+        if self.bloom is not None:
+            self.bloom.add(msg_id)
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self.save()
+        return False
+
+    def save(self):
+        if self.bloom is not None:
+            self._unsaved = 0
+            self.bloom.save()
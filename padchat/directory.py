@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import time
+
+
+class ContactDirectory:
+    '''
+    本地通讯录
+
+    由contact事件、好友信息推送及getContact/getRoomMembers结果填充，
+    超过ttl的数据视为过期，需重新向服务器获取
+    '''
+
+    def __init__(self, ttl=3600):
+        '''
+        :param ttl: 数据有效时间，秒，None为不过期
+        '''
+        self.ttl = ttl
+        self._contacts = {}     # user_name -> (更新时间, 联系人数据)
+        self._members = {}      # group_id -> (更新时间, 群成员数据)
+        self._nicks = {}        # group_id -> {user_name: 群内昵称}
+        self._remarks = {}      # 备注 -> user_name
+        # 是否完成过流式同步，之后只同步增量
+        self.synced = False
+
+    def __len__(self):
+        return len(self._contacts)
+
+    def __contains__(self, user_name):
+        return user_name in self._contacts
+
+    def _fresh(self, entry):
+        if entry is None:
+            return None
+        updated, data = entry
+        if updated is None:
+            return None
+        if self.ttl is not None and time.monotonic() - updated > self.ttl:
+            return None
+        return data
+
+    # 联系人 ##################################################################
+
+    def contact(self, user_name):
+        '''
+        联系人或群资料，不存在或已过期返回None
+        '''
+        return self._fresh(self._contacts.get(user_name))
+
+    def update_contact(self, contact: dict):
+        '''
+        更新联系人或群资料
+        :param contact: contact事件或getContact返回的数据
+        '''
+        user_name = contact.get('user_name')
+        if not user_name:
+            return
+        old = self._contacts.get(user_name)
+        if old is not None and old[1].get('remark'):
+            self._remarks.pop(old[1]['remark'], None)
+        self._contacts[user_name] = (time.monotonic(), contact)
+        if contact.get('remark'):
+            self._remarks[contact['remark']] = user_name
+
+    def set_remark(self, user_name, remark):
+        entry = self._contacts.get(user_name)
+        if entry is None:
+            return
+        contact = entry[1]
+        if contact.get('remark'):
+            self._remarks.pop(contact['remark'], None)
+        contact['remark'] = remark
+        if remark:
+            self._remarks[remark] = user_name
+
+    def remove_contact(self, user_name):
+        entry = self._contacts.pop(user_name, None)
+        if entry is not None and entry[1].get('remark'):
+            self._remarks.pop(entry[1]['remark'], None)
+        self.remove_room(user_name)
+
+    def by_remark(self, remark):
+        '''
+        根据备注查找联系人
+        '''
+        user_name = self._remarks.get(remark)
+        return self.contact(user_name) if user_name else None
+
+    def display_name(self, user_name, group_id=None):
+        '''
+        显示名称，依次为群内昵称、备注、昵称，无缓存数据时返回None
+        '''
+        if group_id is not None:
+            nick = self._nicks.get(group_id, {}).get(user_name)
+            if nick and self._fresh(self._members.get(group_id)) is not None:
+                return nick
+        contact = self.contact(user_name)
+        if contact is None:
+            return None
+        return contact.get('remark') or contact.get('nick_name')
+
+    # 群成员 ##################################################################
+
+    def room_members(self, group_id):
+        '''
+        群成员数据，不存在或已过期返回None
+        '''
+        return self._fresh(self._members.get(group_id))
+
+    def update_room_members(self, group_id, data: dict):
+        '''
+        更新群成员
+        :param data: getRoomMembers返回的数据
+        '''
+        self._members[group_id] = (time.monotonic(), data)
+        self._nicks[group_id] = {
+            member.get('user_name'): member.get('chatroom_nick_name') or
+            member.get('nick_name')
+            for member in data.get('member') or ()
+            if isinstance(member, dict)}
+
+    def remove_room(self, group_id):
+        self._members.pop(group_id, None)
+        self._nicks.pop(group_id, None)
+
+    def invalidate(self, user_name):
+        '''
+        标记数据过期，下次访问时重新获取
+        '''
+        entry = self._contacts.get(user_name)
+        if entry is not None:
+            self._contacts[user_name] = (None, entry[1])
+        entry = self._members.get(user_name)
+        if entry is not None:
+            self._members[user_name] = (None, entry[1])
+
+    def clear(self):
+        self.synced = False
+        self._contacts.clear()
+        self._members.clear()
+        self._nicks.clear()
+        self._remarks.clear()
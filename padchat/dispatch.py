@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import collections
+
+
+class HandlerRegistry:
+    '''
+    事件处理函数注册表
+
+    注册或移除时version递增，客户端据此重建分发表
+    '''
+
+    def __init__(self):
+        self.version = 0
+        self._events = collections.defaultdict(list)    # event -> handlers
+        self._push = collections.defaultdict(list)      # sub_type -> handlers
+        self._app = collections.defaultdict(list)       # app type -> handlers
+        self._text = []                                 # (group, handler)
+
+    def add(self, handler, event='push', sub_type=None, app_type=None):
+        '''
+        注册处理函数
+        :param handler: 处理函数 handler(data)，push事件为单条推送
+        :param event: 事件名，如push、login、contact
+        :param sub_type: push事件的sub_type，None为所有推送
+        :param app_type: sub_type为49的app消息类型，如'2001'红包
+        '''
+        if app_type is not None:
+            self._app[str(app_type)].append(handler)
+        elif event == 'push':
+            self._push[sub_type].append(handler)
+        else:
+            self._events[event].append(handler)
+        self.version += 1
+        return handler
+
+    def add_text(self, handler, group=None):
+        '''
+        注册文字消息处理函数，不包含自己发送的消息
+        :param group: True仅群消息，False仅个人消息，None为全部
+        '''
+        self._text.append((group, handler))
+        self.version += 1
+        return handler
+
+    def remove(self, handler):
+        for handlers in (list(self._events.values()) +
+                         list(self._push.values()) +
+                         list(self._app.values())):
+            while handler in handlers:
+                handlers.remove(handler)
+        self._text = [i for i in self._text if i[1] is not handler]
+        self.version += 1
+
+    def event_handlers(self, event):
+        return tuple(self._events.get(event, ()))
+
+    def push_handlers(self, sub_type):
+        return tuple(self._push.get(sub_type, ()))
+
+    def push_sub_types(self):
+        return [sub_type for sub_type, handlers in self._push.items()
+                if handlers and sub_type is not None]
+
+    def app_handlers(self, app_type):
+        return tuple(self._app.get(app_type, ()))
+
+    @property
+    def has_app_handlers(self):
+        return any(self._app.values())
+
+    def text_handlers(self, group: bool):
+        return tuple(handler for is_group, handler in self._text
+                     if is_group is None or is_group == group)
+
+    @property
+    def has_text_handlers(self):
+        return bool(self._text)
@@ -1,39 +1,200 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*- 
 # Author: Ben Chen
+import asyncio
+import inspect
+import time
+
 import qrcode
 import qrcode_terminal
-from xml.dom import minidom
 
+from .command import CommandScope
 from .constant import LoginType
+from .executor import ExecutionPolicy, run_in
+from .message import PushMessage
 from .user import User
 from .logger import logger
+from .push import PadchatPushMixin
 
 
 
 class PadChatEventMixin:
+    # 事件 -> 处理方法
+    EVENT_ROUTES = {
+        'qrcode': 'event_qrcode',    # 二维码
+        'scan': 'event_scan',        # 扫码
+        'push': 'event_push',        # 新消息
+        'login': 'event_login',      # 登录
+        'logout': 'event_logout',    # 注销登录
+        'loaded': 'event_loaded',    # 通讯录载入完毕
+        'over': 'event_over',        # 实例关闭
+        'warn': 'event_warn',        # 异常消息
+        'contact': 'event_contact',  # 联系人
+        'sns': 'event_sns',          # 朋友圈
+        'notify': 'event_notify',    # 推送通知
+    }
+
+    # 推送sub_type -> (处理方法, 触发的PadchatPushMixin接口)
+    # 接口均未重写且没有注册处理函数的sub_type不做任何处理
+    PUSH_ROUTES = {
+        1: ('_push_text', ('text_msg', 'self_text_msg', 'person_text_msg',
+                           'group_text_msg')),          # 文字消息
+        2: ('_push_contact', None),                     # 好友、群、公众号信息
+        3: ('image_msg', ('image_msg',)),               # 图片消息
+        34: ('voice_msg', ('voice_msg',)),              # 语音消息
+        37: ('friend_invite_msg', ('friend_invite_msg',)),  # 好友请求
+        49: ('_push_app', ('transfer_msg', 'red_packet_msg', 'zhifu_msg',
+                           'app_msg')),                 # APP消息
+        10000: ('_push_notice', None),                  # 微信通知信息
+    }
+    # 42名片 43视频 47表情 48定位 50语音通话 62小视频 3000群邀请
+    # 9999系统通知 10002撤回消息 暂无接口，可通过on注册处理函数
+
+    # 分发推送期间收集异步处理函数的future，全部完成后才记录推送日志检查点
+    _handler_futures = None
+
+    def on(self, event='push', sub_type=None, app_type=None, policy=None,
+           callback=None):
+        '''
+        注册事件处理函数的装饰器
+        :param event: 事件名，如push、login、contact
+        :param sub_type: push事件的sub_type，None为所有推送
+        :param app_type: app消息类型，如'2000'转账、'2001'红包、'5'收款
+        :param policy: 执行方式ExecutionPolicy，默认在事件循环中执行
+        :param callback: 线程池、进程池执行完成后的回调 callback(data, result)
+        :return: 
+
+        eg. 处理红包消息
+            @client.on(sub_type=49, app_type='2001')
+            async def red_packet(push):
+                await client.receive_red_packet(push)
+        '''
+        def decorator(handler):
+            if policy is not None:
+                run_in(policy, callback)(handler)
+            return self.handlers.add(handler, event=event, sub_type=sub_type,
+                                     app_type=app_type)
+        return decorator
+
+    def on_text(self, group=None):
+        '''
+        注册文字消息处理函数的装饰器，不包含自己发送的消息
+        :param group: True仅群消息，False仅个人消息，None为全部
+        '''
+        def decorator(handler):
+            return self.handlers.add_text(handler, group=group)
+        return decorator
+
+    def command(self, exact=None, prefix=None, regex=None, scope=None,
+                rooms=None, users=None):
+        '''
+        注册文字命令的装饰器，处理函数为 handler(context, match)
+        :param exact: 完全匹配的命令
+        :param prefix: 前缀匹配的命令，match.args为命令之后的文本
+        :param regex: 正则命令，match.match为re.Match
+        :param scope: CommandScope.person、group、self或其列表，默认好友及群消息
+        :param rooms: 仅在这些群内生效
+        :param users: 仅响应这些发送者
+        :return: 
+
+        eg. 设置群名
+            @client.command(prefix='群名:', scope=CommandScope.group)
+            async def set_room_name(context, match):
+                await client.set_room_name(match.room, match.args)
+        '''
+        return self.commands.command(exact=exact, prefix=prefix, regex=regex,
+                                     scope=scope, rooms=rooms, users=users)
+
+    def _is_overridden(self, name):
+        return getattr(type(self), name) is not getattr(PadchatPushMixin, name)
+
+    def _dispatch_tables(self):
+        '''
+        事件及推送分发表，注册表变化时重建
+        '''
+        version = (self.handlers.version, len(self.commands))
+        tables = getattr(self, '_tables', None)
+        if tables is not None and tables[0] == version:
+            return tables[1], tables[2]
+
+        events = {}
+        for event, name in self.EVENT_ROUTES.items():
+            events[event] = (getattr(self, name),) + \
+                self.handlers.event_handlers(event)
+
+        wildcard = self.handlers.push_handlers(None)
+        push = {}
+        for sub_type, (name, hooks) in self.PUSH_ROUTES.items():
+            if hooks is None or any(self._is_overridden(hook)
+                                    for hook in hooks):
+                push[sub_type] = (getattr(self, name),)
+        if (self.handlers.has_text_handlers or self.commands) and \
+                1 not in push:
+            push[1] = (self._push_text,)
+        if self.handlers.has_app_handlers and 49 not in push:
+            push[49] = (self._push_app,)
+        for sub_type in self.handlers.push_sub_types():
+            push[sub_type] = push.get(sub_type, ()) + \
+                self.handlers.push_handlers(sub_type)
+        if wildcard:
+            for sub_type in push:
+                push[sub_type] += wildcard
+            push[None] = wildcard
+
+        self._tables = (version, events, push)
+        return events, push
+
+    def _call_handler(self, handler, data):
+        policy = getattr(handler, 'padchat_policy', ExecutionPolicy.inline)
+        try:
+            if policy == ExecutionPolicy.inline:
+                name = getattr(handler, '__name__', 'unknow')
+                start = time.monotonic()
+                result = self.executors.run_inline(handler, data)
+                if inspect.isawaitable(result):
+                    result.add_done_callback(
+                        lambda _: self._metrics.handlers.observe(
+                            time.monotonic() - start, name))
+                    self._track_handler(result)
+                else:
+                    self._metrics.handlers.observe(time.monotonic() - start,
+                                                   name)
+                return
+            if getattr(handler, '__self__', None) is self:
+                # 重写的接口方法，在线程中通过代理调用客户端
+                if policy == ExecutionPolicy.process:
+                    raise TypeError('method can not run in process pool, '
+                                    'use a module level function instead')
+                handler = handler.__func__.__get__(self.proxy)
+            future = self.executors.submit(
+                policy, handler, data, getattr(handler, 'padchat_callback',
+                                               None))
+            if self._handler_futures is not None:
+                self._handler_futures.append(asyncio.wrap_future(future))
+        except Exception:
+            logger.error('处理函数出错: {}'.format(
+                getattr(handler, '__name__', handler)), exc_info=True)
+
+    def _track_handler(self, future):
+        if self._handler_futures is not None:
+            self._handler_futures.append(future)
+
+    def _call_hook(self, name, push):
+        self._call_handler(getattr(self, name), push)
+
     def event_msg_route(self, msg):
-        EVENT_MAP = {
-            'qrcode': self.event_qrcode,    # 二维码
-            'scan': self.event_scan,        # 扫码
-            'push': self.event_push,        # 新消息
-            'login': self.event_login,      # 登录
-            'logout': self.event_logout,    # 注销登录
-            'loaded': self.event_loaded,    # 通讯录载入完毕
-            'over': self.event_over,        # 实例关闭
-            'warn': self.event_warn,        # 异常消息
-            'contact': self.event_contact,  # 联系人
-            'sns': self.event_sns,          # 朋友圈
-            'notify': self.event_notify,    # 推送通知
-        }
+        events, _ = self._dispatch_tables()
         response_event = msg.get('event')
-        event_callback = EVENT_MAP.get(response_event, None)
-        if not event_callback:
+        handlers = events.get(response_event)
+        if not handlers:
             logger.error('unknow event: {response_event} body: {msg}'.format(
                 response_event=response_event, msg=msg
             ))
-        else:
-            event_callback(msg.get('payload'))
+            return
+        payload = msg.get('payload')
+        handlers[0](payload)
+        for handler in handlers[1:]:
+            self._call_handler(handler, payload)
 
     # event 函数 ###############################################################
 
@@ -45,8 +206,8 @@ class PadChatEventMixin:
         '''
         error = data.get('error', None)
         if error == '接收推送信息异常！':
-            self.logout()
-            self.close()
+            self.spawn(self.logout())
+            self.spawn(self.close())
 
     def event_qrcode(self, data):
         '''
@@ -118,6 +279,7 @@ class PadChatEventMixin:
             if sub_status == 0:
                 logger.info('扫码成功！登录成功！')
                 self.user = User(**data)
+                self._metrics.account = self.user.wx_id
             elif sub_status == 1:
                 logger.info('扫码成功！登录失败！')
                 self.re_init_padchat()
@@ -131,12 +293,12 @@ class PadChatEventMixin:
             self._scan_tip = False
             self._is_scan_tip = False
             logger.info('将重新获取登录二维码')
-            self.login_padchat(LoginType.qrcode)
+            self.spawn(self.login_padchat(LoginType.qrcode))
         elif status is 4:
             logger.info('手机端已取消登录')
             self._scan_tip = False
             self._is_scan_tip = False
-            self.login_padchat(LoginType.qrcode)
+            self.spawn(self.login_padchat(LoginType.qrcode))
 
     def event_push(self, data: dict):
         '''
@@ -144,76 +306,152 @@ class PadChatEventMixin:
         :param data: 
         :return: 
         '''
-        for push in data.get('list', []):
-            sub_type = push.get('sub_type')
-            if not sub_type or sub_type in (2048, 32768):
-                # 无意义推送
+        _, table = self._dispatch_tables()
+        journal = self.journal
+        pushes = []
+        for item in data.get('list', []):
+            push = PushMessage(item)
+            msg_id = push.msg_id
+            if msg_id is not None and self.dedup.seen(str(msg_id)):
+                # 重连、同步消息后重复推送的消息
+                self._metrics.duplicates.inc()
                 continue
-            elif sub_type == 1:
-                if push.get('from_user') == self.user.wx_id:
-                    self.self_text_msg(push)
-                else:
-                    self.text_msg(push)
-            elif sub_type == 2:
-                logger.debug('好友信息推送，包含好友，群，公众号信息')
-            elif sub_type == 3:
-                self.image_msg(push)
-            elif sub_type == 34:
-                logger.debug('语音消息')
-                self.voice_msg(push)
-            elif sub_type == 37:
-                self.friend_invite_msg(push)
-            elif sub_type == 42:
-                logger.debug('名片消息')
-            elif sub_type == 43:
-                logger.debug('视频消息')
-            elif sub_type == 47:
-                logger.debug('表情消息')
-            elif sub_type == 48:
-                logger.debug('定位消息')
-            elif sub_type == 49:
-                logger.debug('APP消息')
-                content = push.get('content')
-                if self._is_group_msg(push):
-                    from_user, content = content.split(':\n', 1)
-                xml = minidom.parseString(content)
-                appmsg = xml.getElementsByTagName('appmsg')[0]
-                type = appmsg.getElementsByTagName('type')[0].childNodes[0].data
-                if type == '2000':
-                    # 转账
-                    if push.get('from_user') != self.user.wx_id:
-                        # 转账给他人不触发事件，仅针对收到其他人转账
-                        self.transfer_msg(push)
-                elif type == '2001':
-                    # 红包
-                    self.red_packet_msg(push)
-                elif type == '5':
-                    # 收款通知
-                    self.zhifu_msg(push)
-                else:
-                    self.app_msg(push)
-            elif sub_type == 50:
-                logger.debug('语音通话')
-            elif sub_type == 62:
-                logger.debug('小视频')
-            elif sub_type == 3000:
-                logger.debug('群邀请')
-            elif sub_type == 9999:
-                logger.debug('系统通知')
-            elif sub_type == 10000:
-                logger.debug('微信通知信息')
-                if '為朋友，現在可以聊天了。' in push.get('content'):
-                    self.add_friend_msg(push)
-                elif '，现在可以开始聊天了。' in push.get('content'):
-                    self.add_friend_msg(push)
-            elif sub_type == 10002:
-                logger.debug('撤回消息')
+            pushes.append((journal.append(item) if journal is not None
+                           else None, push))
+        if journal is not None:
+            # 整批推送写入日志后再分发
+            journal.flush()
+        for offset, push in pushes:
+            if offset is None:
+                self._dispatch_push(table, push)
             else:
-                logger.debug('其他信息: ', push)
-            logger.debug(push)
+                self._journal_done(offset, self._dispatch_push(table, push,
+                                                               track=True))
+
+    def _dispatch_push(self, table, push, track=False):
+        '''
+        :param track: 是否收集异步处理函数的future
+        :return: 未完成的处理函数future列表
+        '''
+        if track:
+            self._handler_futures = []
+        try:
+            for handler in table.get(push.get('sub_type'),
+                                     table.get(None, ())):
+                self._call_handler(handler, push)
+        finally:
+            futures, self._handler_futures = self._handler_futures, None
+        self.wire_log.push(push)
+        return futures
+
+    def _journal_done(self, offset, futures):
+        '''
+        处理函数全部完成后记录已处理；被取消的处理函数视为未处理，重启后重放
+        '''
+        journal = self.journal
+        pending = [future for future in futures or () if not future.done()]
+        if any(future.cancelled() for future in futures or ()
+               if future.done()):
+            return
+        if not pending:
+            journal.done(offset)
+            return
+        remaining = [len(pending)]
+
+        def done(future):
+            if future.cancelled():
+                remaining[0] = -1
+            elif remaining[0] > 0:
+                remaining[0] -= 1
+                if not remaining[0]:
+                    journal.done(offset)
+
+        for future in pending:
+            future.add_done_callback(done)
+
+    def replay_journal(self):
+        '''
+        重放推送日志中上次未处理的推送，登录后在处理新推送前调用
+        '''
+        journal = self.journal
+        if journal is None or not journal.pending:
+            return
+        _, table = self._dispatch_tables()
+        count = 0
+        for offset, item in journal.replay():
+            push = PushMessage(item)
+            if push.msg_id is not None:
+                self.dedup.seen(str(push.msg_id))
+            self._journal_done(offset, self._dispatch_push(table, push,
+                                                           track=True))
+            count += 1
+        logger.info('已重放{}条未处理的推送'.format(count))
+
+    def _push_text(self, push):
+        if push.get('from_user') == self.user.wx_id:
+            if self.commands:
+                self._route_command(push, CommandScope.self)
+            self._call_hook('self_text_msg', push)
+            return
+        is_group = push.is_group
+        if self.commands:
+            self._route_command(push, CommandScope.group if is_group
+                                else CommandScope.person)
+        if self._is_overridden('text_msg'):
+            self._call_hook('text_msg', push)
+        else:
+            self._call_hook('group_text_msg' if is_group
+                            else 'person_text_msg', push)
+        if self.handlers.has_text_handlers:
+            for handler in self.handlers.text_handlers(is_group):
+                self._call_handler(handler, push)
+
+    def _route_command(self, push, scope):
+        try:
+            matched = self.commands.match(push, scope)
+            if matched is not None:
+                handler, match = matched
+                result = handler(push, match)
+                if inspect.isawaitable(result):
+                    self._track_handler(self.spawn(result))
+        except Exception:
+            logger.error('命令处理出错', exc_info=True)
+
+    def _push_contact(self, push):
+        self.directory.update_contact(push)
+
+    def _push_app(self, push):
+        type = push.app.type
+        if type == '2000':
+            # 转账
+            if push.get('from_user') != self.user.wx_id:
+                # 转账给他人不触发事件，仅针对收到其他人转账
+                self._call_hook('transfer_msg', push)
+        elif type == '2001':
+            # 红包
+            self._call_hook('red_packet_msg', push)
+        elif type == '5':
+            # 收款通知
+            self._call_hook('zhifu_msg', push)
+        else:
+            self._call_hook('app_msg', push)
+        for handler in self.handlers.app_handlers(type):
+            self._call_handler(handler, push)
+
+    def _push_notice(self, push):
+        # 群成员、群名等变化通知，本地通讯录数据需重新获取
+        self.directory.invalidate(push.get('from_user'))
+        if '為朋友，現在可以聊天了。' in push.get('content'):
+            self._call_hook('add_friend_msg', push)
+        elif '，现在可以开始聊天了。' in push.get('content'):
+            self._call_hook('add_friend_msg', push)
 
     def event_loaded(self, data):
-        logger.info('同步通讯录完成')
+        if self._contact_streams:
+            for stream in list(self._contact_streams):
+                stream.loaded()
+        else:
+            logger.info('同步通讯录完成')
 
     def event_over(self, data):
         '''
@@ -230,7 +468,16 @@ class PadChatEventMixin:
         :param data: 
         :return: 
         '''
-        pass
+        contacts = data if isinstance(data, list) else [data]
+        if self._contact_streams:
+            # 由流式同步写入各自的sink
+            for stream in list(self._contact_streams):
+                for contact in contacts:
+                    stream.feed(contact)
+            return
+        for contact in contacts:
+            if isinstance(contact, dict):
+                self.directory.update_contact(contact)
 
     def event_sns(self, data):
         '''
@@ -247,11 +494,13 @@ class PadChatEventMixin:
         :return: 
         '''
         if data.get('type') == 4:
-            self.sync_contact()
+            self.spawn(self.sync_contact())
         else:
-            self.sync_msg()
+            self.spawn(self.sync_msg())
 
 
     def _is_group_msg(self, context):
+        if isinstance(context, PushMessage):
+            return context.is_group
         from_user = context.get('from_user')
         return from_user.endswith('@chatroom')
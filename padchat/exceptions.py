@@ -13,3 +13,14 @@ class InvalidateValueError(PadchatException):
 class InstanceNotInit(PadchatException):
     pass
 
+
+class RequestTimeout(PadchatException):
+    pass
+
+
+class ConnectionClosed(PadchatException):
+    pass
+
+
+class OutboxFull(PadchatException):
+    pass
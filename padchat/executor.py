@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import concurrent.futures
+import inspect
+import threading
+import time
+
+from .logger import logger
+
+
+class ExecutionPolicy:
+    inline = 'inline' # 在事件循环中直接执行
+    thread = 'thread' # 线程池
+    process = 'process' # 进程池
+
+    policies = (inline, thread, process)
+
+
+def run_in(policy, callback=None):
+    '''
+    指定处理函数的执行方式
+    :param policy: ExecutionPolicy
+    :param callback: 进程池执行完成后在事件循环中回调 callback(data, result)
+    :return:
+
+    eg. 图片识别放在线程池执行
+        class Client(PadchatClient):
+            @run_in(ExecutionPolicy.thread)
+            def image_msg(self, context):
+                result = self.get_msg_image(context).result()
+    '''
+    if policy not in ExecutionPolicy.policies:
+        raise ValueError('unknow execution policy: {}'.format(policy))
+
+    def decorator(handler):
+        handler.padchat_policy = policy
+        handler.padchat_callback = callback
+        return handler
+    return decorator
+
+
+class ExecutorStats:
+    '''
+    执行统计，wait为提交到开始执行的排队时间，run为执行时间
+    '''
+    __slots__ = ('submitted', 'completed', 'failed', 'total_wait',
+                 'total_run', 'max_run')
+
+    def __init__(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.total_run = 0.0
+        self.max_run = 0.0
+
+    def record(self, wait, run, failed=False):
+        self.completed += 1
+        if failed:
+            self.failed += 1
+        self.total_wait += wait
+        self.total_run += run
+        self.max_run = max(self.max_run, run)
+
+    def as_dict(self):
+        done = self.completed or 1
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'pending': self.submitted - self.completed,
+            'avg_wait': self.total_wait / done,
+            'avg_run': self.total_run / done,
+            'max_run': self.max_run,
+        }
+
+
+def _timed_call(handler, data, submitted):
+    # 在工作线程或进程中执行，time.time可跨进程比较
+    start = time.time()
+    try:
+        result = handler(data)
+    except Exception as e:
+        return start - submitted, time.time() - start, None, e
+    return start - submitted, time.time() - start, result, None
+
+
+class HandlerExecutors:
+    '''
+    处理函数执行器，线程池及进程池在首次使用时创建，可在多个客户端间共用
+    '''
+
+    def __init__(self, thread_workers=None, process_workers=None):
+        '''
+        :param thread_workers: 线程池大小，默认按CPU数量
+        :param process_workers: 进程池大小，默认为CPU数量
+        '''
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self._pools = {}
+        self._stats = {policy: ExecutorStats()
+                       for policy in ExecutionPolicy.policies}
+
+    def _pool(self, policy):
+        pool = self._pools.get(policy)
+        if pool is None:
+            if policy == ExecutionPolicy.thread:
+                pool = concurrent.futures.ThreadPoolExecutor(
+                    self.thread_workers)
+            else:
+                pool = concurrent.futures.ProcessPoolExecutor(
+                    self.process_workers)
+            self._pools[policy] = pool
+        return pool
+
+    def run_inline(self, handler, data):
+        stats = self._stats[ExecutionPolicy.inline]
+        stats.submitted += 1
+        start = time.time()
+        try:
+            result = handler(data)
+        except Exception:
+            stats.record(0, time.time() - start, failed=True)
+            raise
+        if inspect.isawaitable(result):
+            # 协程处理函数，完成时再记录
+            def done(future):
+                error = None if future.cancelled() else future.exception()
+                stats.record(0, time.time() - start, failed=error is not None)
+                if error is not None:
+                    logger.error('处理函数出错: {}'.format(
+                        getattr(handler, '__name__', handler)),
+                        exc_info=error)
+
+            result = asyncio.ensure_future(result)
+            result.add_done_callback(done)
+        else:
+            stats.record(0, time.time() - start)
+        return result
+
+    def submit(self, policy, handler, data, callback=None):
+        '''
+        提交到线程池或进程池执行
+        :param callback: 完成后在事件循环中回调 callback(data, result)
+        :return: concurrent.futures.Future
+        '''
+        stats = self._stats[policy]
+        stats.submitted += 1
+        loop = asyncio.get_event_loop()
+        future = self._pool(policy).submit(_timed_call, handler, data,
+                                           time.time())
+
+        def finish(wait, run, result, error):
+            # 在事件循环线程中记录，统计不需要加锁
+            stats.record(wait, run, failed=error is not None)
+            if error is not None:
+                logger.error('处理函数出错: {}'.format(
+                    getattr(handler, '__name__', handler)), exc_info=error)
+            elif callback is not None:
+                callback(data, result)
+
+        def done(future):
+            # 在工作线程或进程池的管理线程中执行
+            try:
+                wait, run, result, error = future.result()
+            except Exception as e:
+                # 进程池中处理函数或数据无法序列化等
+                wait, run, result, error = 0, 0, None, e
+            try:
+                loop.call_soon_threadsafe(finish, wait, run, result, error)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+
+        future.add_done_callback(done)
+        return future
+
+    def stats(self):
+        return {policy: stats.as_dict()
+                for policy, stats in self._stats.items()}
+
+    def shutdown(self, wait=True):
+        for pool in self._pools.values():
+            pool.shutdown(wait=wait)
+        self._pools.clear()
+
+
+class LoopProxy:
+    '''
+    客户端的线程安全代理
+
+    在工作线程中调用协程接口时，转到事件循环中执行，并返回
+    concurrent.futures.Future；普通方法及属性与直接访问客户端相同，
+    需修改客户端状态时使用call转到事件循环中执行。在事件循环线程中调用
+    则与直接调用客户端相同
+    '''
+
+    def __init__(self, client, loop=None):
+        self._client = client
+        self._loop = loop or asyncio.get_event_loop()
+        self._thread = threading.get_ident()
+
+    def __getattr__(self, name):
+        value = getattr(self._client, name)
+        if not inspect.iscoroutinefunction(
+                getattr(type(self._client), name, None)):
+            return value
+
+        def call(*args, **kwargs):
+            if threading.get_ident() == self._thread:
+                return value(*args, **kwargs)
+            return asyncio.run_coroutine_threadsafe(value(*args, **kwargs),
+                                                    self._loop)
+        return call
+
+    def call(self, func, *args, **kwargs):
+        '''
+        在事件循环中执行func，如更新本地通讯录
+
+        eg. 线程池中执行的接口方法内
+            self.call(self.directory.update_contact, contact).result()
+        :return: concurrent.futures.Future，在事件循环线程中调用时已完成
+        '''
+        future = concurrent.futures.Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+        if threading.get_ident() == self._thread:
+            run()
+        else:
+            self._loop.call_soon_threadsafe(run)
+        return future
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import collections
+
+from .cache import MediaCache
+from .executor import HandlerExecutors
+from .generic import PadchatClient
+from .media import UploadCache
+from .logger import logger
+
+
+def profile_name(profile, default=None):
+    '''
+    已保存用户数据的账号名称，优先使用uin
+    '''
+    user = profile.get('user')
+    for key in ('uin', 'wx_id', 'nick_name'):
+        value = getattr(user, key, None)
+        if value:
+            return str(value)
+    return default
+
+
+class PadchatFleet:
+    '''
+    多账号管理，所有账号运行在同一个事件循环中
+
+    媒体缓存、上传编码缓存及处理函数执行器由所有账号共用；通讯录、发送调度、
+    指令队列及心跳为每个账号独立，单个账号出错或断线不影响其他账号
+    '''
+
+    def __init__(self, url, client_class=PadchatClient, stagger=1.0,
+                 media_cache=None, upload_cache=None, executors=None,
+                 **client_kwargs):
+        '''
+        :param url: Padchat服务器地址
+        :param client_class: 客户端类，PadchatClient子类
+        :param stagger: 启动间隔秒数，避免同时登录
+        :param media_cache: 共用的媒体下载缓存MediaCache
+        :param upload_cache: 共用的媒体上传编码缓存UploadCache
+        :param executors: 共用的处理函数执行器HandlerExecutors
+        :param client_kwargs: 创建客户端的其他参数，如codec、wire_log
+        '''
+        self.url = url
+        self.client_class = client_class
+        self.stagger = stagger
+        self.media_cache = media_cache or MediaCache()
+        self.upload_cache = upload_cache or UploadCache()
+        self.executors = executors or HandlerExecutors()
+        self.client_kwargs = client_kwargs
+        self._clients = collections.OrderedDict()
+        self._started = set()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __iter__(self):
+        return iter(self._clients.values())
+
+    def __contains__(self, name):
+        return name in self._clients
+
+    def __getitem__(self, name):
+        return self._clients[name]
+
+    def add(self, name, user=None, wx_data=None, token=None, **kwargs):
+        '''
+        添加账号
+        :param name: 账号名称，如昵称或wxid
+        :param user: 已保存的用户数据，见PadchatClient.load_users
+        :param kwargs: 该账号的客户端参数，覆盖创建fleet时的参数
+        :return: 客户端
+        '''
+        if name in self._clients:
+            raise KeyError('account already exists: {}'.format(name))
+        options = dict(self.client_kwargs, media_cache=self.media_cache,
+                       upload_cache=self.upload_cache,
+                       executors=self.executors)
+        options.update(kwargs)
+        client = self.client_class(user, wx_data, token, **options)
+        self._clients[name] = client
+        return client
+
+    def add_users(self, profiles=None):
+        '''
+        添加所有已保存的账号
+        :param profiles: 用户数据列表，默认读取本地保存的全部用户
+        '''
+        if profiles is None:
+            profiles = self.client_class.load_users()
+        for profile in profiles:
+            name = profile_name(profile, default=str(len(self._clients)))
+            if name not in self._clients:
+                self.add(name, **profile)
+
+    def remove(self, name):
+        '''
+        移除账号并断开连接，不注销微信
+        '''
+        client = self._clients.pop(name)
+        self._started.discard(name)
+        client.disconnect()
+        return client
+
+    async def start(self):
+        '''
+        按stagger间隔依次连接未启动的账号
+        '''
+        for name, client in list(self._clients.items()):
+            if name in self._started:
+                continue
+            try:
+                client.connect(self.url)
+            except Exception:
+                logger.error('账号启动失败: {}'.format(name), exc_info=True)
+                continue
+            self._started.add(name)
+            if self.stagger:
+                await asyncio.sleep(self.stagger)
+
+    def stop(self):
+        '''
+        断开所有账号
+        '''
+        for name in list(self._started):
+            try:
+                self._clients[name].disconnect()
+            except Exception:
+                logger.error('账号断开失败: {}'.format(name), exc_info=True)
+        self._started.clear()
+
+    def run(self):
+        loop = asyncio.get_event_loop()
+        loop.create_task(self.start())
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            self.stop()
+        finally:
+            self.executors.shutdown(wait=False)
+
+    def stats(self):
+        '''
+        各账号状态：是否已登录、等待回应的指令数量、发送排队数量、重连状态
+        '''
+        return {
+            name: {
+                'started': name in self._started,
+                'alive': client._alive,
+                'inflight': len(client._msg_queue),
+                'queued': client._scheduler.depth,
+                'reconnect': client.reconnect.state,
+                'reconnects': client.reconnect.reconnects,
+            } for name, client in self._clients.items()
+        }
@@ -1,45 +1,41 @@
 #!/usr/bin/env python
 # -*- coding:utf-8 -*- 
 # Author: Ben Chen
-from tornado import ioloop
-from tornado import gen
-import time
+import asyncio
 
 from .api import PadChatAPIMixin
 from .constant import LoginType
 from .base import BasePadchatClient
+from .broadcast import PadchatBroadcastMixin
 from .event import PadChatEventMixin
 from .push import PadchatPushMixin
 from .logger import logger
 
 
-class PadchatClient(PadChatEventMixin, PadChatAPIMixin, PadchatPushMixin,
-                    BasePadchatClient):
+class PadchatClient(PadChatEventMixin, PadChatAPIMixin, PadchatBroadcastMixin,
+                    PadchatPushMixin, BasePadchatClient):
     def _on_connection_success(self):
         super()._on_connection_success()
-        self.init_padchat()
+        self.spawn(self.init_padchat())
 
     def re_init_padchat(self):
         logger.info('将重新初始化实例')
-        ioloop.IOLoop.instance().spawn_callback(self.init_padchat)
+        self.spawn(self.init_padchat())
 
-    @gen.coroutine
-    def init_padchat(self):
-        yield self.init()
+    async def init_padchat(self):
+        await self.init()
         self._init = True
         logger.info('初始化成功')
-        time.sleep(1)
+        await asyncio.sleep(self.reconnect.login_delay)
 
-        if self.user:
-            yield self.login_padchat(LoginType.auto, token=self._token)
+        if self.user and self._token and self._wx_data:
+            # 使用缓存的token及设备数据恢复登录
+            await self.login_padchat(LoginType.auto, token=self._token)
         else:
-            yield self.login_padchat(LoginType.qrcode)
+            await self.login_padchat(LoginType.qrcode)
 
-        self._first_push_event = False
-
-    @gen.coroutine
-    def wx_data_padchat(self):
-        result = yield self.get_wx_data()
+    async def wx_data_padchat(self):
+        result = await self.get_wx_data()
         if result.get('success') is True:
             wx_data = result['data'].get('wx_data')
             logger.info('获取实例设备数据成功')
@@ -47,9 +43,8 @@ class PadchatClient(PadChatEventMixin, PadChatAPIMixin, PadchatPushMixin,
         else:
             logger.error('获取实例设备数据失败')
 
-    @gen.coroutine
-    def login_token_padchat(self):
-        result = yield self.get_login_token()
+    async def login_token_padchat(self):
+        result = await self.get_login_token()
         if result.get('success') is True:
             token = result['data'].get('token')
             logger.info('获取实例登录Token成功')
@@ -57,32 +52,30 @@ class PadchatClient(PadChatEventMixin, PadChatAPIMixin, PadchatPushMixin,
         else:
             logger.error('获取实例登录Token失败')
 
-    @gen.coroutine
-    def login_padchat(self, login_type: str, **kwargs):
+    async def login_padchat(self, login_type: str, **kwargs):
 
-        result = yield self.login(type=login_type, **kwargs)
+        result = await self.login(type=login_type, **kwargs)
 
         if result.get('success') == True:
             logger.debug(result.get('msg'))
         else:
             if result.get('data', {}).get('status') == -2023:
                 logger.error('尝试断线重连失败，尝试其他登录方式')
-                result = yield self.login_padchat(LoginType.request, token=self._token)
+                result = await self.login_padchat(LoginType.request, token=self._token)
             elif result.get('data', {}).get('status') in (-2017, -100):
                 logger.error('尝试toten登录失败，尝试二维码方式登陆')
-                result = yield self.login_padchat(LoginType.qrcode)
+                result = await self.login_padchat(LoginType.qrcode)
             else:
                 logger.error('登录请求失败。将关闭实例后重新建立实例。')
-                self.close()
+                await self.close()
                 return
         return result
 
-    @gen.coroutine
-    def save_user_padchat(self):
+    async def save_user_padchat(self):
         if not self._wx_data:
-            yield self.wx_data_padchat()
+            await self.wx_data_padchat()
 
-        yield self.login_token_padchat()
+        await self.login_token_padchat()
         if self._wx_data and self._token:
             self._token = self._token
             if self.save_user():
@@ -92,22 +85,23 @@ class PadchatClient(PadChatEventMixin, PadChatAPIMixin, PadchatPushMixin,
         else:
             logger.error('保存用户登陆信息失败。')
 
-    def event_push(self, data: dict):
-        if self._first_push_event:
-            super().event_push(data)
-        else:
-            self._first_push_event = True
-
     def event_login(self, data):
         super().event_login(data)
-        self.save_user_padchat()
+        self.reconnect.logged_in()
+        self.replay_journal()
+        self.flush_outbox()
+        self.spawn(self.save_user_padchat())
 
     def event_over(self, data):
         super().event_over(data)
         self.re_init_padchat()
 
     def run(self):
+        loop = asyncio.get_event_loop()
         try:
-            ioloop.IOLoop.instance().start()
+            loop.run_forever()
         except KeyboardInterrupt:
-            self.close()
+            try:
+                loop.run_until_complete(asyncio.wait_for(self.close(), 5))
+            except Exception:
+                logger.warning('关闭实例未收到回应')
@@ -0,0 +1,345 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import os
+import struct
+import threading
+import zlib
+
+from .codec import default_codec
+from .logger import logger
+
+
+# 记录头：内容长度、crc32、标志位
+_HEADER = struct.Struct('<IIB')
+_COMPRESSED = 1
+_SEGMENT_SUFFIX = '.log'
+
+
+class PushJournal:
+    '''
+    推送消息日志
+
+    event_push在分发前将推送写入日志并flush到系统，处理函数全部完成后记录
+    该序号；进程崩溃后重启时重放未处理的推送。处理完成的顺序可能与序号不同，
+    检查点只推进到连续完成的最大序号。fsync在线程池中按fsync_interval合并
+    执行，断电时最多丢失最近一个间隔的记录
+
+    目录中按首条记录序号命名分段文件，单个文件超过segment_size后新建分段，
+    已全部处理的分段在保存检查点时删除
+    '''
+
+    def __init__(self, directory=None, segment_size=64 * 1024 * 1024,
+                 fsync_interval=0.05, compress=True, compress_min=512,
+                 codec=None):
+        '''
+        :param directory: 日志目录，默认为当前目录下的journal
+        :param segment_size: 分段文件大小上限，字节
+        :param fsync_interval: 合并fsync的间隔秒数，0为每次flush都fsync，
+            None为不主动fsync
+        :param compress: 是否zlib压缩较大的记录
+        :param compress_min: 超过多少字节才压缩
+        :param codec: json编解码，默认选择已安装的最快实现
+        '''
+        self.directory = directory or os.path.join(os.getcwd(), 'journal')
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.compress = compress
+        self.compress_min = compress_min
+        self.codec = codec or default_codec()
+
+        self.checkpoint = 0     # 此序号及之前的记录均已处理
+        self._saved_checkpoint = 0
+        self._written_checkpoint = 0
+        self._checkpoint_lock = threading.Lock()
+        self._completed = set()  # 检查点之后已处理的序号
+        self._next = 1          # 下一条记录的序号
+        self._file = None
+        self._segment_start = None
+        self._segment_bytes = 0
+        self._unsynced = False
+        self._timer = None
+        self._syncing = None    # 线程池中执行的fsync
+        self._resync = False    # fsync期间又有新的写入或检查点
+        # 统计
+        self.appended = 0
+        self.syncs = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._load_checkpoint()
+        self._recover()
+        # 启动前写入的记录由replay重放，之后的由event_push分发
+        self._replayed = self.checkpoint
+        self._replay_end = self._next
+
+    # 文件 ####################################################################
+
+    @property
+    def _checkpoint_file(self):
+        return os.path.join(self.directory, 'checkpoint')
+
+    def _segment_path(self, start):
+        return os.path.join(self.directory,
+                            '{:020d}{}'.format(start, _SEGMENT_SUFFIX))
+
+    def _segments(self):
+        '''
+        :return: 按序号排列的分段首条记录序号
+        '''
+        return sorted(int(name[:-len(_SEGMENT_SUFFIX)])
+                      for name in os.listdir(self.directory)
+                      if name.endswith(_SEGMENT_SUFFIX))
+
+    def _load_checkpoint(self):
+        try:
+            with open(self._checkpoint_file) as f:
+                self.checkpoint = self._saved_checkpoint = \
+                    self._written_checkpoint = int(f.read())
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logger.error('推送日志检查点已损坏，将重放全部记录')
+
+    def _save_checkpoint(self, checkpoint):
+        '''
+        写入检查点并删除已处理的分段，可在线程池中执行
+        '''
+        with self._checkpoint_lock:
+            if checkpoint <= self._written_checkpoint:
+                return
+            tmp = self._checkpoint_file + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(str(checkpoint))
+            os.replace(tmp, self._checkpoint_file)
+            self._written_checkpoint = checkpoint
+            self._compact(checkpoint)
+
+    def _compact(self, checkpoint):
+        # 下一分段的首条记录已处理时，当前分段可以删除
+        segments = self._segments()
+        for start, next_start in zip(segments, segments[1:]):
+            if next_start > checkpoint + 1:
+                break
+            os.remove(self._segment_path(start))
+
+    def _read(self, path):
+        '''
+        逐条读取分段中的记录
+        :return: 生成(记录结束位置, 内容)
+        '''
+        with open(path, 'rb') as f:
+            data = f.read()
+        position = 0
+        while position + _HEADER.size <= len(data):
+            length, crc, flags = _HEADER.unpack_from(data, position)
+            start = position + _HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                return
+            if flags & _COMPRESSED:
+                payload = zlib.decompress(payload)
+            position = start + length
+            yield position, payload
+
+    def _recover(self):
+        '''
+        找到最后一个分段的有效结尾，截断写入一半的记录
+        '''
+        segments = self._segments()
+        if not segments:
+            self._next = self.checkpoint + 1
+            return
+        start = segments[-1]
+        path = self._segment_path(start)
+        end = count = 0
+        for end, _ in self._read(path):
+            count += 1
+        if end != os.path.getsize(path):
+            logger.warning('推送日志{}结尾不完整，已截断'.format(path))
+            with open(path, 'r+b') as f:
+                f.truncate(end)
+        if start + count <= self.checkpoint:
+            # 分段已被删除或检查点超前，从新分段开始
+            self._next = self.checkpoint + 1
+            return
+        self._next = start + count
+        self._segment_start = start
+        self._segment_bytes = end
+        self._file = open(path, 'ab')
+
+    def _rotate(self):
+        if self._file is not None:
+            # 旧分段在线程池中fsync后关闭复制的文件描述符
+            self._file.flush()
+            asyncio.get_event_loop().run_in_executor(
+                None, self._sync_files, os.dup(self._file.fileno()), None)
+            self._file.close()
+            self._unsynced = False
+        self._segment_start = self._next
+        self._segment_bytes = 0
+        self._file = open(self._segment_path(self._next), 'ab')
+
+    # 写入 ####################################################################
+
+    def append(self, item: dict):
+        '''
+        写入一条推送，需调用flush后才写入系统
+        :return: 记录序号
+        '''
+        if self._file is None or self._segment_bytes >= self.segment_size:
+            self._rotate()
+        payload = self.codec.dumps(item)
+        flags = 0
+        if self.compress and len(payload) >= self.compress_min:
+            payload = zlib.compress(payload, 1)
+            flags |= _COMPRESSED
+        self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload),
+                                      flags))
+        self._file.write(payload)
+        self._segment_bytes += _HEADER.size + len(payload)
+        offset = self._next
+        self._next += 1
+        self.appended += 1
+        return offset
+
+    def flush(self):
+        '''
+        写入系统缓冲区，进程崩溃不会丢失；fsync按间隔合并在线程池中执行
+        '''
+        if self._file is None:
+            return
+        self._file.flush()
+        self._unsynced = True
+        self._schedule_sync()
+
+    def _schedule_sync(self):
+        if self.fsync_interval == 0:
+            self.sync_soon()
+        elif self.fsync_interval is not None and self._timer is None:
+            self._timer = asyncio.get_event_loop().call_later(
+                self.fsync_interval, self.sync_soon)
+
+    def _sync_files(self, fd, checkpoint):
+        # 在线程池中执行，fd为复制的文件描述符，分段关闭后仍然有效
+        if fd is not None:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        if checkpoint is not None:
+            self._save_checkpoint(checkpoint)
+
+    def _sync_args(self):
+        fd = checkpoint = None
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            fd = os.dup(self._file.fileno())
+            self._unsynced = False
+            self.syncs += 1
+        if self.checkpoint != self._saved_checkpoint:
+            checkpoint = self._saved_checkpoint = self.checkpoint
+        return fd, checkpoint
+
+    def sync_soon(self):
+        '''
+        在线程池中fsync当前分段并保存检查点，不阻塞事件循环
+        '''
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._syncing is not None:
+            # 上一次尚未完成，完成后再执行
+            self._resync = True
+            return
+        fd, checkpoint = self._sync_args()
+        if fd is None and checkpoint is None:
+            return
+        self._syncing = asyncio.get_event_loop().run_in_executor(
+            None, self._sync_files, fd, checkpoint)
+        self._syncing.add_done_callback(self._synced)
+
+    def _synced(self, future):
+        self._syncing = None
+        if not future.cancelled() and future.exception() is not None:
+            logger.error('推送日志fsync失败', exc_info=future.exception())
+        if self._resync:
+            self._resync = False
+            self.sync_soon()
+
+    def sync(self):
+        '''
+        立即fsync当前分段并保存检查点，在调用线程中执行，用于关闭时
+        '''
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._sync_files(*self._sync_args())
+
+    def done(self, offset):
+        '''
+        记录已处理的序号，检查点推进到连续完成的最大序号，与下次fsync一起保存
+        '''
+        if offset <= self.checkpoint:
+            return
+        completed = self._completed
+        completed.add(offset)
+        checkpoint = self.checkpoint
+        while checkpoint + 1 in completed:
+            checkpoint += 1
+            completed.discard(checkpoint)
+        if checkpoint != self.checkpoint:
+            self.checkpoint = checkpoint
+            self._schedule_sync()
+
+    @property
+    def pending(self):
+        '''
+        未处理的记录数量
+        '''
+        return self._next - 1 - self.checkpoint
+
+    # 重放 ####################################################################
+
+    def replay(self):
+        '''
+        读取启动前写入、尚未处理的记录，每条只返回一次
+        :return: 生成(序号, 推送内容)，处理完成后需调用done
+        '''
+        first = max(self.checkpoint, self._replayed) + 1
+        if first >= self._replay_end:
+            return
+        segments = self._segments()
+        for start, next_start in zip(segments, segments[1:] + [None]):
+            if next_start is not None and next_start <= first:
+                continue
+            offset = start
+            for _, payload in self._read(self._segment_path(start)):
+                if offset >= self._replay_end:
+                    return
+                if offset >= first and offset not in self._completed:
+                    self._replayed = offset
+                    try:
+                        item = self.codec.loads(payload)
+                    except ValueError:
+                        logger.error('推送日志记录{}无法解析'.format(offset))
+                        self.done(offset)
+                    else:
+                        yield offset, item
+                offset += 1
+
+    def close(self):
+        self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        return {
+            'offset': self._next - 1,
+            'checkpoint': self.checkpoint,
+            'pending': self.pending,
+            'segments': len(self._segments()),
+            'appended': self.appended,
+            'syncs': self.syncs,
+        }
@@ -1,4 +1,6 @@
 import logging
+import random
+import re
 import tornado.log
 
 
@@ -9,3 +11,118 @@ logger = logging.getLogger('padchat')
 
 tornado.log.enable_pretty_logging()
 # logger.setLevel(logging.DEBUG)
+
+# 收发指令日志，可单独设置级别及handler
+wire_logger = logging.getLogger('padchat.wire')
+
+
+class WireLogLevel:
+    off = 'off' # 不记录
+    summary = 'summary' # 仅记录类型、指令、长度
+    truncated = 'truncated' # 截断内容并隐藏base64数据
+    full = 'full' # 完整内容
+
+    levels = (off, summary, truncated, full)
+
+
+# 连续的base64字符，用于隐藏图片、语音等数据
+BASE64_PATTERN = re.compile(r'[A-Za-z0-9+/=\n]{128,}')
+
+
+class _WireRecord:
+    '''
+    延迟格式化的日志内容，只在handler实际输出时生成文本
+    '''
+    __slots__ = ('wire_log', 'direction', 'kind', 'name', 'cmd_id', 'raw')
+
+    def __init__(self, wire_log, direction, kind, name, cmd_id, raw):
+        self.wire_log = wire_log
+        self.direction = direction
+        self.kind = kind
+        self.name = name
+        self.cmd_id = cmd_id
+        self.raw = raw
+
+    def __str__(self):
+        return self.wire_log.format(self)
+
+
+class WireLog:
+    '''
+    收发指令日志
+    '''
+
+    def __init__(self, level=WireLogLevel.truncated, max_length=512,
+                 sample_rate=1.0, log_level=logging.INFO):
+        '''
+        :param level: 记录内容 WireLogLevel
+        :param max_length: truncated模式下最多记录的字符数
+        :param sample_rate: 采样比例，0-1
+        :param log_level: 日志级别
+        '''
+        if level not in WireLogLevel.levels:
+            raise ValueError('unknow wire log level: {}'.format(level))
+        self.level = level
+        self.max_length = max_length
+        self.sample_rate = sample_rate
+        self.log_level = log_level
+
+    def enabled(self):
+        if self.level == WireLogLevel.off or \
+                not wire_logger.isEnabledFor(self.log_level):
+            return False
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def inbound(self, msg: dict, raw):
+        '''
+        收到的消息
+        :param msg: 解析后的消息
+        :param raw: 原始文本帧
+        '''
+        if self.enabled():
+            wire_logger.log(self.log_level, '%s', _WireRecord(
+                self, '<<<', msg.get('type'),
+                msg.get('event') or msg.get('cmd'), msg.get('cmdId'), raw))
+
+    def outbound(self, cmd, cmd_id, raw):
+        '''
+        发送的指令
+        :param raw: 序列化后的指令，媒体数据为占位文本
+        '''
+        if self.enabled():
+            wire_logger.log(self.log_level, '%s', _WireRecord(
+                self, '>>>', 'cmd', cmd, cmd_id, raw))
+
+    def push(self, item: dict):
+        '''
+        推送消息明细，DEBUG级别
+        '''
+        if self.level != WireLogLevel.off and \
+                wire_logger.isEnabledFor(logging.DEBUG):
+            wire_logger.debug('%s', _WireRecord(
+                self, '<<<', 'push', item.get('sub_type'), item.get('msg_id'),
+                item))
+
+    def format(self, record):
+        raw = record.raw
+        summary = '{} {} {} cmdId={} {} bytes'.format(
+            record.direction, record.kind, record.name, record.cmd_id,
+            len(raw) if isinstance(raw, (str, bytes)) else '-')
+        if self.level == WireLogLevel.summary:
+            return summary
+        if self.level == WireLogLevel.full:
+            if isinstance(raw, bytes):
+                raw = raw.decode('utf-8', 'replace')
+            return '{} {}'.format(summary, raw)
+        if not isinstance(raw, (str, bytes)):
+            raw = str(raw)
+        # 先截取再解码，大的媒体帧不整体复制
+        text = raw[:self.max_length]
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', 'replace')
+        text = BASE64_PATTERN.sub(
+            lambda match: '<base64 {} chars>'.format(len(match.group(0))),
+            text)
+        if len(raw) > self.max_length:
+            text += '...'
+        return '{} {}'.format(summary, text)
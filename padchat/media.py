@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import base64
+import collections
+import hashlib
+import io
+import mmap
+import os
+
+# 分块编码大小，需为3的倍数，保证各块编码结果可直接拼接
+CHUNK_SIZE = 3 * 64 * 1024
+
+
+class Media:
+    '''
+    已编码为base64（无换行）的媒体数据，data为ascii bytes
+
+    发送指令时直接拼接进json文本，不再参与json序列化
+    '''
+    __slots__ = ('data',)
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __str__(self):
+        return self.data.decode('ascii')
+
+    @property
+    def placeholder(self):
+        # 序列化时的占位文本，同时用于日志输出
+        return '<media:{}:{} bytes>'.format(id(self), len(self.data))
+
+    def __repr__(self):
+        return self.placeholder
+
+
+def encode_media(file, cache=None):
+    '''
+    媒体数据编码为base64
+    :param file: 文件路径、bytes、memoryview、二进制文件对象、base64字符串或Media
+    :param cache: UploadCache，命中时跳过编码
+    :return: Media，传入base64字符串时原样返回
+    '''
+    if isinstance(file, Media):
+        return file
+    if isinstance(file, str) and not os.path.isfile(file):
+        # 已编码的base64字符串
+        return file
+    if cache is not None:
+        return cache.encode(file)
+    return _encode(file)
+
+
+def _encode(file):
+    if isinstance(file, str) or hasattr(file, '__fspath__'):
+        with open(file, 'rb') as f:
+            return _encode_file(f)
+    if isinstance(file, (bytes, bytearray, memoryview)):
+        return Media(base64.b64encode(file))
+    if hasattr(file, 'read'):
+        return _encode_file(file)
+    raise TypeError('unsupported media type: {}'.format(type(file)))
+
+
+def _encode_file(file):
+    try:
+        fileno = file.fileno()
+        offset = file.tell()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return _encode_chunks(file)
+    if os.fstat(fileno).st_size <= offset:
+        return Media(b'')
+    # 映射文件，编码时不再读入一份完整的文件内容
+    with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            encoded = base64.b64encode(view[offset:])
+        finally:
+            view.release()
+    file.seek(0, os.SEEK_END)
+    return Media(encoded)
+
+
+def _encode_chunks(file):
+    encoded = bytearray()
+    buffer = b''
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if buffer:
+            chunk = buffer + chunk
+        size = len(chunk) - len(chunk) % 3
+        encoded += base64.b64encode(memoryview(chunk)[:size])
+        buffer = chunk[size:]
+    if buffer:
+        encoded += base64.b64encode(buffer)
+    return Media(bytes(encoded))
+
+
+class UploadCache:
+    '''
+    上传编码缓存
+
+    文件按路径、修改时间和大小，bytes按sha1缓存编码结果，重复发送时跳过编码。
+    内存中按总大小LRU淘汰，指定directory时淘汰的数据写入磁盘
+    '''
+
+    def __init__(self, max_size=32 * 1024 * 1024, directory=None,
+                 max_disk_size=512 * 1024 * 1024):
+        '''
+        :param max_size: 内存缓存总大小上限，字节
+        :param directory: 磁盘缓存目录，None为不写入磁盘
+        :param max_disk_size: 磁盘缓存总大小上限，字节
+        '''
+        self.max_size = max_size
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.size = 0
+        self.disk_size = 0
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._disk = collections.OrderedDict()
+
+    def encode(self, file):
+        '''
+        编码媒体数据，参数同encode_media
+        '''
+        key = self._key(file)
+        if key is None:
+            self.misses += 1
+            return _encode(file)
+        media = self.get(key)
+        if media is not None:
+            self.hits += 1
+            if hasattr(file, 'seek'):
+                file.seek(0, os.SEEK_END)
+            return media
+        self.misses += 1
+        media = _encode(file)
+        self.put(key, media)
+        return media
+
+    @staticmethod
+    def _key(file):
+        if isinstance(file, str) or hasattr(file, '__fspath__'):
+            stat = os.stat(file)
+            return _stat_key(stat, 0)
+        if isinstance(file, (bytes, bytearray, memoryview)):
+            return 'sha1-' + hashlib.sha1(file).hexdigest()
+        try:
+            stat = os.fstat(file.fileno())
+            offset = file.tell()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return None
+        return _stat_key(stat, offset)
+
+    def get(self, key):
+        media = self._memory.get(key)
+        if media is not None:
+            self._memory.move_to_end(key)
+            return media
+        if key in self._disk:
+            self._disk.move_to_end(key)
+            with open(self._disk_path(key), 'rb') as file:
+                media = Media(file.read())
+            self.put(key, media)
+            return media
+        return None
+
+    def put(self, key, media):
+        if len(media) > self.max_size:
+            self._spill(key, media)
+            return
+        self._memory[key] = media
+        self.size += len(media)
+        while self.size > self.max_size:
+            old_key, old_media = self._memory.popitem(last=False)
+            self.size -= len(old_media)
+            self._spill(old_key, old_media)
+
+    def _disk_path(self, key):
+        return os.path.join(self.directory, key + '.b64')
+
+    def _spill(self, key, media):
+        if self.directory is None or key in self._disk:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._disk_path(key) + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(media.data)
+        os.replace(tmp_path, self._disk_path(key))
+        self._disk[key] = len(media)
+        self.disk_size += len(media)
+        while self.disk_size > self.max_disk_size and len(self._disk) > 1:
+            old_key, size = self._disk.popitem(last=False)
+            self.disk_size -= size
+            try:
+                os.remove(self._disk_path(old_key))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            'entries': len(self._memory),
+            'size': self.size,
+            'disk_entries': len(self._disk),
+            'disk_size': self.disk_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+def _stat_key(stat, offset):
+    return 'file-{}-{}-{}-{}-{}'.format(stat.st_dev, stat.st_ino,
+                                        stat.st_mtime_ns, stat.st_size,
+                                        offset)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import re
+
+from .appmsg import AppMsg
+
+
+AT_USER_LIST = re.compile(r'<atuserlist>(?:<!\[CDATA\[)?(.*?)(?:\]\]>)?'
+                          r'</atuserlist>', re.S)
+
+
+class PushMessage(dict):
+    '''
+    推送消息
+
+    仍为原始推送dict，可直接传给get_msg_image、receive_red_packet等接口；
+    群消息、发送者、正文、艾特列表等在首次访问时计算并缓存
+    '''
+    __slots__ = ('_sender', '_body', '_mentions', '_app')
+
+    @property
+    def sub_type(self):
+        return self.get('sub_type')
+
+    @property
+    def msg_id(self):
+        return self.get('msg_id')
+
+    @property
+    def is_group(self):
+        '''
+        是否为群内他人发送的消息
+        '''
+        return (self.get('from_user') or '').endswith('@chatroom')
+
+    @property
+    def room(self):
+        '''
+        群id，包含自己在群内发送的消息，非群消息为None
+        '''
+        for key in ('from_user', 'to_user'):
+            user = self.get(key) or ''
+            if user.endswith('@chatroom'):
+                return user
+        return None
+
+    def _split(self):
+        content = self.get('content') or ''
+        if self.is_group and ':\n' in content:
+            sender, _, content = content.partition(':\n')
+        else:
+            sender = self.get('from_user')
+        self._sender = sender
+        self._body = content
+
+    @property
+    def sender(self):
+        '''
+        实际发送者wxid，群消息为群内发送者
+        '''
+        try:
+            return self._sender
+        except AttributeError:
+            self._split()
+            return self._sender
+
+    @property
+    def body(self):
+        '''
+        消息正文，已去除群消息的发送者前缀
+        '''
+        try:
+            return self._body
+        except AttributeError:
+            self._split()
+            return self._body
+
+    @property
+    def mentions(self):
+        '''
+        被艾特的wxid列表
+        '''
+        try:
+            return self._mentions
+        except AttributeError:
+            match = AT_USER_LIST.search(self.get('msg_source') or '')
+            self._mentions = [user for user in match.group(1).split(',')
+                              if user] if match else []
+            return self._mentions
+
+    @property
+    def app(self):
+        '''
+        app消息（sub_type 49），其他消息为None
+        '''
+        try:
+            return self._app
+        except AttributeError:
+            self._app = AppMsg(self.body) if self.get('sub_type') == 49 \
+                else None
+            return self._app
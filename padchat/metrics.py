@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import bisect
+import weakref
+
+from tornado import web
+
+from .logger import logger
+
+
+# 指令回应耗时的默认分桶，秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{}="{}"'.format(name, _escape(value))
+             for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('{}="{}"'.format(*extra))
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help='', labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+
+    def _header(self):
+        return ['# HELP {} {}'.format(self.name, self.help),
+                '# TYPE {} {}'.format(self.name, self.type)]
+
+    def render(self):
+        lines = self._header()
+        for values, value in self._values.items():
+            lines.append('{}{} {}'.format(
+                self.name, _format_labels(self.labels, values), value))
+        return lines
+
+
+class Counter(_Metric):
+    '''
+    只增不减的计数
+    '''
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+
+class Gauge(_Metric):
+    '''
+    可增可减的数值
+    '''
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+
+class Histogram(_Metric):
+    '''
+    分桶统计，每个标签组合保存各桶计数、总和及次数
+    '''
+    type = 'histogram'
+
+    def __init__(self, name, help='', labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        data = self._values.get(labels)
+        if data is None:
+            # [各桶计数..., +Inf计数, 总和]
+            data = self._values[labels] = [0] * (len(self.buckets) + 1) + \
+                [0.0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def count(self, *labels):
+        data = self._values.get(labels)
+        return sum(data[:-1]) if data else 0
+
+    def render(self):
+        lines = self._header()
+        for values, data in self._values.items():
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), data[:-1]):
+                total += count
+                lines.append('{}_bucket{} {}'.format(
+                    self.name,
+                    _format_labels(self.labels, values, ('le', bound)),
+                    total))
+            labels = _format_labels(self.labels, values)
+            lines.append('{}_sum{} {}'.format(self.name, labels, data[-1]))
+            lines.append('{}_count{} {}'.format(self.name, labels, total))
+        return lines
+
+
+class MetricsRegistry:
+    '''
+    指标注册表
+
+    记录时只更新dict中的数值，导出时才生成文本；采集函数在导出时调用，
+    用于读取调度器、缓存等已有的统计
+    '''
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, help, labels, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError('metric {} is already registered as {}'.format(
+                name, metric.type))
+        return metric
+
+    def counter(self, name, help='', labels=()):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', labels=()):
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', labels=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def add_collector(self, collector):
+        '''
+        注册采集函数，返回[(指标名, help, {标签: 值}, 数值[, 来源对象])]，
+        按gauge导出；绑定方法只保存弱引用，客户端释放后自动移除
+
+        带来源对象的指标按对象去重，多个账号共用的对象只导出一次，
+        account标签为shared
+        '''
+        if hasattr(collector, '__self__'):
+            self._collectors.append(weakref.WeakMethod(collector))
+        else:
+            self._collectors.append(lambda: collector)
+
+    def _collect(self):
+        raw = []
+        owners = {}     # id(来源对象) -> 账号集合
+        alive = []
+        for ref in self._collectors:
+            collector = ref()
+            if collector is None:
+                continue
+            alive.append(ref)
+            try:
+                for sample in collector():
+                    source = sample[4] if len(sample) > 4 else None
+                    if source is not None:
+                        owners.setdefault(id(source), set()).add(
+                            sample[2].get('account'))
+                    raw.append((sample[:4], source))
+            except Exception:
+                logger.error('采集指标出错', exc_info=True)
+        self._collectors = alive
+        samples = {}
+        seen = set()
+        for (name, help, labels, value), source in raw:
+            if source is not None and len(owners[id(source)]) > 1:
+                labels = dict(labels, account='shared')
+            key = (name, tuple(labels.items()))
+            if key in seen:
+                continue
+            seen.add(key)
+            samples.setdefault(name, (help, []))[1].append((labels, value))
+        lines = []
+        for name, (help, values) in samples.items():
+            lines.append('# HELP {} {}'.format(name, help))
+            lines.append('# TYPE {} gauge'.format(name))
+            for labels, value in values:
+                lines.append('{}{} {}'.format(name, _format_labels(
+                    labels.keys(), labels.values()), value))
+        return lines
+
+    def render(self):
+        '''
+        Prometheus文本格式
+        '''
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        lines.extend(self._collect())
+        return '\n'.join(lines) + '\n'
+
+
+# 默认注册表，同一进程内的客户端共用
+default_registry = MetricsRegistry()
+
+
+def merge_rendered(rendered):
+    '''
+    合并多个注册表导出的文本，用于汇总多个进程的指标
+    :param rendered: [(附加标签dict, render()导出的文本)]，附加标签用于区分来源
+    :return: Prometheus文本格式，同名指标合并为一组
+    '''
+    families = {}   # 指标名 -> ([HELP、TYPE行], [数据行])
+    for extra, text in rendered:
+        extra = ','.join('{}="{}"'.format(name, _escape(value))
+                         for name, value in extra.items())
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith('#'):
+                family = families.setdefault(line.split(' ', 3)[2], ([], []))
+                if line not in family[0]:
+                    family[0].append(line)
+                continue
+            if family is None:
+                continue
+            if extra:
+                brace = line.find('{')
+                space = line.find(' ')
+                if 0 <= brace < space:
+                    line = '{}{},{}'.format(line[:brace + 1], extra,
+                                            line[brace + 1:])
+                else:
+                    line = '{}{{{}}}{}'.format(line[:space], extra,
+                                               line[space:])
+            family[1].append(line)
+    lines = []
+    for headers, samples in families.values():
+        lines.extend(headers)
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+class _AccountMetric:
+    '''
+    记录时在标签最前加上所属客户端的account标签，多个账号的数据不合并
+    '''
+    __slots__ = ('_metric', '_owner')
+
+    def __init__(self, metric, owner):
+        self._metric = metric
+        self._owner = owner
+
+    def inc(self, *labels, amount=1):
+        self._metric.inc(self._owner.account, *labels, amount=amount)
+
+    def dec(self, *labels, amount=1):
+        self._metric.dec(self._owner.account, *labels, amount=amount)
+
+    def set(self, value, *labels):
+        self._metric.set(value, self._owner.account, *labels)
+
+    def observe(self, value, *labels):
+        self._metric.observe(value, self._owner.account, *labels)
+
+    def value(self, *labels):
+        return self._metric.value(self._owner.account, *labels)
+
+    def count(self, *labels):
+        return self._metric.count(self._owner.account, *labels)
+
+
+class ClientMetrics:
+    '''
+    客户端使用的指标，均带account标签，登录后更新为wxid
+    '''
+
+    def __init__(self, registry, account):
+        self.account = account
+
+        def bind(metric):
+            return _AccountMetric(metric, self)
+
+        self.latency = bind(registry.histogram(
+            'padchat_cmd_latency_seconds', '指令往返耗时', ('account', 'cmd')))
+        self.commands = bind(registry.counter(
+            'padchat_cmd_total', '指令数量', ('account', 'cmd', 'result')))
+        self.inflight = bind(registry.gauge(
+            'padchat_cmd_inflight', '等待回应的指令数量', ('account',)))
+        self.frames = bind(registry.counter(
+            'padchat_inbound_frames_total', '收到的帧数', ('account', 'type')))
+        self.bytes = bind(registry.counter(
+            'padchat_inbound_bytes_total', '收到的字节数', ('account', 'type')))
+        self.duplicates = bind(registry.counter(
+            'padchat_push_duplicates_total', '丢弃的重复推送数量', ('account',)))
+        self.handlers = bind(registry.histogram(
+            'padchat_handler_seconds', '处理函数耗时', ('account', 'handler')))
+        self.reconnects = bind(registry.counter(
+            'padchat_reconnects_total', '重新连接次数', ('account',)))
+        self.reconnect_time = bind(registry.histogram(
+            'padchat_reconnect_seconds', '断线到重新连接的耗时', ('account',),
+            buckets=(1, 2, 5, 10, 30, 60, 120, 300, 600)))
+
+
+class _MetricsHandler(web.RequestHandler):
+    def initialize(self, registry):
+        self.registry = registry
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4')
+        self.write(self.registry.render())
+
+
+class MetricsExporter:
+    '''
+    在本地端口以Prometheus文本格式导出指标，运行在当前事件循环中
+    '''
+
+    def __init__(self, registry=None, port=9108, address='127.0.0.1',
+                 path='/metrics'):
+        self.registry = registry or default_registry
+        self.port = port
+        self.address = address
+        self.path = path
+        self._server = None
+
+    def start(self):
+        app = web.Application([
+            (self.path, _MetricsHandler, {'registry': self.registry}),
+        ])
+        self._server = app.listen(self.port, address=self.address)
+        logger.info('指标导出: http://{}:{}{}'.format(
+            self.address, self.port, self.path))
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import collections
+import itertools
+import json
+import os
+import time
+
+from .codec import JSONCodec
+from .exceptions import ConnectionClosed, OutboxFull, RequestTimeout
+from .logger import logger
+from .media import Media
+
+
+# 建立会话的指令，不经过发件箱
+SESSION_CMDS = frozenset({
+    'init', 'getWxData', 'login', 'getLoginToken', 'logout', 'close',
+})
+
+# 重复执行结果相同的指令：排队时相同内容只发送一次，连接中断未收到回应时
+# 重新排队；其他指令中断后直接失败，避免重复发送消息
+IDEMPOTENT_CMDS = frozenset({
+    'syncMsg', 'syncContact', 'getContact', 'searchContact', 'getMyInfo',
+    'getRoomMembers', 'getRoomQrcode', 'getUserQrcode', 'getMsgImage',
+    'getMsgVideo', 'getMsgVoice', 'queryTransfer', 'queryRedPacket',
+    'setRemark', 'setRoomName', 'setRoomAnnouncement', 'setHeadImg',
+})
+
+
+class _Entry:
+    __slots__ = ('id', 'cmd', 'type', 'data', 'timeout', 'priority',
+                 'expires', 'key', 'future', 'handle')
+
+    def __init__(self, id, cmd, type, data, timeout, priority, expires,
+                 key=None, future=None):
+        self.id = id
+        self.cmd = cmd
+        self.type = type
+        self.data = data
+        self.timeout = timeout
+        self.priority = priority
+        self.expires = expires      # time.time()
+        self.key = key
+        self.future = future        # 从文件恢复的指令没有等待方
+        self.handle = None
+
+    def dumps(self) -> bytes:
+        '''
+        序列化为一行，媒体数据以占位文本序列化后拼接，只复制一次
+        '''
+        data = self.data
+        media = []
+        if isinstance(data, dict):
+            media = [key for key, value in data.items()
+                     if isinstance(value, Media)]
+            if media:
+                data = {key: value.placeholder if isinstance(value, Media)
+                        else value for key, value in data.items()}
+        content = json.dumps({
+            'id': self.id, 'cmd': self.cmd, 'type': self.type,
+            'data': data, 'timeout': self.timeout,
+            'priority': self.priority, 'expires': self.expires,
+            'media': media,
+        }, ensure_ascii=False).encode('utf-8')
+        return JSONCodec.splice(content, [self.data[key] for key in media])
+
+    @classmethod
+    def loads(cls, id, record):
+        data = record['data']
+        for key in record.get('media') or ():
+            data[key] = Media(data[key].encode('ascii'))
+        return cls(id, record['cmd'], record['type'], data, record['timeout'],
+                   record['priority'], record['expires'])
+
+
+def _key(cmd, type, data):
+    # 媒体按对象区分，不把base64复制进key
+    return cmd, type, json.dumps(
+        data, sort_keys=True, ensure_ascii=False,
+        default=lambda value: value.placeholder if isinstance(value, Media)
+        else str(value))
+
+
+class Outbox:
+    '''
+    发件箱
+
+    连接中断或尚未登录时指令在此排队，登录后按顺序发送，同时最多pipeline
+    条等待回应；排队超过ttl秒的指令以RequestTimeout失败。指定path时排队的
+    指令同时写入文件，进程重启后登录时继续发送
+    '''
+
+    def __init__(self, max_size=1000, ttl=300, ttls=None, idempotent=None,
+                 pipeline=10, path=None):
+        '''
+        :param max_size: 最多排队的指令数量，超过时抛出OutboxFull
+        :param ttl: 指令排队的最长秒数
+        :param ttls: 按指令设置的排队秒数
+        :param idempotent: 幂等指令集合，默认为IDEMPOTENT_CMDS
+        :param pipeline: 发送时最多同时等待回应的指令数量
+        :param path: 保存排队指令的文件，None为只保存在内存
+        '''
+        self.max_size = max_size
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.idempotent = IDEMPOTENT_CMDS if idempotent is None \
+            else frozenset(idempotent)
+        self.pipeline = pipeline
+        self.path = path
+        self._entries = collections.deque()
+        self._keys = {}
+        self._ids = itertools.count(1)
+        self._flushing = False
+        self._file = None
+        # 统计
+        self.queued = 0
+        self.coalesced = 0
+        self.retried = 0
+        self.expired = 0
+        self.sent = 0
+        if path:
+            self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def busy(self):
+        '''
+        有排队或正在发送的指令，新指令需排在其后
+        '''
+        return bool(self._entries) or self._flushing
+
+    @staticmethod
+    def bypass(cmd):
+        return cmd in SESSION_CMDS
+
+    # 排队 ####################################################################
+
+    def put(self, cmd, type='user', data=None, timeout=None, priority=None):
+        '''
+        指令排队
+        :return: 收到回应后完成的future
+        '''
+        key = None
+        if cmd in self.idempotent:
+            key = _key(cmd, type, data)
+            entry = self._keys.get(key)
+            if entry is not None:
+                self.coalesced += 1
+                if entry.future is None:
+                    # 从文件恢复的指令
+                    entry.future = asyncio.get_event_loop().create_future()
+                return entry.future
+        if len(self._entries) >= self.max_size:
+            raise OutboxFull('outbox is full: {} commands'.format(
+                len(self._entries)))
+        ttl = self.ttls.get(cmd, self.ttl)
+        entry = _Entry(next(self._ids), cmd, type, data, timeout, priority,
+                       time.time() + ttl, key,
+                       asyncio.get_event_loop().create_future())
+        self._push(entry)
+        if self.path:
+            self._write(entry.dumps())
+        self.queued += 1
+        return entry.future
+
+    def retry(self, cmd, type='user', data=None, timeout=None, priority=None):
+        '''
+        连接中断未收到回应的幂等指令重新排队
+        '''
+        self.retried += 1
+        return self.put(cmd, type, data, timeout, priority)
+
+    def _push(self, entry):
+        entries = self._entries
+        if not entries or entries[-1].id < entry.id:
+            entries.append(entry)
+        else:
+            # 重新排队的指令按原有序号插入
+            index = next(i for i, queued in enumerate(entries)
+                         if queued.id > entry.id)
+            entries.insert(index, entry)
+        if entry.key is not None:
+            self._keys[entry.key] = entry
+        entry.handle = asyncio.get_event_loop().call_later(
+            max(entry.expires - time.time(), 0), self._expire, entry)
+
+    def _remove(self, entry):
+        if self._keys.get(entry.key) is entry:
+            del self._keys[entry.key]
+        if entry.handle is not None:
+            entry.handle.cancel()
+            entry.handle = None
+
+    def _expire(self, entry):
+        try:
+            self._entries.remove(entry)
+        except ValueError:
+            return
+        entry.handle = None
+        self._remove(entry)
+        self._finish(entry, exception=RequestTimeout(
+            '{} expired in outbox'.format(entry.cmd)))
+        self.expired += 1
+
+    def _finish(self, entry, result=None, exception=None):
+        if self.path:
+            self._write(json.dumps({'done': entry.id}).encode('utf-8'))
+        future = entry.future
+        if future is None:
+            if exception is not None:
+                logger.error('发件箱指令{}发送失败: {}'.format(
+                    entry.cmd, exception))
+            return
+        if future.done():
+            return
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    # 发送 ####################################################################
+
+    async def flush(self, send, ready):
+        '''
+        按顺序发送排队的指令
+        :param send: 发送指令的协程函数 send(cmd, type, data, timeout, priority)
+        :param ready: 返回是否可以发送，连接中断时停止
+        '''
+        if self._flushing:
+            return
+        self._flushing = True
+        window = asyncio.Semaphore(self.pipeline)
+        tasks = []
+        try:
+            while self._entries and ready():
+                await window.acquire()
+                if not self._entries or not ready():
+                    window.release()
+                    break
+                entry = self._entries.popleft()
+                self._remove(entry)
+                if entry.expires < time.time():
+                    window.release()
+                    self.expired += 1
+                    self._finish(entry, exception=RequestTimeout(
+                        '{} expired in outbox'.format(entry.cmd)))
+                    continue
+                tasks.append(asyncio.ensure_future(
+                    self._deliver(send, entry, window)))
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            self._flushing = False
+            self._compact()
+        if self._entries and ready():
+            # 发送期间重新排队的指令
+            await self.flush(send, ready)
+
+    async def _deliver(self, send, entry, window):
+        try:
+            result = await send(entry.cmd, entry.type, entry.data,
+                                entry.timeout, entry.priority)
+        except ConnectionClosed as e:
+            if entry.cmd in self.idempotent and entry.expires > time.time():
+                self.retried += 1
+                self._push(entry)
+            else:
+                self._finish(entry, exception=e)
+        except Exception as e:
+            self._finish(entry, exception=e)
+        else:
+            self.sent += 1
+            self._finish(entry, result=result)
+        finally:
+            window.release()
+
+    # 文件 ####################################################################
+
+    def _write(self, line):
+        if not self.path:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(line + b'\n')
+        self._file.flush()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            return
+        entries = collections.OrderedDict()
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 写入一半的行
+                    continue
+                if 'done' in record:
+                    entries.pop(record['done'], None)
+                else:
+                    entries[record['id']] = record
+        for record in entries.values():
+            entry = _Entry.loads(next(self._ids), record)
+            if entry.cmd in self.idempotent:
+                entry.key = _key(entry.cmd, entry.type, entry.data)
+            self._push(entry)
+        self._compact()
+        if entries:
+            logger.info('发件箱恢复{}条未发送的指令'.format(len(entries)))
+
+    def _compact(self):
+        '''
+        只保留仍在排队的指令
+        '''
+        if not self.path:
+            return
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not self._entries:
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            for entry in self._entries:
+                f.write(entry.dumps() + b'\n')
+        os.replace(tmp, self.path)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'queued': self.queued,
+            'coalesced': self.coalesced,
+            'retried': self.retried,
+            'expired': self.expired,
+            'sent': self.sent,
+        }
@@ -4,6 +4,10 @@
 
 
 class PadchatPushMixin:
+    '''
+    推送消息接口，context为PushMessage，可直接当作原始推送dict使用，
+    并提供is_group、sender、body、mentions、app等属性
+    '''
     def text_msg(self, context):
         '''
         文字信息
@@ -73,7 +77,7 @@ class PadchatPushMixin:
             if stranger and ticket:
                 stranger = stranger.group(1)
                 ticket = ticket.group(1)
-                self.accept_user(stranger, ticket)
+                self.spawn(self.accept_user(stranger, ticket))
         :param context: 
         :return: 
         '''
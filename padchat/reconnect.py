@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import random
+import time
+
+
+class CircuitState:
+    closed = 'closed' # 正常重连
+    open = 'open' # 连续失败过多，暂停重连
+    half_open = 'half_open' # 暂停结束，尝试一次
+
+
+class ReconnectPolicy:
+    '''
+    断线重连策略：指数退避、随机抖动、最小重连间隔及熔断
+
+    重连间隔为 min(max_delay, initial * multiplier ** 失败次数)，再随机减少
+    jitter比例，避免大量客户端同时重连；连续失败failure_threshold次后
+    暂停reset_timeout秒（同样随机减少jitter比例），之后只尝试一次，成功后恢复
+    '''
+
+    def __init__(self, initial=1.0, max_delay=60.0, multiplier=2.0,
+                 jitter=0.5, max_rate=1.0, failure_threshold=10,
+                 reset_timeout=300.0, login_delay=1.0):
+        '''
+        :param initial: 首次重连间隔秒数
+        :param max_delay: 最大重连间隔秒数
+        :param multiplier: 每次失败后间隔的倍数
+        :param jitter: 随机抖动比例，0~1
+        :param max_rate: 每秒最多重连次数，None为不限制
+        :param failure_threshold: 熔断前连续失败次数，None为不熔断
+        :param reset_timeout: 熔断后暂停秒数
+        :param login_delay: 初始化实例后等待多少秒再登录
+        '''
+        self.initial = initial
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.min_interval = 1.0 / max_rate if max_rate else 0
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.login_delay = login_delay
+
+        self.state = CircuitState.closed
+        self.failures = 0           # 连续失败次数
+        self._unconfirmed = False   # 已连接但尚未登录
+        self._last_attempt = None
+        self._down_since = None
+
+        # 统计
+        self.disconnects = 0
+        self.attempts = 0
+        self.reconnects = 0
+        self.resumes = 0
+        self.last_reconnect_time = None     # 断线到重新连接的秒数
+        self.total_reconnect_time = 0.0
+        self.max_reconnect_time = 0.0
+        self.last_resume_time = None        # 断线到重新登录的秒数
+
+    def disconnected(self):
+        '''
+        连接中断
+        '''
+        if self._down_since is None:
+            self._down_since = time.monotonic()
+            self.disconnects += 1
+        if self._unconfirmed:
+            # 连接后未能登录即中断，视为重连失败
+            self._unconfirmed = False
+            self._failed()
+
+    def failure(self):
+        '''
+        重连失败
+        '''
+        self._unconfirmed = False
+        self.disconnected()
+        self._failed()
+
+    def _failed(self):
+        self.failures += 1
+        if self.state == CircuitState.half_open or (
+                self.failure_threshold and
+                self.failures >= self.failure_threshold):
+            self.state = CircuitState.open
+
+    def next_delay(self):
+        '''
+        下次重连前等待的秒数，调用即视为一次重连尝试
+        '''
+        now = time.monotonic()
+        if self.state == CircuitState.open:
+            delay = self.reset_timeout
+            self.state = CircuitState.half_open
+        else:
+            delay = min(self.max_delay,
+                        self.initial * self.multiplier ** self.failures)
+        # 熔断暂停同样加入抖动，避免所有实例同时恢复重连
+        delay -= delay * self.jitter * random.random()
+        if self._last_attempt is not None:
+            # 距上次重连不足min_interval时补足
+            delay = max(delay, self._last_attempt + self.min_interval - now)
+        self._last_attempt = now + delay
+        self.attempts += 1
+        return delay
+
+    def connected(self):
+        '''
+        连接成功，登录后才重置失败次数及熔断状态
+        '''
+        self._unconfirmed = True
+        if self._down_since is not None:
+            elapsed = time.monotonic() - self._down_since
+            self.reconnects += 1
+            self.last_reconnect_time = elapsed
+            self.total_reconnect_time += elapsed
+            self.max_reconnect_time = max(self.max_reconnect_time, elapsed)
+
+    def logged_in(self):
+        '''
+        登录成功，断线恢复完成
+        '''
+        self._unconfirmed = False
+        self.failures = 0
+        self.state = CircuitState.closed
+        if self._down_since is not None:
+            self.resumes += 1
+            self.last_resume_time = time.monotonic() - self._down_since
+            self._down_since = None
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'disconnects': self.disconnects,
+            'attempts': self.attempts,
+            'reconnects': self.reconnects,
+            'resumes': self.resumes,
+            'last_reconnect_time': self.last_reconnect_time,
+            'avg_reconnect_time': self.total_reconnect_time /
+            (self.reconnects or 1),
+            'max_reconnect_time': self.max_reconnect_time,
+            'last_resume_time': self.last_resume_time,
+        }
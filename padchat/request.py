@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import math
+import time
+
+from .exceptions import RequestTimeout
+from .logger import logger
+
+
+class TimerWheel:
+    '''
+    时间轮，所有超时共用一个定时器，按tick粒度批量过期
+    '''
+
+    def __init__(self, callback, tick=1.0):
+        '''
+        :param callback: 过期回调，参数为过期的key
+        :param tick: 时间轮精度，秒
+        '''
+        self.tick = tick
+        self._callback = callback
+        self._slots = {}
+        self._current = self._now_tick()
+        self._timer = None
+
+    def _now_tick(self):
+        return int(time.monotonic() / self.tick)
+
+    def add(self, key, delay):
+        '''
+        添加定时项
+        :param key: 定时项标识
+        :param delay: 延迟秒数
+        :return: 所在槽位，用于取消
+        '''
+        slot = self._now_tick() + max(1, int(math.ceil(delay / self.tick)))
+        self._slots.setdefault(slot, set()).add(key)
+        if self._timer is None:
+            self._current = self._now_tick()
+            self._schedule()
+        return slot
+
+    def remove(self, key, slot):
+        keys = self._slots.get(slot)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._slots[slot]
+
+    def clear(self):
+        self._slots.clear()
+        self._stop()
+
+    def _schedule(self):
+        self._timer = asyncio.get_event_loop().call_later(self.tick,
+                                                          self._advance)
+
+    def _stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _advance(self):
+        self._timer = None
+        now = self._now_tick()
+        while self._current <= now:
+            keys = self._slots.pop(self._current, None)
+            self._current += 1
+            for key in keys or ():
+                self._callback(key)
+        if self._slots and self._timer is None:
+            self._schedule()
+
+    def __len__(self):
+        return sum(len(keys) for keys in self._slots.values())
+
+
+class PendingRequest:
+    '''
+    等待回应的指令，只保存回调所需数据，不保留请求内容
+    '''
+    __slots__ = ('cmd', 'future', 'slot', 'start')
+
+    def __init__(self, cmd, future, slot, start):
+        self.cmd = cmd
+        self.future = future
+        self.slot = slot
+        self.start = start
+
+
+class MsgQueue:
+    '''
+    指令回调队列
+
+    cmd id -> PendingRequest，超时由时间轮统一处理，连接断开时全部失败，
+    并可限制同时等待回应的指令数量
+    '''
+
+    def __init__(self, timeout=60, max_inflight=None, tick=1.0):
+        '''
+        :param timeout: 默认超时秒数，None为不超时
+        :param max_inflight: 最大同时等待回应的指令数量，None为不限制
+        :param tick: 超时检测精度，秒
+        '''
+        self.timeout = timeout
+        self.max_inflight = max_inflight
+        self._pending = {}
+        self._wheel = TimerWheel(self._on_timeout, tick=tick)
+        self._semaphore = asyncio.Semaphore(max_inflight) if max_inflight \
+            else None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, cmd_id):
+        return cmd_id in self._pending
+
+    async def acquire(self):
+        '''
+        获取发送名额，超出max_inflight时等待
+        '''
+        if self._semaphore is not None:
+            await self._semaphore.acquire()
+
+    def _release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    def store(self, cmd_id, cmd, future, timeout=None):
+        '''
+        存储等待回应的指令，需先调用acquire；等待方取消时移除并释放名额
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        slot = self._wheel.add(cmd_id, timeout) if timeout else None
+        request = PendingRequest(cmd, future, slot, time.monotonic())
+        self._pending[cmd_id] = request
+        if future is not None:
+            future.add_done_callback(
+                lambda f: f.cancelled() and self._cancel(cmd_id, request))
+
+    def _cancel(self, cmd_id, request):
+        if self._pending.get(cmd_id) is request:
+            self.pop(cmd_id)
+
+    def pop(self, cmd_id):
+        '''
+        取出cmd id对应的指令，不存在时返回None
+        '''
+        request = self._pending.pop(cmd_id, None)
+        if request is None:
+            return None
+        if request.slot is not None:
+            self._wheel.remove(cmd_id, request.slot)
+        self._release()
+        return request
+
+    def fail_all(self, exception):
+        '''
+        所有等待中的指令以exception失败
+        '''
+        pending, self._pending = self._pending, {}
+        self._wheel.clear()
+        for request in pending.values():
+            self._release()
+            if not request.future.done():
+                request.future.set_exception(exception)
+        return len(pending)
+
+    def _on_timeout(self, cmd_id):
+        request = self._pending.pop(cmd_id, None)
+        if request is None:
+            return
+        self._release()
+        logger.warning('指令超时: cmd: {} cmd id: {}'.format(request.cmd,
+                                                         cmd_id))
+        if not request.future.done():
+            request.future.set_exception(RequestTimeout(
+                '{} timeout after {:.1f}s'.format(
+                    request.cmd, time.monotonic() - request.start)))
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import collections
+import time
+
+from .constant import Priority
+
+
+# 指令默认优先级，未列出的指令为Priority.normal
+CMD_PRIORITY = {
+    'init': Priority.high,
+    'getWxData': Priority.high,
+    'login': Priority.high,
+    'getLoginToken': Priority.high,
+    'logout': Priority.high,
+    'close': Priority.high,
+    'syncMsg': Priority.high,
+    'syncContact': Priority.high,
+    'sendMsg': Priority.bulk,
+    'sendAppMsg': Priority.bulk,
+    'sendImage': Priority.bulk,
+    'sendVoice': Priority.bulk,
+    'shareCard': Priority.bulk,
+}
+
+
+class TokenBucket:
+    '''
+    令牌桶，rate为每秒补充令牌数，capacity为最大突发数量
+    '''
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now):
+        '''
+        距离下一个可用令牌的秒数，0为当前可用
+        '''
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Waiter:
+    __slots__ = ('cmd', 'recipient', 'future', 'enqueued')
+
+    def __init__(self, cmd, recipient, future, enqueued):
+        self.cmd = cmd
+        self.recipient = recipient
+        self.future = future
+        self.enqueued = enqueued
+
+
+class SendScheduler:
+    '''
+    发送调度器
+
+    在指令写入连接前按令牌桶限速（全局、按接收者toUserName、按指令），
+    等待中的指令按优先级通道依次放行，同一通道内先进先出
+    '''
+
+    def __init__(self, rate=None, burst=None, recipient_rate=None,
+                 recipient_burst=None, cmd_rates=None, priorities=None,
+                 max_recipients=10000):
+        '''
+        :param rate: 全局每秒指令数，None为不限制
+        :param burst: 全局突发数量
+        :param recipient_rate: 单个接收者每秒指令数，None为不限制
+        :param recipient_burst: 单个接收者突发数量
+        :param cmd_rates: 按指令限速 {cmd: rate} 或 {cmd: (rate, burst)}
+        :param priorities: 覆盖CMD_PRIORITY的指令优先级
+        :param max_recipients: 最多保留的接收者令牌桶数量
+        '''
+        self._global = TokenBucket(rate, burst) if rate else None
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.max_recipients = max_recipients
+        self._recipients = collections.OrderedDict()
+        self._cmds = {}
+        for cmd, spec in (cmd_rates or {}).items():
+            if not isinstance(spec, (tuple, list)):
+                spec = (spec,)
+            self._cmds[cmd] = TokenBucket(*spec)
+        self._priorities = dict(CMD_PRIORITY, **(priorities or {}))
+        self._lanes = {lane: collections.deque() for lane in Priority.lanes}
+        self._timer = None
+
+        # 统计
+        self.granted = 0
+        self.delayed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def limited(self):
+        return bool(self._global or self.recipient_rate or self._cmds)
+
+    def priority(self, cmd):
+        return self._priorities.get(cmd, Priority.normal)
+
+    def acquire(self, cmd, recipient=None, priority=None):
+        '''
+        获取发送许可
+        :param cmd: 指令
+        :param recipient: 接收者wxid
+        :param priority: 优先级，默认按指令取
+        :return: Future，完成时可写入连接
+        '''
+        future = asyncio.get_event_loop().create_future()
+        now = time.monotonic()
+        if not self.limited or (not self.depth and
+                                self._try_consume(cmd, recipient, now) == 0):
+            self.granted += 1
+            future.set_result(0)
+            return future
+        if priority is None:
+            priority = self.priority(cmd)
+        self._lanes[priority].append(_Waiter(cmd, recipient, future, now))
+        self._pump()
+        return future
+
+    def _buckets(self, cmd, recipient, now):
+        buckets = []
+        if self._global is not None:
+            buckets.append(self._global)
+        bucket = self._cmds.get(cmd)
+        if bucket is not None:
+            buckets.append(bucket)
+        if recipient and self.recipient_rate:
+            buckets.append(self._recipient_bucket(recipient, now))
+        return buckets
+
+    def _recipient_bucket(self, recipient, now):
+        bucket = self._recipients.get(recipient)
+        if bucket is None:
+            bucket = TokenBucket(self.recipient_rate, self.recipient_burst)
+            self._recipients[recipient] = bucket
+            if len(self._recipients) > self.max_recipients:
+                self._evict_recipients(now)
+        else:
+            self._recipients.move_to_end(recipient)
+        return bucket
+
+    def _evict_recipients(self, now):
+        # 只淘汰已回满的令牌桶，不影响限速效果
+        for recipient in list(self._recipients):
+            if len(self._recipients) <= self.max_recipients:
+                break
+            if self._recipients[recipient].is_full(now):
+                del self._recipients[recipient]
+
+    def _try_consume(self, cmd, recipient, now):
+        buckets = self._buckets(cmd, recipient, now)
+        wait = max([bucket.delay(now) for bucket in buckets] or [0])
+        if wait == 0:
+            for bucket in buckets:
+                bucket.consume(now)
+        return wait
+
+    def _pump(self):
+        now = time.monotonic()
+        next_wait = None
+        for lane in Priority.lanes:
+            waiters = self._lanes[lane]
+            blocked = collections.deque()
+            while waiters:
+                waiter = waiters.popleft()
+                if waiter.future.done():
+                    # 等待方已取消（如调用超时），不再消耗令牌
+                    continue
+                wait = self._try_consume(waiter.cmd, waiter.recipient, now)
+                if wait:
+                    blocked.append(waiter)
+                    next_wait = wait if next_wait is None \
+                        else min(next_wait, wait)
+                    if self._global is not None and \
+                            self._global.delay(now) > 0:
+                        # 全局令牌已用完，后续指令无需再检查
+                        blocked.extend(waiters)
+                        waiters.clear()
+                else:
+                    self._grant(waiter, now)
+            self._lanes[lane] = blocked
+        if next_wait is not None:
+            self._schedule(next_wait)
+
+    def _grant(self, waiter, now):
+        wait = now - waiter.enqueued
+        self.granted += 1
+        self.delayed += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        waiter.future.set_result(wait)
+
+    def _schedule(self, delay):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + delay
+        if self._timer is not None:
+            if self._timer[0] <= deadline:
+                return
+            self._timer[1].cancel()
+        self._timer = (deadline, loop.call_at(deadline, self._on_timer))
+
+    def _on_timer(self):
+        self._timer = None
+        self._pump()
+
+    @property
+    def depth(self):
+        return sum(len(waiters) for waiters in self._lanes.values())
+
+    def stats(self):
+        '''
+        调度统计：各通道排队数量、放行数、等待次数与等待时间
+        '''
+        return {
+            'depth': {lane: len(waiters)
+                      for lane, waiters in self._lanes.items()},
+            'granted': self.granted,
+            'delayed': self.delayed,
+            'total_wait': self.total_wait,
+            'avg_wait': self.total_wait / self.delayed if self.delayed else 0,
+            'max_wait': self.max_wait,
+        }
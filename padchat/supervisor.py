@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import argparse
+import asyncio
+import importlib
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zlib
+
+from .fleet import PadchatFleet, profile_name
+from .generic import PadchatClient
+from .metrics import default_registry, merge_rendered
+from .user import UserProfile
+from .logger import logger
+
+
+def shard_of(name, workers):
+    '''
+    账号所在分片，同一账号在相同进程数下始终分到同一进程
+    '''
+    return zlib.crc32(name.encode('utf-8')) % workers
+
+
+def _worker_main(index, url, client_class, profiles, commands, events,
+                 log_queue, report_interval, fleet_kwargs):
+    '''
+    工作进程入口，运行一个PadchatFleet
+    '''
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    fleet = PadchatFleet(url, client_class=client_class, **fleet_kwargs)
+    for name, profile in profiles:
+        fleet.add(name, **profile)
+
+    def add(profiles):
+        for name, profile in profiles:
+            if name not in fleet:
+                fleet.add(name, **profile)
+        loop.create_task(fleet.start())
+
+    def listen():
+        # 在线程中阻塞读取主进程指令，转到事件循环执行
+        while True:
+            command, args = commands.get()
+            if command == 'add':
+                loop.call_soon_threadsafe(add, args)
+            elif command == 'stop':
+                loop.call_soon_threadsafe(loop.stop)
+                return
+
+    registry = fleet_kwargs.get('metrics') or default_registry
+
+    def report():
+        try:
+            events.put_nowait(('stats', index, {
+                'accounts': fleet.stats(),
+                'executors': fleet.executors.stats(),
+                'metrics': registry.render(),
+            }))
+        except queue.Full:
+            pass
+        loop.call_later(report_interval, report)
+
+    threading.Thread(target=listen, daemon=True).start()
+    loop.create_task(fleet.start())
+    loop.call_later(report_interval, report)
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fleet.stop()
+        fleet.executors.shutdown(wait=False)
+
+
+class _Worker:
+    __slots__ = ('index', 'process', 'commands', 'accounts', 'restarts',
+                 'restart_at', 'stats', 'failed')
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.commands = None
+        self.accounts = {}      # 账号名称 -> 用户数据
+        self.restarts = []      # 最近的重启时间
+        self.restart_at = None  # 等待重启的时间
+        self.stats = {}
+        self.failed = False
+
+
+class PadchatSupervisor:
+    '''
+    多进程账号分片
+
+    已保存的账号按名称分到workers个工作进程，每个进程运行一个PadchatFleet；
+    工作进程退出后重新启动，restart_window秒内重启超过max_restarts次才将其账号
+    分给其他进程，此前账号随工作进程一起重启。
+    工作进程的日志、状态及指标汇总到主进程
+    '''
+
+    def __init__(self, url, workers=None, client_class=PadchatClient,
+                 profiles=None, max_restarts=3, restart_window=300,
+                 restart_delay=5, report_interval=10, **fleet_kwargs):
+        '''
+        :param url: Padchat服务器地址
+        :param workers: 工作进程数量，默认为CPU数量
+        :param client_class: 客户端类，需可在模块中导入
+        :param profiles: 用户数据列表，默认读取UserProfile中的全部用户
+        :param max_restarts: restart_window秒内最多重启次数，超过则重新分配账号
+        :param restart_delay: 重启工作进程前等待的秒数
+        :param report_interval: 工作进程上报状态的间隔秒数
+        :param fleet_kwargs: PadchatFleet参数，如stagger
+        '''
+        self.url = url
+        self.workers = workers or os.cpu_count() or 1
+        self.client_class = client_class
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.restart_delay = restart_delay
+        self.report_interval = report_interval
+        self.fleet_kwargs = fleet_kwargs
+        if profiles is None:
+            profiles = UserProfile().profile_file_data
+        self._workers = [_Worker(i) for i in range(self.workers)]
+        for i, profile in enumerate(profiles):
+            name = profile_name(profile, default=str(i))
+            worker = self._workers[shard_of(name, self.workers)]
+            worker.accounts[name] = profile
+        self._events = multiprocessing.Queue(maxsize=1000)
+        self._log_queue = multiprocessing.Queue()
+        self._running = False
+
+    def _start_worker(self, worker):
+        worker.commands = multiprocessing.Queue()
+        worker.process = multiprocessing.Process(
+            target=_worker_main, name='padchat-worker-{}'.format(worker.index),
+            args=(worker.index, self.url, self.client_class,
+                  list(worker.accounts.items()), worker.commands,
+                  self._events, self._log_queue, self.report_interval,
+                  self.fleet_kwargs),
+            daemon=True)
+        worker.process.start()
+        logger.info('工作进程{}已启动，{}个账号'.format(
+            worker.index, len(worker.accounts)))
+
+    def _check(self, worker):
+        if worker.failed or worker.process.is_alive():
+            return
+        now = time.monotonic()
+        if worker.restart_at is not None:
+            if now >= worker.restart_at:
+                worker.restart_at = None
+                self._start_worker(worker)
+            return
+        logger.error('工作进程{}已退出，exit code: {}'.format(
+            worker.index, worker.process.exitcode))
+        worker.restarts = [t for t in worker.restarts
+                           if now - t < self.restart_window]
+        worker.stats = {}
+        if len(worker.restarts) < self.max_restarts:
+            worker.restarts.append(now)
+            worker.restart_at = now + self.restart_delay
+            return
+        worker.failed = True
+        self._rebalance(worker)
+
+    def _rebalance(self, worker):
+        alive = [i for i in self._workers
+                 if not i.failed and i.process.is_alive()]
+        if not alive:
+            logger.error('没有可用的工作进程，{}个账号无法分配'.format(
+                len(worker.accounts)))
+            return
+        moved = {}
+        for name, profile in worker.accounts.items():
+            target = alive[shard_of(name, len(alive))]
+            target.accounts[name] = profile
+            moved.setdefault(target.index, []).append((name, profile))
+        worker.accounts = {}
+        for index, profiles in moved.items():
+            self._workers[index].commands.put(('add', profiles))
+        logger.warning('工作进程{}反复退出，账号已分配到其他进程'.format(
+            worker.index))
+
+    def _drain_events(self):
+        while True:
+            try:
+                kind, index, data = self._events.get_nowait()
+            except queue.Empty:
+                return
+            if kind == 'stats':
+                self._workers[index].stats = data
+
+    def stats(self):
+        '''
+        汇总各工作进程上报的状态
+        '''
+        accounts = {}
+        for worker in self._workers:
+            for name, stats in worker.stats.get('accounts', {}).items():
+                accounts[name] = dict(stats, worker=worker.index)
+        return {
+            'workers': {
+                worker.index: {
+                    'pid': worker.process.pid if worker.process else None,
+                    'alive': bool(worker.process and
+                                  worker.process.is_alive()),
+                    'failed': worker.failed,
+                    'accounts': len(worker.accounts),
+                    'restarts': len(worker.restarts),
+                    'executors': worker.stats.get('executors'),
+                } for worker in self._workers
+            },
+            'accounts': accounts,
+        }
+
+    def render_metrics(self):
+        '''
+        汇总各工作进程上报的指标，Prometheus文本格式，带worker标签
+        '''
+        return merge_rendered(
+            ({'worker': worker.index}, worker.stats['metrics'])
+            for worker in self._workers if 'metrics' in worker.stats)
+
+    def run(self, interval=1.0):
+        '''
+        启动工作进程并监控，Ctrl+C结束
+        '''
+        listener = logging.handlers.QueueListener(
+            self._log_queue, *logging.getLogger().handlers,
+            respect_handler_level=True)
+        listener.start()
+        self._running = True
+        try:
+            for worker in self._workers:
+                self._start_worker(worker)
+            while self._running:
+                time.sleep(interval)
+                self._drain_events()
+                for worker in self._workers:
+                    self._check(worker)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            listener.stop()
+
+    def stop(self, timeout=10):
+        self._running = False
+        for worker in self._workers:
+            if worker.process is not None and worker.process.is_alive():
+                worker.commands.put(('stop', None))
+        for worker in self._workers:
+            if worker.process is not None:
+                worker.process.join(timeout)
+                if worker.process.is_alive():
+                    worker.process.terminate()
+
+
+def _import_class(path):
+    module, _, name = path.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='多进程运行本地保存的全部微信账号')
+    parser.add_argument('url', help='Padchat服务器地址')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='工作进程数量，默认为CPU数量')
+    parser.add_argument('-c', '--client', default=None,
+                        help='客户端类，如 mybot.client:Client')
+    parser.add_argument('--stagger', type=float, default=1.0,
+                        help='每个进程内账号启动间隔秒数')
+    args = parser.parse_args(argv)
+    client_class = _import_class(args.client) if args.client \
+        else PadchatClient
+    PadchatSupervisor(args.url, workers=args.workers,
+                      client_class=client_class, stagger=args.stagger).run()
+
+
+if __name__ == '__main__':
+    main()
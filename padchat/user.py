@@ -1,5 +1,9 @@
+import collections.abc
+import contextlib
 import os
 import pickle
+import sqlite3
+
 from .logger import logger
 
 
@@ -56,35 +60,196 @@ class User:
         return self.user_name
 
 
+class _ProfileIndex(collections.abc.Mapping):
+    '''
+    按索引字段查询用户数据，只在访问时读取数据库
+    '''
+
+    def __init__(self, profile, column):
+        self._profile = profile
+        self._column = column
+
+    def __getitem__(self, value):
+        profile = self._profile.get(**{self._column: value})
+        if profile is None:
+            raise KeyError(value)
+        return profile
+
+    def __iter__(self):
+        return iter(self._profile.keys(self._column))
+
+    def __len__(self):
+        return len(self._profile.keys(self._column))
+
+
 class UserProfile:
-    profile_file = os.path.join(os.getcwd(), 'profile')
+    '''
+    本地保存的用户登录数据，SQLite存储，按uin、wxid及昵称建立索引
+
+    每次保存只更新一行，多进程通过SQLite的文件锁互斥；首次使用时导入
+    旧版pickle格式的profile文件
+    '''
+    profile_file = os.path.join(os.getcwd(), 'profile.db')
+    legacy_file = os.path.join(os.getcwd(), 'profile')
+    # 可按索引查询的字段 -> 列名
+    indexes = {'uin': 'uin', 'user_name': 'wx_id', 'wx_id': 'wx_id',
+               'nick_name': 'nick_name'}
+    _initialized = set()
+
+    def __init__(self, profile_file=None, timeout=30):
+        '''
+        :param profile_file: 数据库文件，默认为当前目录下的profile.db
+        :param timeout: 等待其他进程释放锁的秒数
+        '''
+        if profile_file is not None:
+            self.profile_file = profile_file
+        self.timeout = timeout
+        if self.profile_file not in self._initialized:
+            self._initialize()
+            self._initialized.add(self.profile_file)
 
-    def __init__(self):
-        if os.path.isfile(self.profile_file):
-            self.profile_file_data = self.load()
+    def _initialize(self):
+        with self._transaction() as db:
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS profile (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    uin INTEGER UNIQUE,
+                    wx_id TEXT,
+                    nick_name TEXT,
+                    user BLOB NOT NULL,
+                    wx_data TEXT,
+                    token TEXT
+                )''')
+            db.execute('CREATE INDEX IF NOT EXISTS profile_wx_id '
+                       'ON profile (wx_id)')
+            db.execute('CREATE INDEX IF NOT EXISTS profile_nick_name '
+                       'ON profile (nick_name)')
+            db.execute('CREATE TABLE IF NOT EXISTS meta '
+                       '(key TEXT PRIMARY KEY, value TEXT)')
+            self._migrate(db)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.profile_file, timeout=self.timeout,
+                             isolation_level=None)
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        '''
+        写事务，开始时即获取写锁，异常时回滚
+        '''
+        with self._connect() as db:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+
+    def _migrate(self, db):
+        if db.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            return
+        if os.path.isfile(self.legacy_file):
+            try:
+                with open(self.legacy_file, 'rb') as f:
+                    data = pickle.load(f)
+            except Exception:
+                logger.error('读取旧版用户数据失败: {}'.format(
+                    self.legacy_file), exc_info=True)
+                return
+            for profile in data:
+                self._upsert(db, profile['user'], profile.get('wx_data'),
+                             profile.get('token'))
+            logger.info('已导入{}个旧版用户数据'.format(len(data)))
+        db.execute("INSERT INTO meta VALUES ('migrated', '1')")
+
+    @staticmethod
+    def _upsert(db, user, wx_data, token):
+        # 登录前保存的用户没有uin，按wxid合并；不使用ON CONFLICT，
+        # 兼容SQLite 3.24以前的版本
+        row = None
+        if user.uin is not None:
+            row = db.execute('SELECT id FROM profile WHERE uin = ?',
+                             (user.uin,)).fetchone()
+        if row is None and user.user_name is not None:
+            row = db.execute(
+                'SELECT id FROM profile WHERE wx_id = ? {}'
+                'ORDER BY id LIMIT 1'.format(
+                    'AND uin IS NULL ' if user.uin is not None else ''),
+                (user.user_name,)).fetchone()
+        values = (user.uin, user.user_name, user.nick_name, pickle.dumps(user),
+                  wx_data, token)
+        if row is None:
+            db.execute('''
+                INSERT INTO profile (uin, wx_id, nick_name, user, wx_data,
+                                     token)
+                VALUES (?, ?, ?, ?, ?, ?)''', values)
         else:
-            self.profile_file_data = []
+            db.execute('''
+                UPDATE profile SET uin = COALESCE(?, uin), wx_id = ?,
+                    nick_name = ?, user = ?, wx_data = ?, token = ?
+                WHERE id = ?''', values + row)
+
+    @staticmethod
+    def _row(row):
+        user, wx_data, token = row
+        return {'user': pickle.loads(user), 'wx_data': wx_data,
+                'token': token}
 
     def __getitem__(self, key):
-        return {i.get(key, getattr(i['user'], key, None)): i \
+        column = self.indexes.get(key)
+        if column is not None:
+            return _ProfileIndex(self, column)
+        # 非索引字段，遍历全部用户
+        return {i.get(key, getattr(i['user'], key, None)): i
                 for i in self.profile_file_data if i.get(
             key, hasattr(i['user'], key))}
 
-    def save(self, user: User, wx_data, token):
-        for i in self.profile_file_data:
-            if i['user'].uin == user.uin:
-                i['user'] = user
-                i['wx_data'] = wx_data
-                i['token'] = token
+    def __len__(self):
+        with self._connect() as db:
+            return db.execute('SELECT COUNT(*) FROM profile').fetchone()[0]
+
+    @property
+    def profile_file_data(self):
+        return self.load()
+
+    def keys(self, column):
+        with self._connect() as db:
+            return [i[0] for i in db.execute(
+                'SELECT {0} FROM profile WHERE {0} IS NOT NULL '
+                'ORDER BY id'.format(column))]
+
+    def get(self, uin=None, wx_id=None, nick_name=None, user_name=None):
+        '''
+        按uin、wxid或昵称查询用户数据，不存在则返回None
+        '''
+        for column, value in (('uin', uin), ('wx_id', wx_id or user_name),
+                              ('nick_name', nick_name)):
+            if value is not None:
                 break
         else:
-            self.profile_file_data.append({'user': user, 'wx_data': wx_data,
-                                           'token': token})
-        self.dump()
+            raise ValueError('uin, wx_id or nick_name is required')
+        with self._connect() as db:
+            row = db.execute(
+                'SELECT user, wx_data, token FROM profile WHERE {} = ? '
+                'ORDER BY id LIMIT 1'.format(column), (value,)).fetchone()
+        return self._row(row) if row else None
 
-    def dump(self):
-        pickle.dump(self.profile_file_data, open(self.profile_file, 'wb'))
+    def save(self, user: User, wx_data, token):
+        with self._transaction() as db:
+            self._upsert(db, user, wx_data, token)
 
-    def load(self):
-        return pickle.load(open(self.profile_file, 'rb'))
+    def delete(self, uin):
+        with self._transaction() as db:
+            return db.execute('DELETE FROM profile WHERE uin = ?',
+                              (uin,)).rowcount > 0
 
+    def load(self):
+        with self._connect() as db:
+            return [self._row(row) for row in db.execute(
+                'SELECT user, wx_data, token FROM profile ORDER BY id')]
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+'''
+基于本地模拟服务器的压测
+
+    python -m tests.benchmark                 # 全部
+    python -m tests.benchmark push rtt        # 指定项目
+'''
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+from padchat import PadchatFleet
+from padchat.contacts import SQLiteSink
+from padchat.journal import PushJournal
+from padchat.logger import WireLog, WireLogLevel
+from padchat.reconnect import ReconnectPolicy
+
+from .fixtures import LocalClient, account, logged_in, make_client
+from .server import FakePadchatServer
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def bench_push(server, count=100000, batch=50, **kwargs):
+    '''
+    推送处理吞吐量：服务器按batch条一组推送count条文字消息
+    '''
+    received = []
+
+    class Client(LocalClient):
+        def person_text_msg(self, context):
+            received.append(1)
+
+    client = make_client(Client, **kwargs)
+    client.connect(server.url)
+    await logged_in([client])
+
+    # 每条消息msg_id不同，避免被去重
+    count = count // batch * batch
+    batches = [[server.text_push('消息{}'.format(i)) for i in range(batch)]
+               for _ in range(count // batch)]
+    start = time.perf_counter()
+    for messages in batches:
+        server.push(messages)
+        await asyncio.sleep(0)
+    while len(received) < count:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    client.disconnect()
+    return {'messages': len(received), 'seconds': round(elapsed, 3),
+            'per_second': int(len(received) / elapsed),
+            'duplicates': client.dedup.duplicates}
+
+
+async def bench_journal(server, count=100000, batch=50):
+    '''
+    开启推送日志时的推送处理吞吐量
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        journal = PushJournal(directory)
+        try:
+            result = await bench_push(server, count, batch, journal=journal)
+        finally:
+            journal.close()
+        result.update(syncs=journal.syncs, checkpoint=journal.checkpoint)
+        return result
+
+
+async def bench_rtt(server, count=20000, concurrency=100):
+    '''
+    指令往返耗时：concurrency个协程并发发送共count条sendMsg
+    '''
+    client = make_client()
+    client.connect(server.url)
+    await logged_in([client])
+    latencies = []
+    pending = iter(range(count))
+
+    async def worker():
+        for _ in pending:
+            start = time.perf_counter()
+            await client.send_msg('wxid_friend', '测试')
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    client.disconnect()
+    return {
+        'commands': count,
+        'per_second': int(count / elapsed),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+    }
+
+
+async def bench_media(server, size=8 * 1024 * 1024, count=5):
+    '''
+    发送媒体的内存峰值：发送count次size字节的图片
+    '''
+    client = make_client()
+    client.connect(server.url)
+    await logged_in([client])
+    data = os.urandom(size)
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(count):
+        await client.send_image('wxid_friend', data)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    client.disconnect()
+    return {'size_mb': size / 1024 / 1024, 'count': count,
+            'seconds': round(elapsed, 3),
+            'peak_mb': round(peak / 1024 / 1024, 1),
+            'peak_ratio': round(peak / size, 2)}
+
+
+async def bench_reconnect(server, clients=200):
+    '''
+    断线重连：clients个账号登录后服务器断开全部连接，统计全部恢复登录的耗时
+    '''
+    fleet = PadchatFleet(server.url, client_class=LocalClient, stagger=0,
+                         ping_interval=None,
+                         wire_log=WireLog(WireLogLevel.off))
+    for i in range(clients):
+        fleet.add(str(i), reconnect=ReconnectPolicy(login_delay=0),
+                  **account())
+    await fleet.start()
+    await logged_in(fleet, timeout=120)
+    connects = server.commands['init']
+    start = time.perf_counter()
+    server.drop_all()
+    deadline = time.monotonic() + 300
+    # 等待每个客户端都完成一次断线恢复
+    while not all(client.reconnect.resumes for client in fleet):
+        if time.monotonic() > deadline:
+            raise TimeoutError('resume timeout')
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    resume = [client.reconnect.last_resume_time for client in fleet]
+    attempts = sum(client.reconnect.attempts for client in fleet)
+    fleet.stop()
+    return {'clients': clients, 'seconds': round(elapsed, 3),
+            'attempts': attempts,
+            'inits': server.commands['init'] - connects,
+            'p50_resume_s': round(_percentile(resume, 50), 3),
+            'max_resume_s': round(max(resume), 3)}
+
+
+async def bench_contacts(server, friends=5000, rooms=300):
+    '''
+    流式同步通讯录：friends个好友、rooms个群写入SQLite的耗时及内存峰值
+    '''
+    server.contacts = server.fake_contacts(friends, rooms)
+    client = make_client()
+    client.connect(server.url)
+    await logged_in([client])
+    with tempfile.TemporaryDirectory() as directory:
+        sink = SQLiteSink(os.path.join(directory, 'contacts.db'))
+        tracemalloc.start()
+        start = time.perf_counter()
+        count = await client.sync_contacts_stream(sink=sink).wait()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stored = len(sink)
+        sink.close()
+    client.disconnect()
+    return {'contacts': count, 'stored': stored,
+            'seconds': round(elapsed, 3),
+            'per_second': int(count / elapsed),
+            'peak_mb': round(peak / 1024 / 1024, 1)}
+
+
+BENCHMARKS = {
+    'push': bench_push,
+    'journal': bench_journal,
+    'rtt': bench_rtt,
+    'media': bench_media,
+    'contacts': bench_contacts,
+    'reconnect': bench_reconnect,
+}
+
+
+async def run(names, latency=0):
+    results = {}
+    for name in names:
+        server = FakePadchatServer(latency=latency).start()
+        try:
+            results[name] = await BENCHMARKS[name](server)
+        finally:
+            server.stop()
+        print('{:<10} {}'.format(name, results[name]))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Padchat客户端压测')
+    parser.add_argument('names', nargs='*',
+                        help='压测项目：{}，默认全部'.format(
+                            '、'.join(BENCHMARKS)))
+    parser.add_argument('--latency', type=float, default=0,
+                        help='模拟服务器回应延迟秒数')
+    args = parser.parse_args(argv)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error('unknow benchmark: {}'.format(', '.join(unknown)))
+    logging.getLogger('padchat').setLevel(logging.WARNING)
+    logging.getLogger('tornado.access').setLevel(logging.WARNING)
+    asyncio.get_event_loop().run_until_complete(
+        run(args.names or list(BENCHMARKS), args.latency))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+
+import pytest
+
+from .fixtures import logged_in, make_client
+from .server import FakePadchatServer
+
+
+@pytest.fixture
+def run():
+    '''
+    每个测试使用新的事件循环，run(coro)执行协程并返回结果
+    '''
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield lambda coro: loop.run_until_complete(
+        asyncio.wait_for(coro, 30))
+    for task in asyncio.all_tasks(loop) if hasattr(asyncio, 'all_tasks') \
+            else asyncio.Task.all_tasks(loop):
+        task.cancel()
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+@pytest.fixture
+def server(run):
+    '''
+    本地模拟服务器
+    '''
+    async def start():
+        return FakePadchatServer().start()
+    server = run(start())
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def connect(server):
+    '''
+    connect(**kwargs)协程：创建客户端连接模拟服务器并等待登录
+    '''
+    clients = []
+
+    async def connect(**kwargs):
+        client = make_client(**kwargs)
+        clients.append(client)
+        client.connect(server.url)
+        await logged_in([client])
+        return client
+    yield connect
+    for client in clients:
+        client.disconnect()
@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+'''
+测试及压测共用的客户端工具
+'''
+import asyncio
+import time
+
+from padchat import PadchatClient
+from padchat.logger import WireLog, WireLogLevel
+from padchat.reconnect import ReconnectPolicy
+from padchat.user import User
+
+from .server import FAKE_USER
+
+
+class LocalClient(PadchatClient):
+    def save_user(self):
+        # 不写入本地用户数据
+        return True
+
+
+def account():
+    # 使用已保存的token登录，跳过二维码
+    return {'user': User(**FAKE_USER), 'wx_data': 'fake-wx-data',
+            'token': 'fake-token'}
+
+
+def make_client(client_class=LocalClient, **kwargs):
+    kwargs.setdefault('wire_log', WireLog(WireLogLevel.off))
+    kwargs.setdefault('reconnect', ReconnectPolicy(login_delay=0))
+    kwargs.update(account())
+    return client_class(ping_interval=None, **kwargs)
+
+
+async def logged_in(clients, timeout=30):
+    deadline = time.monotonic() + timeout
+    while not all(client._alive for client in clients):
+        if time.monotonic() > deadline:
+            raise TimeoutError('login timeout')
+        await asyncio.sleep(0.01)
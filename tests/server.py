@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+'''
+本地模拟的Padchat服务器，用于压测及无需真实服务器的调试
+
+    python tests/server.py --port 7777
+'''
+import argparse
+import asyncio
+import base64
+import collections
+import itertools
+import json
+import os
+
+from tornado import httpserver
+from tornado import netutil
+from tornado import web
+from tornado import websocket
+
+
+FAKE_USER = {
+    'email': '',
+    'external': '1',
+    'long_link_server': '',
+    'message': 'Everything is ok',
+    'nick_name': '测试账号',
+    'phone_number': '',
+    'qq': 0,
+    'short_link_server': '',
+    'status': 2,
+    'sub_status': 0,
+    'uin': 100000,
+    'user_name': 'wxid_fakeuser',
+}
+
+
+class _PadchatHandler(websocket.WebSocketHandler):
+    def initialize(self, server):
+        self.server = server
+
+    def check_origin(self, origin):
+        return True
+
+    def open(self):
+        self.server.connections.add(self)
+
+    def on_close(self):
+        self.server.connections.discard(self)
+
+    def on_message(self, message):
+        self.server.handle(self, json.loads(message))
+
+
+class FakePadchatServer:
+    '''
+    实现cmdRet/userEvent协议的模拟服务器
+
+    init、login、getWxData、getLoginToken及媒体下载指令返回模拟数据，其他指令
+    直接返回成功；登录后可通过push主动推送消息
+    '''
+
+    def __init__(self, port=0, address='127.0.0.1', latency=0,
+                 media_size=64 * 1024, user=None, contacts=None,
+                 max_message_size=64 * 1024 * 1024):
+        '''
+        :param port: 监听端口，0为随机端口
+        :param latency: 指令回应延迟秒数
+        :param media_size: getMsgImage等返回的媒体大小
+        :param user: 扫码登录后的用户数据
+        :param contacts: syncContact时推送的联系人列表
+        :param max_message_size: 最大接收帧大小，需大于base64编码后的媒体
+        '''
+        self.port = port
+        self.address = address
+        self.latency = latency
+        self.user = dict(FAKE_USER, **(user or {}))
+        self.contacts = contacts or []
+        self.sync_requests = []     # 每次syncContact的reset参数
+        self._synced = {}           # 已同步的联系人 user_name -> 内容
+        self.max_message_size = max_message_size
+        self.connections = set()
+        self.commands = collections.Counter()
+        self._media = base64.b64encode(os.urandom(media_size)).decode()
+        self._msg_id = itertools.count(1)
+        self._server = None
+
+    @property
+    def url(self):
+        return 'ws://{}:{}/'.format(self.address, self.port)
+
+    def start(self):
+        app = web.Application(
+            [('/', _PadchatHandler, {'server': self})],
+            websocket_max_message_size=self.max_message_size)
+        sockets = netutil.bind_sockets(self.port, self.address)
+        self.port = sockets[0].getsockname()[1]
+        self._server = httpserver.HTTPServer(app)
+        self._server.add_sockets(sockets)
+        return self
+
+    def stop(self):
+        self.drop_all()
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+
+    def drop_all(self):
+        '''
+        断开所有客户端，模拟服务器重启
+        '''
+        for connection in list(self.connections):
+            connection.close()
+        self.connections.clear()
+
+    # 协议 ####################################################################
+
+    def _write(self, connection, message):
+        if connection.ws_connection is not None:
+            connection.write_message(json.dumps(message, ensure_ascii=False))
+
+    def reply(self, connection, cmd_id, payload):
+        self._write(connection, {'type': 'cmdRet', 'cmdId': cmd_id,
+                                 'payload': payload})
+
+    def event(self, connection, event, payload):
+        self._write(connection, {'type': 'userEvent', 'event': event,
+                                 'payload': payload})
+
+    def handle(self, connection, message):
+        cmd = message.get('cmd')
+        self.commands[cmd] += 1
+        handler = getattr(self, 'cmd_' + cmd, None)
+        payload = handler(connection, message.get('payload') or {}) \
+            if handler is not None else {'success': True, 'data': {}}
+        if self.latency:
+            asyncio.get_event_loop().call_later(
+                self.latency, self.reply, connection, message.get('cmdId'),
+                payload)
+        else:
+            self.reply(connection, message.get('cmdId'), payload)
+
+    def cmd_getWxData(self, connection, data):
+        return {'success': True, 'data': {'wx_data': 'fake-wx-data'}}
+
+    def cmd_getLoginToken(self, connection, data):
+        return {'success': True, 'data': {'token': 'fake-token'}}
+
+    def cmd_login(self, connection, data):
+        loop = asyncio.get_event_loop()
+        if data.get('loginType') == 'qrcode':
+            loop.call_soon(self.event, connection, 'qrcode',
+                           {'url': 'http://weixin.qq.com/x/fake'})
+            loop.call_soon(self.event, connection, 'scan', self.user)
+        loop.call_soon(self.event, connection, 'login', {})
+        loop.call_soon(self.event, connection, 'loaded', {})
+        return {'success': True, 'msg': 'ok', 'data': {}}
+
+    def cmd_syncContact(self, connection, data):
+        # reset为False时只推送上次同步后新增或变化的联系人
+        reset = bool(data.get('reset'))
+        self.sync_requests.append(reset)
+        if reset:
+            self._synced.clear()
+        loop = asyncio.get_event_loop()
+        for contact in self.contacts:
+            if self._synced.get(contact['user_name']) == contact:
+                continue
+            self._synced[contact['user_name']] = dict(contact)
+            loop.call_soon(self.event, connection, 'contact', contact)
+        loop.call_soon(self.event, connection, 'loaded', {})
+        return {'success': True, 'data': {}}
+
+    def _media_payload(self, field):
+        return {'success': True, 'data': {field: self._media}}
+
+    def cmd_getMsgImage(self, connection, data):
+        return self._media_payload('image')
+
+    def cmd_getMsgVideo(self, connection, data):
+        return self._media_payload('video')
+
+    def cmd_getMsgVoice(self, connection, data):
+        return self._media_payload('voice')
+
+    # 推送 ####################################################################
+
+    def text_push(self, content='你好', from_user='wxid_friend', to_user=None):
+        return {
+            'sub_type': 1,
+            'msg_id': str(next(self._msg_id)),
+            'from_user': from_user,
+            'to_user': to_user or self.user['user_name'],
+            'content': content,
+            'msg_source': '',
+            'timestamp': 0,
+        }
+
+    @staticmethod
+    def fake_contacts(friends=100, rooms=10):
+        '''
+        生成模拟联系人
+        '''
+        contacts = [{
+            'user_name': 'wxid_friend{}'.format(i),
+            'nick_name': '好友{}'.format(i),
+            'remark': '',
+            'sex': i % 3,
+            'signature': '签名' * 10,
+            'small_head': 'http://wx.qlogo.cn/mmhead/{}/132'.format(i),
+            'big_head': 'http://wx.qlogo.cn/mmhead/{}/0'.format(i),
+        } for i in range(friends)]
+        contacts += [{
+            'user_name': '{}@chatroom'.format(1000000 + i),
+            'nick_name': '群{}'.format(i),
+            'chatroom_owner': 'wxid_friend0',
+            'member': ['wxid_friend{}'.format(j)
+                       for j in range(min(friends, 100))],
+        } for i in range(rooms)]
+        return contacts
+
+    def push(self, messages, connection=None):
+        '''
+        推送消息
+        :param messages: 推送内容列表
+        :param connection: 目标连接，默认推送给所有客户端
+        '''
+        targets = [connection] if connection is not None \
+            else list(self.connections)
+        for target in targets:
+            self.event(target, 'push', {'list': messages})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='模拟Padchat服务器')
+    parser.add_argument('--port', type=int, default=7777)
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--latency', type=float, default=0)
+    args = parser.parse_args(argv)
+    server = FakePadchatServer(args.port, args.address,
+                               latency=args.latency).start()
+    print('Fake Padchat server: {}'.format(server.url))
+    asyncio.get_event_loop().run_forever()
+
+
+if __name__ == '__main__':
+    main()
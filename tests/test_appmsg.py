@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+from padchat.appmsg import AppMsg, app_msg_type
+
+
+TRANSFER = '''<msg>
+<appmsg appid="wx_pay" sdkver="">
+    <title><![CDATA[微信转账]]></title>
+    <des><![CDATA[收到转账0.01元]]></des>
+    <type>2000</type>
+    <url><![CDATA[https://support.weixin.qq.com/cgi-bin/mmsupport-bin/readtemplate?t=page/common_page__upgrade]]></url>
+    <wcpayinfo>
+        <paysubtype>1</paysubtype>
+        <feedesc><![CDATA[￥0.01]]></feedesc>
+        <type>9</type>
+    </wcpayinfo>
+</appmsg>
+<fromusername>wxid_friend</fromusername>
+</msg>'''
+
+
+def test_type_stops_at_appmsg_type():
+    assert app_msg_type(TRANSFER) == '2000'
+    # 只读取<appmsg>的直接子节点，之后的内容不影响结果
+    assert app_msg_type(TRANSFER.replace('</msg>', '<broken')) == '2000'
+    assert app_msg_type('<appmsg><title>x</title><type> 5 </type></appmsg>') \
+        == '5'
+
+
+def test_type_missing_or_invalid():
+    assert app_msg_type('<msg><appmsg><title>x</title></appmsg></msg>') is None
+    assert app_msg_type('<msg><type>1</type></msg>') is None
+    assert app_msg_type('wxid_friend:\n<msg>') is None
+    assert app_msg_type('') is None
+
+
+def test_fields_parsed_lazily():
+    app = AppMsg(TRANSFER)
+    assert app.type == '2000'
+    assert app._element is False
+    assert app.title == '微信转账' and app.des == '收到转账0.01元'
+    assert app.get('wcpayinfo/feedesc') == '￥0.01'
+    assert app.appid == 'wx_pay'
+    assert app.get('missing', 'default') == 'default'
+    broken = AppMsg('<msg><appmsg>')
+    assert broken.type is None and broken.title is None
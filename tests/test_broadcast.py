@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+from padchat.broadcast import BroadcastCheckpoint
+
+
+def test_broadcast_resumes_from_checkpoint(run, connect, server, tmp_path):
+    path = str(tmp_path / 'notice.ckpt')
+    targets = ['wxid_friend{}'.format(i) for i in range(20)]
+    failing = {'wxid_friend3', 'wxid_friend11'}
+    sent = []
+
+    def send_msg(connection, data):
+        sent.append(data['toUserName'])
+        if data['toUserName'] in failing:
+            return {'success': False, 'msg': 'failed'}
+        return {'success': True, 'data': {}}
+
+    server.cmd_sendMsg = send_msg
+
+    async def broadcast():
+        client = await connect()
+        callbacks = []
+        first = await client.broadcast(
+            targets, content='通知', concurrency=4, checkpoint=path,
+            callback=lambda target, result: callbacks.append(target))
+        assert sorted(callbacks) == sorted(targets)
+        failing.clear()
+        del sent[:]
+        second = await client.broadcast(targets, content='通知',
+                                        checkpoint=path)
+        return first, second
+
+    first, second = run(broadcast())
+    assert set(first.failed) == {'wxid_friend3', 'wxid_friend11'}
+    assert len(first.succeeded) == 18 and first.total == 20
+    # 再次群发只发送上次失败的接收者
+    assert sorted(sent) == ['wxid_friend11', 'wxid_friend3']
+    assert second.skipped == 18 and len(second.succeeded) == 2
+    assert BroadcastCheckpoint(path).done == set(targets)
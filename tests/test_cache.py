@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import base64
+import os
+import threading
+
+from padchat.cache import MediaCache
+
+
+class FakeLoader:
+    def __init__(self, content=b'image-data'):
+        self.content = content
+        self.calls = 0
+
+    async def __call__(self, raw_data):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return {'success': True, 'data': {
+            'image': base64.encodebytes(self.content).decode('ascii')}}
+
+
+def _push(msg_id, md5=None):
+    content = '<msg><img md5="{}" /></msg>'.format(md5) if md5 else ''
+    return {'msg_id': msg_id, 'content': content}
+
+
+def test_concurrent_fetch_downloads_once(run, tmp_path):
+    cache = MediaCache(str(tmp_path))
+    loader = FakeLoader()
+
+    async def fetch():
+        return await asyncio.gather(*[
+            cache.fetch('image', _push(str(i), 'ABCDEF'), loader)
+            for i in range(5)])
+
+    paths = run(fetch())
+    assert len(set(paths)) == 1 and loader.calls == 1
+    assert os.path.basename(paths[0]) == 'image-abcdef.jpg'
+    with open(paths[0], 'rb') as f:
+        assert f.read() == b'image-data'
+    assert cache.stats()['hits'] == 4 and cache.stats()['misses'] == 1
+
+
+def test_keyless_media_keyed_by_content(run, tmp_path):
+    cache = MediaCache(str(tmp_path))
+    threads = []
+    write = cache._write
+
+    def record(*args):
+        threads.append(threading.get_ident())
+        return write(*args)
+    cache._write = record
+
+    async def fetch():
+        first = await cache.fetch('image', _push(None), FakeLoader(b'a'))
+        second = await cache.fetch('image', _push(None), FakeLoader(b'b'))
+        again = await cache.fetch('image', _push(None), FakeLoader(b'a'))
+        return first, second, again
+
+    first, second, again = run(fetch())
+    assert first == again and first != second
+    assert os.path.basename(first).startswith('image-sha1')
+    assert threading.get_ident() not in threads
+    assert not [name for name in os.listdir(str(tmp_path))
+                if name.endswith('.tmp')]
+
+
+def test_lru_eviction(run, tmp_path):
+    cache = MediaCache(str(tmp_path), max_size=25)
+    loader = FakeLoader(b'x' * 10)
+
+    async def fetch():
+        return [await cache.fetch('image', _push(str(i), 'aa{}'.format(i)),
+                                  loader) for i in range(3)]
+
+    paths = run(fetch())
+    assert not os.path.exists(paths[0])
+    assert cache.path('image-aa2') == paths[2]
+    assert cache.size == 20
+    # 重新打开目录时恢复已缓存的文件
+    assert MediaCache(str(tmp_path)).size == 20
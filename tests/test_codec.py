@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import pytest
+
+from padchat import codec as codec_module
+from padchat.codec import JSONCodec, OrjsonCodec, UJSONCodec, default_codec
+
+
+def test_default_codec_fallback(monkeypatch):
+    monkeypatch.setattr(codec_module, 'orjson', object())
+    assert isinstance(default_codec(), OrjsonCodec)
+    monkeypatch.setattr(codec_module, 'orjson', None)
+    monkeypatch.setattr(codec_module, 'ujson', object())
+    assert isinstance(default_codec(), UJSONCodec)
+    monkeypatch.setattr(codec_module, 'ujson', None)
+    assert type(default_codec()) is JSONCodec
+
+
+def test_json_codec_round_trip():
+    codec = JSONCodec()
+    data = {'content': '你好', 'uin': 2 ** 70}
+    encoded = codec.dumps(data)
+    assert isinstance(encoded, bytes)
+    assert codec.loads(encoded) == codec.loads(encoded.decode('utf-8')) == data
+
+
+def test_orjson_falls_back_for_big_integers():
+    pytest.importorskip('orjson')
+    codec = OrjsonCodec()
+    data = {'content': '你好', 'uin': 2 ** 70}
+    assert codec.loads(codec.dumps(data)) == data
+    assert codec.loads('{"a": 1}') == {'a': 1}
+
+
+def test_client_with_stdlib_codec(run, connect):
+    async def send():
+        client = await connect(codec=JSONCodec())
+        return await client.get_my_info()
+
+    assert run(send())['success'] is True
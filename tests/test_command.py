@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import re
+
+from padchat.command import CommandRouter, CommandScope
+
+
+def _text(content, from_user='wxid_a'):
+    return {'content': content, 'from_user': from_user}
+
+
+def _name(router, content, scope=CommandScope.person, **kwargs):
+    matched = router.match(_text(content, **kwargs), scope)
+    return matched[0].__name__ if matched else None
+
+
+def test_exact_then_longest_prefix_then_regex():
+    router = CommandRouter()
+
+    @router.command(regex=r'查询')
+    def regex(context, match):
+        pass
+
+    @router.command(prefix='查')
+    def short(context, match):
+        pass
+
+    @router.command(prefix='查询')
+    def long(context, match):
+        pass
+
+    @router.command(exact='查询')
+    def exact(context, match):
+        pass
+
+    assert _name(router, '查询') == 'exact'
+    assert _name(router, '查询 天气') == 'long'
+    assert _name(router, '查看') == 'short'
+    assert router.match(_text('查询 天气'), CommandScope.person)[1].args \
+        == '天气'
+
+
+def test_regex_in_registration_order():
+    router = CommandRouter()
+
+    @router.command(regex=r'(?P<n>\d+)')
+    def first(context, match):
+        pass
+
+    @router.command(regex=re.compile(r'[a-z]+', re.I))
+    def flagged(context, match):
+        pass
+
+    @router.command(regex=r'\w+')
+    def last(context, match):
+        pass
+
+    assert _name(router, '42') == 'first'
+    assert router.match(_text('42'), CommandScope.person)[1].match.group('n') \
+        == '42'
+    # 带flags的正则不参与合并，仍按注册顺序优先
+    assert _name(router, 'ABC') == 'flagged'
+    assert _name(router, '中文') == 'last'
+
+
+def test_filtered_command_falls_through():
+    router = CommandRouter()
+
+    @router.command(prefix='群名:', scope=CommandScope.group,
+                    users=['wxid_admin'])
+    def admin(context, match):
+        pass
+
+    @router.command(prefix='群名')
+    def anyone(context, match):
+        pass
+
+    room = 'room@chatroom'
+    assert _name(router, 'wxid_admin:\n群名: 新名字', CommandScope.group,
+                 from_user=room) == 'admin'
+    assert _name(router, 'wxid_b:\n群名: 新名字', CommandScope.group,
+                 from_user=room) == 'anyone'
+    assert _name(router, '群名: 新名字') == 'anyone'
+    assert _name(router, '群名: 新名字', CommandScope.self) is None
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+
+
+
+def test_second_sync_is_incremental(run, server, connect):
+    server.contacts = server.fake_contacts(friends=20, rooms=2)
+
+    async def sync():
+        client = await connect()
+        first = [contact async for contact in client.iter_contacts(
+            batch_size=5)]
+        server.contacts.append({'user_name': 'wxid_new', 'nick_name': '新'})
+        second = [contact async for contact in client.iter_contacts()]
+        return client, first, second
+
+    client, first, second = run(sync())
+    assert len(first) == 22
+    assert [contact['user_name'] for contact in second] == ['wxid_new']
+    assert server.sync_requests == [True, False]
+    assert client.directory.synced
+    assert len(client.directory) == 23
+
+
+def test_loaded_before_answer_is_ignored(run, server, connect):
+    server.contacts = server.fake_contacts(friends=8, rooms=0)
+
+    async def sync():
+        client = await connect()
+        stream = client.sync_contacts_stream()
+        first = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0)
+        # 登录等产生的loaded事件，早于syncContact回应
+        client.event_loaded({})
+        batches = [await first] + [batch async for batch in stream]
+        return client, batches
+
+    client, batches = run(sync())
+    assert sum(len(batch) for batch in batches) == 8
+    assert client.directory.synced
+
+
+def test_stream_reports_batches_and_progress(run, server, connect):
+    server.contacts = server.fake_contacts(friends=10, rooms=3)
+    progress = []
+
+    async def sync():
+        client = await connect()
+        stream = client.sync_contacts_stream(
+            batch_size=4, progress=lambda s: progress.append(s.count))
+        batches = [batch async for batch in stream]
+        return stream, batches
+
+    stream, batches = run(sync())
+    assert [len(batch) for batch in batches] == [4, 4, 4, 1]
+    assert progress == [4, 8, 12, 13]
+    assert stream.rooms == 3
+
+
+def test_sqlite_sink_remembers_sync(run, server, connect, tmp_path):
+    from padchat.contacts import SQLiteSink
+    server.contacts = server.fake_contacts(friends=5, rooms=0)
+    path = str(tmp_path / 'contacts.db')
+
+    async def sync():
+        client = await connect()
+        sink = SQLiteSink(path)
+        count = await client.sync_contacts_stream(sink=sink).wait()
+        client.disconnect()
+        return sink, count
+
+    sink, count = run(sync())
+    assert count == 5 and len(sink) == 5
+    assert sink.contact('wxid_friend3')['nick_name'] == '好友3'
+    sink.close()
+    # 新的客户端使用同一个数据库，只同步增量
+    sink, count = run(sync())
+    assert server.sync_requests == [True, False]
+    sink.close()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import time
+
+from padchat.dedup import MessageDeduplicator, RollingBloomFilter
+
+
+def test_lru_evicted_ids_fall_back_to_bloom():
+    dedup = MessageDeduplicator(size=10, bloom=RollingBloomFilter(1000))
+    assert not any(dedup.seen(str(i)) for i in range(100))
+    assert len(dedup) == 10
+    assert all(dedup.seen(str(i)) for i in range(100))
+    assert dedup.duplicates == 100
+
+    lru_only = MessageDeduplicator(size=10)
+    for i in range(100):
+        lru_only.seen(str(i))
+    assert not lru_only.seen('0')
+    assert lru_only.seen('99')
+
+
+def test_max_age():
+    dedup = MessageDeduplicator(max_age=0.01)
+    assert not dedup.seen('a')
+    assert dedup.seen('a')
+    time.sleep(0.02)
+    assert not dedup.seen('a')
+
+
+def test_rolling_generations():
+    bloom = RollingBloomFilter(capacity=10, generations=2)
+    for i in range(20):
+        bloom.add(str(i))
+    assert all(str(i) in bloom for i in range(20))
+    # 第三代写入后最旧的一代被丢弃
+    bloom.add('20')
+    assert '0' not in bloom and '19' in bloom
+
+
+def test_bloom_survives_restart(tmp_path):
+    path = str(tmp_path / 'dedup.bloom')
+    dedup = MessageDeduplicator(size=10, save_every=1000,
+                                bloom=RollingBloomFilter(1000, path=path))
+    for i in range(50):
+        dedup.seen(str(i))
+    dedup.save()
+
+    restarted = MessageDeduplicator(size=10,
+                                    bloom=RollingBloomFilter(1000, path=path))
+    assert all(restarted.seen(str(i)) for i in range(50))
+    assert not restarted.seen('new')
+
+    with open(path, 'wb') as f:
+        f.write(b'broken')
+    assert not MessageDeduplicator(
+        bloom=RollingBloomFilter(1000, path=path)).seen('0')
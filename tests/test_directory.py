@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+from padchat import directory as directory_module
+from padchat.directory import ContactDirectory
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(directory_module.time, 'monotonic', clock)
+    directory = ContactDirectory(ttl=60)
+    directory.update_contact({'user_name': 'wxid_a', 'nick_name': 'A',
+                              'remark': '老A'})
+    directory.update_room_members('1@chatroom', {'member': [
+        {'user_name': 'wxid_a', 'chatroom_nick_name': '群昵称'}]})
+    clock.now += 59
+    assert directory.by_remark('老A')['nick_name'] == 'A'
+    assert directory.display_name('wxid_a', '1@chatroom') == '群昵称'
+    clock.now += 2
+    assert directory.contact('wxid_a') is None
+    assert directory.room_members('1@chatroom') is None
+    assert directory.display_name('wxid_a', '1@chatroom') is None
+    # 过期数据仍保留，更新后重新生效
+    assert 'wxid_a' in directory
+    directory.update_contact({'user_name': 'wxid_a', 'nick_name': 'A2'})
+    assert directory.display_name('wxid_a', '1@chatroom') == 'A2'
+    assert directory.by_remark('老A') is None
+
+
+def test_invalidate_and_no_ttl():
+    directory = ContactDirectory(ttl=None)
+    directory.update_contact({'user_name': '1@chatroom', 'nick_name': '群'})
+    directory.update_room_members('1@chatroom', {'member': []})
+    assert directory.contact('1@chatroom') is not None
+    directory.invalidate('1@chatroom')
+    assert directory.contact('1@chatroom') is None
+    assert directory.room_members('1@chatroom') is None
+
+
+def test_get_contact_served_locally(run, connect, server):
+    def get_contact(connection, data):
+        return {'success': True, 'data': {'user_name': data['userId'],
+                                          'nick_name': '好友'}}
+
+    server.cmd_getContact = get_contact
+
+    async def lookup():
+        client = await connect()
+        results = [await client.get_contact('wxid_friend') for _ in range(3)]
+        await client.get_contact('wxid_friend', refresh=True)
+        return results
+
+    results = run(lookup())
+    assert all(result['data']['nick_name'] == '好友' for result in results)
+    assert server.commands['getContact'] == 2
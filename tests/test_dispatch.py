@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+from .fixtures import make_client
+
+
+APP_XML = '<msg><appmsg appid=""><title>红包</title><type>{}</type></appmsg></msg>'
+
+
+def _push(msg_id, sub_type, content='', from_user='wxid_friend'):
+    return {'msg_id': str(msg_id), 'sub_type': sub_type, 'content': content,
+            'from_user': from_user, 'to_user': 'wxid_fakeuser'}
+
+
+def test_push_table_wildcard_and_sub_types():
+    client = make_client()
+    calls = []
+
+    @client.on()
+    def every(push):
+        calls.append(('all', push['msg_id']))
+
+    @client.on(sub_type=3)
+    def image(push):
+        calls.append(('image', push['msg_id']))
+
+    @client.on(sub_type=49, app_type='2001')
+    def red_packet(push):
+        calls.append(('2001', push['msg_id']))
+
+    @client.on_text(group=False)
+    def text(push):
+        calls.append(('text', push['msg_id']))
+
+    client.event_push({'list': [
+        _push(1, 1, 'hi'), _push(2, 3), _push(3, 49, APP_XML.format('2001')),
+        _push(4, 49, APP_XML.format('5')), _push(5, 10002)]})
+    # 具体sub_type的处理函数先于通配处理函数
+    assert calls == [('text', '1'), ('all', '1'), ('image', '2'), ('all', '2'),
+                     ('2001', '3'), ('all', '3'), ('all', '4'), ('all', '5')]
+
+    # 注册表不变时复用分发表，变化后重建
+    _, table = client._dispatch_tables()
+    assert client._dispatch_tables()[1] is table
+    client.handlers.remove(every)
+    del calls[:]
+    client.event_push({'list': [_push(6, 3), _push(7, 10002)]})
+    assert calls == [('image', '6')]
+    assert None not in client._dispatch_tables()[1]
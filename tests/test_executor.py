@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import threading
+
+from padchat.executor import ExecutionPolicy, HandlerExecutors, LoopProxy
+
+
+def test_thread_stats_recorded_on_loop(run):
+    executors = HandlerExecutors(thread_workers=8)
+    threads = set()
+
+    def handler(data):
+        return data * 2
+
+    async def submit():
+        results = []
+        for i in range(200):
+            executors.submit(ExecutionPolicy.thread, handler, i,
+                             lambda data, result: (
+                                 results.append(result),
+                                 threads.add(threading.get_ident())))
+        while len(results) < 200:
+            await asyncio.sleep(0.01)
+        return results
+
+    results = run(submit())
+    stats = executors.stats()[ExecutionPolicy.thread]
+    executors.shutdown()
+    assert sorted(results) == [i * 2 for i in range(200)]
+    assert threads == {threading.get_ident()}
+    assert stats['completed'] == 200 and stats['pending'] == 0
+
+
+class _Client:
+    def __init__(self):
+        self.calls = []
+
+    def is_group(self, value):
+        return value.endswith('@chatroom')
+
+    def update(self, value):
+        self.calls.append((value, threading.get_ident()))
+        return len(self.calls)
+
+    async def fetch(self, value):
+        return value
+
+
+def test_loop_proxy_forwards_coroutines_only(run):
+    client = _Client()
+
+    def worker(proxy):
+        # 普通方法直接返回结果，协程接口及call转到事件循环
+        return (proxy.is_group('wxid_a'), proxy.fetch('b'),
+                proxy.call(proxy.update, 'a'))
+
+    async def call():
+        proxy = LoopProxy(client)
+        loop = asyncio.get_event_loop()
+        group, fetched, updated = await loop.run_in_executor(
+            None, worker, proxy)
+        return (group, await asyncio.wrap_future(fetched),
+                await asyncio.wrap_future(updated),
+                proxy.call(proxy.update, 'c').result())
+
+    assert run(call()) == (False, 'b', 1, 2)
+    assert [ident for _, ident in client.calls] == \
+        [threading.get_ident()] * 2
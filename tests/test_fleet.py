@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+
+from padchat.fleet import PadchatFleet
+from padchat.logger import WireLog, WireLogLevel
+from padchat.reconnect import ReconnectPolicy
+
+from .fixtures import LocalClient, account, logged_in
+
+
+class _TimedClient(LocalClient):
+    def connect(self, url):
+        self.connected_at = asyncio.get_event_loop().time()
+        return super().connect(url)
+
+
+def test_fleet_staggers_and_reports(run, server):
+    fleet = PadchatFleet(server.url, client_class=_TimedClient, stagger=0.05,
+                         wire_log=WireLog(WireLogLevel.off), ping_interval=None)
+    for name in ('a', 'b', 'c'):
+        fleet.add(name, reconnect=ReconnectPolicy(login_delay=0), **account())
+
+    async def start():
+        await fleet.start()
+        await logged_in(list(fleet))
+        return fleet.stats()
+
+    try:
+        stats = run(start())
+    finally:
+        fleet.stop()
+        fleet.executors.shutdown(wait=False)
+    times = [client.connected_at for client in fleet]
+    assert all(later - earlier >= 0.045
+               for earlier, later in zip(times, times[1:]))
+    assert sorted(stats) == ['a', 'b', 'c']
+    assert all(item['started'] and item['alive'] and item['inflight'] == 0
+               for item in stats.values())
+    # 缓存及执行器共用，通讯录及发送调度为每个账号独立
+    clients = list(fleet)
+    assert clients[0].upload_cache is clients[1].upload_cache
+    assert clients[0].executors is clients[2].executors
+    assert clients[0].directory is not clients[1].directory
+    assert clients[0]._scheduler is not clients[1]._scheduler
+    assert fleet.stats()['a']['started'] is False
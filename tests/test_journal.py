@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+import os
+import threading
+
+from padchat.executor import ExecutionPolicy
+from padchat.journal import PushJournal
+
+
+def _journal(directory, **kwargs):
+    kwargs.setdefault('fsync_interval', None)
+    return PushJournal(str(directory), **kwargs)
+
+
+def test_replay_after_crash(run, tmp_path):
+    async def crash():
+        journal = _journal(tmp_path)
+        for i in range(5):
+            journal.append({'msg_id': str(i), 'content': 'x' * 600 * (i % 2)})
+        journal.flush()
+        journal.done(1)
+        journal.done(2)
+        journal.sync()
+        # 进程崩溃：最后一条记录只写入一半
+        journal._file.write(b'\x10\x00\x00\x00garbage')
+        journal._file.flush()
+        return journal._segment_path(1)
+
+    path = run(crash())
+    size = os.path.getsize(path)
+
+    async def recover():
+        recovered = _journal(tmp_path)
+        assert os.path.getsize(path) < size
+        assert recovered.checkpoint == 2 and recovered.pending == 3
+        replayed = list(recovered.replay())
+        # 每条只重放一次
+        assert list(recovered.replay()) == []
+        # 截断后继续追加，序号连续
+        assert recovered.append({'msg_id': '5'}) == 6
+        for offset in (3, 4, 5, 6):
+            recovered.done(offset)
+        recovered.close()
+        return replayed
+
+    replayed = run(recover())
+    assert [offset for offset, _ in replayed] == [3, 4, 5]
+    assert replayed[0][1] == {'msg_id': '2', 'content': ''}
+    assert replayed[1][1]['content'] == 'x' * 600
+    assert run(_replay(tmp_path)) == []
+
+
+async def _replay(directory):
+    return list(_journal(directory).replay())
+
+
+def test_checkpoint_waits_for_earlier_offsets(run, tmp_path):
+    async def complete():
+        journal = _journal(tmp_path)
+        for i in range(4):
+            journal.append({'msg_id': str(i)})
+        journal.flush()
+        journal.done(3)
+        journal.done(2)
+        assert journal.checkpoint == 0
+        journal.done(1)
+        assert journal.checkpoint == 3
+        journal.close()
+
+    run(complete())
+    assert [item['msg_id'] for _, item in run(_replay(tmp_path))] == ['3']
+
+
+def test_processed_segments_removed(run, tmp_path):
+    async def write():
+        journal = _journal(tmp_path, segment_size=64, compress=False)
+        for i in range(10):
+            journal.append({'msg_id': str(i), 'content': 'y' * 40})
+        journal.flush()
+        segments = len(journal._segments())
+        assert segments > 1
+        for offset in range(1, 10):
+            journal.done(offset)
+        journal.sync()
+        assert len(journal._segments()) < segments
+
+    run(write())
+    assert [item['msg_id'] for _, item in run(_replay(tmp_path))] == ['9']
+
+
+def test_fsync_off_the_loop(run, tmp_path):
+    threads = []
+    fsync = os.fsync
+
+    def record(fd):
+        threads.append(threading.get_ident())
+        fsync(fd)
+
+    async def write():
+        journal = _journal(tmp_path, fsync_interval=0.01)
+        journal.append({'msg_id': '1'})
+        journal.flush()
+        journal.done(1)
+        await asyncio.sleep(0.05)
+        return journal
+
+    os.fsync = record
+    try:
+        journal = run(write())
+    finally:
+        os.fsync = fsync
+    assert threads and threading.get_ident() not in threads
+    assert journal.syncs == 1
+    with open(journal._checkpoint_file) as f:
+        assert f.read() == '1'
+
+
+def test_checkpoint_after_handlers_finish(run, connect, server, tmp_path):
+    release = threading.Event()
+
+    async def push():
+        journal = _journal(tmp_path)
+        client = await connect(journal=journal)
+
+        @client.on(sub_type=1, policy=ExecutionPolicy.thread)
+        def slow(push):
+            release.wait(5)
+
+        done = asyncio.get_event_loop().create_future()
+
+        @client.on(sub_type=1)
+        async def handler(push):
+            await done
+
+        server.push([server.text_push()])
+        while not journal.appended:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        assert journal.checkpoint == 0
+        done.set_result(None)
+        await asyncio.sleep(0.05)
+        assert journal.checkpoint == 0
+        release.set()
+        while journal.checkpoint == 0:
+            await asyncio.sleep(0.01)
+        return journal
+
+    assert run(push()).checkpoint == 1
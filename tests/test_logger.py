@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+from padchat.logger import BASE64_PATTERN, WireLog, _WireRecord
+
+
+def _format(wire_log, raw):
+    return str(_WireRecord(wire_log, '>>>', 'cmd', 'sendImage', '1', raw))
+
+
+def test_truncated_frame_masks_base64():
+    wire_log = WireLog(max_length=300)
+    frame = ('{"cmd":"sendImage","payload":{"file":"' + 'QUJD' * 1000 +
+             '"}}').encode('utf-8')
+    text = _format(wire_log, frame)
+    assert '<base64 262 chars>...' in text
+    assert '{} bytes'.format(len(frame)) in text
+
+
+def test_truncated_frame_cut_inside_character():
+    text = _format(WireLog(max_length=4), '你好'.encode('utf-8'))
+    assert text.endswith('你�...')
+
+
+def test_base64_pattern_newlines():
+    assert BASE64_PATTERN.fullmatch('QUJD\n' * 40)
+    assert not BASE64_PATTERN.search('\\' * 64 + 'n' * 64)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import base64
+import io
+import json
+import os
+
+from padchat import media as media_module
+from padchat.codec import JSONCodec
+from padchat.media import Media, UploadCache, encode_media
+
+
+def test_encode_paths_match_b64encode(tmp_path, monkeypatch):
+    monkeypatch.setattr(media_module, 'CHUNK_SIZE', 3 * 5)
+    for size in (0, 1, 2, 3, 44, 45, 46):
+        data = os.urandom(size)
+        expected = base64.b64encode(data)
+        path = tmp_path / 'media-{}'.format(size)
+        path.write_bytes(data)
+        # 文件路径及文件对象映射编码，BytesIO分块编码
+        assert encode_media(str(path)).data == expected
+        assert encode_media(path).data == expected
+        with open(str(path), 'rb') as file:
+            assert encode_media(file).data == expected
+            assert file.read() == b''
+        assert encode_media(io.BytesIO(data)).data == expected
+        assert encode_media(data).data == expected
+
+
+def test_encode_file_from_offset(tmp_path):
+    path = tmp_path / 'media'
+    path.write_bytes(b'header' + b'body' * 100)
+    with open(str(path), 'rb') as file:
+        file.read(6)
+        assert encode_media(file).data == base64.b64encode(b'body' * 100)
+    # 已编码的base64字符串原样返回
+    assert encode_media('aGVsbG8=') == 'aGVsbG8='
+
+
+def test_splice_media_into_frame():
+    codec = JSONCodec()
+    image = Media(base64.b64encode(os.urandom(1000)))
+    voice = Media(base64.b64encode(os.urandom(10)))
+    content, media = codec.dumps_frame({'cmd': 'sendImage', 'payload': {
+        'toUserName': 'wxid', 'file': image, 'voice': voice}})
+    assert media == [image, voice]
+    # json中只有占位文本，记录媒体长度
+    assert image.placeholder.endswith(':1336 bytes>')
+    assert image.placeholder.encode('ascii') in content
+    assert len(content) < len(image)
+    frame = json.loads(codec.splice(content, media).decode('utf-8'))
+    assert frame['payload']['file'] == str(image)
+    assert frame['payload']['voice'] == str(voice)
+
+
+def test_upload_cache_lru_and_disk_spill(tmp_path):
+    directory = str(tmp_path / 'uploads')
+    cache = UploadCache(max_size=3000, directory=directory,
+                        max_disk_size=3000)
+    items = [os.urandom(900) for _ in range(5)]     # 编码后1200字节
+    for data in items[:2]:
+        encode_media(data, cache)
+    # 访问第一项后，第二项最久未使用，先被写入磁盘
+    assert encode_media(items[0], cache).data == base64.b64encode(items[0])
+    encode_media(items[2], cache)
+    assert cache.size == 2400 and cache.disk_size == 1200
+    assert len(os.listdir(directory)) == 1
+    # 从磁盘读回
+    assert encode_media(items[1], cache).data == base64.b64encode(items[1])
+    assert cache.hits == 2 and cache.misses == 3
+    for data in items[3:]:
+        encode_media(data, cache)
+    # 磁盘超过上限时删除最久未使用的文件
+    assert cache.disk_size <= 3000
+    assert len(os.listdir(directory)) == len(cache._disk) == 2
+
+
+def test_upload_cache_file_key_changes_with_content(tmp_path):
+    cache = UploadCache()
+    path = tmp_path / 'image'
+    path.write_bytes(b'first')
+    first = encode_media(str(path), cache)
+    assert encode_media(str(path), cache) is first
+    path.write_bytes(b'second!')
+    assert encode_media(str(path), cache).data == base64.b64encode(b'second!')
+    assert cache.hits == 1 and cache.misses == 2
@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import json
+import pickle
+
+from padchat.message import PushMessage
+
+
+GROUP_PUSH = {
+    'msg_id': '1',
+    'sub_type': 1,
+    'from_user': '1000@chatroom',
+    'to_user': 'wxid_fakeuser',
+    'content': 'wxid_friend:\n@测试账号 你好',
+    'msg_source': '<msgsource><atuserlist><![CDATA[wxid_fakeuser,wxid_b]]>'
+                  '</atuserlist></msgsource>',
+}
+
+
+def test_push_message_is_plain_dict():
+    push = PushMessage(GROUP_PUSH)
+    assert isinstance(push, dict) and push == GROUP_PUSH
+    assert push['content'] == GROUP_PUSH['content']
+    assert push.get('missing') is None
+    assert json.loads(json.dumps(push)) == GROUP_PUSH
+    assert dict(push) == GROUP_PUSH and not hasattr(push, '__dict__')
+    # 访问属性后仍可序列化，传给进程池处理函数
+    assert push.sender == 'wxid_friend'
+    copied = pickle.loads(pickle.dumps(push))
+    assert copied == GROUP_PUSH and copied.body == '@测试账号 你好'
+
+
+def test_lazy_fields():
+    push = PushMessage(GROUP_PUSH)
+    assert push.is_group and push.room == '1000@chatroom'
+    assert push.sender == 'wxid_friend' and push.body == '@测试账号 你好'
+    assert push.mentions == ['wxid_fakeuser', 'wxid_b']
+    assert push.app is None
+    assert push.sub_type == 1 and push.msg_id == '1'
+
+    own = PushMessage(dict(GROUP_PUSH, from_user='wxid_fakeuser',
+                           to_user='1000@chatroom', content='hi',
+                           msg_source=''))
+    assert not own.is_group and own.room == '1000@chatroom'
+    assert own.sender == 'wxid_fakeuser' and own.body == 'hi'
+    assert own.mentions == []
+
+    app = PushMessage({'sub_type': 49, 'from_user': '1000@chatroom',
+                       'content': 'wxid_friend:\n<msg><appmsg><type>2001'
+                                  '</type></appmsg></msg>'})
+    assert app.app.type == '2001' and app.sender == 'wxid_friend'
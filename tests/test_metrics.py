@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+from padchat import PadchatClient
+from padchat.media import UploadCache
+from padchat.metrics import MetricsRegistry
+from padchat.user import User
+
+
+def _client(wx_id, registry, **kwargs):
+    return PadchatClient(user=User(wx_id), metrics=registry, **kwargs)
+
+
+def _samples(registry, name):
+    return [line for line in registry.render().splitlines()
+            if line.startswith(name + '{')]
+
+
+def test_per_client_caches_are_all_exported(run):
+    registry = MetricsRegistry()
+    first = _client('wxid_a', registry)
+    second = _client('wxid_b', registry)
+    second.upload_cache.hits = 99
+    hits = _samples(registry, 'padchat_cache_hits')
+    assert 'padchat_cache_hits{account="wxid_a",cache="upload"} 0' in hits
+    assert 'padchat_cache_hits{account="wxid_b",cache="upload"} 99' in hits
+    assert first and second
+
+
+def test_shared_cache_is_exported_once(run):
+    registry = MetricsRegistry()
+    cache = UploadCache()
+    cache.hits = 7
+    clients = [_client(wx_id, registry, upload_cache=cache)
+               for wx_id in ('wxid_a', 'wxid_b')]
+    hits = _samples(registry, 'padchat_cache_hits')
+    assert hits == ['padchat_cache_hits{account="shared",cache="upload"} 7']
+    # 未共用的指标仍按账号导出
+    assert len(_samples(registry, 'padchat_alive')) == len(clients)
+
+
+def test_client_series_labelled_by_account(run):
+    registry = MetricsRegistry()
+    clients = [_client(wx_id, registry) for wx_id in ('wxid_a', 'wxid_b')]
+    for i, client in enumerate(clients):
+        client._metrics.commands.inc('sendMsg', 'ok', amount=i + 1)
+        client._metrics.latency.observe(0.01, 'sendMsg')
+    assert _samples(registry, 'padchat_cmd_total') == [
+        'padchat_cmd_total{account="wxid_a",cmd="sendMsg",result="ok"} 1',
+        'padchat_cmd_total{account="wxid_b",cmd="sendMsg",result="ok"} 2']
+    assert len(_samples(registry, 'padchat_cmd_latency_seconds_count')) == 2
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+
+import pytest
+
+from padchat.exceptions import ConnectionClosed, RequestTimeout
+from padchat.media import Media
+from padchat.outbox import Outbox
+
+from .fixtures import make_client
+
+
+class FakeSend:
+    '''
+    记录发送的指令，fail中的指令第一次发送时连接中断
+    '''
+
+    def __init__(self, fail=()):
+        self.sent = []
+        self.fail = set(fail)
+
+    async def __call__(self, cmd, type, data, timeout, priority):
+        await asyncio.sleep(0)
+        if cmd in self.fail:
+            self.fail.discard(cmd)
+            raise ConnectionClosed('closed')
+        self.sent.append((cmd, data))
+        return {'success': True, 'cmd': cmd}
+
+
+def test_flush_in_order_and_coalesce(run):
+    async def flush():
+        outbox = Outbox(pipeline=1)
+        send = FakeSend()
+        futures = [outbox.put('sendMsg', data={'i': i}) for i in range(3)]
+        futures.append(outbox.put('getMyInfo'))
+        futures.append(outbox.put('getMyInfo'))
+        await outbox.flush(send, lambda: True)
+        return outbox, send, await asyncio.gather(*futures)
+
+    outbox, send, results = run(flush())
+    assert [data for _, data in send.sent] == \
+        [{'i': 0}, {'i': 1}, {'i': 2}, None]
+    assert results[-1] is results[-2]
+    assert outbox.coalesced == 1 and outbox.sent == 4 and not outbox.busy
+
+
+def test_retry_keeps_order(run):
+    async def flush():
+        outbox = Outbox(pipeline=3)
+        send = FakeSend(fail={'getContact'})
+        for cmd in ('getContact', 'getRoomMembers', 'getMyInfo'):
+            outbox.put(cmd)
+        await outbox.flush(send, lambda: bool(send.fail))
+        order = [entry.cmd for entry in outbox._entries]
+        await outbox.flush(send, lambda: True)
+        return outbox, order
+
+    outbox, order = run(flush())
+    assert order == ['getContact']
+    assert outbox.retried == 1 and outbox.sent == 3
+
+
+def test_expire(run):
+    async def expire():
+        outbox = Outbox(ttl=0.01)
+        future = outbox.put('sendMsg', data={'content': 'hi'})
+        with pytest.raises(RequestTimeout):
+            await future
+        return outbox
+
+    outbox = run(expire())
+    assert outbox.expired == 1 and len(outbox) == 0
+
+
+def test_restore_from_file(run, tmp_path):
+    path = str(tmp_path / 'outbox.jsonl')
+    media = Media(b'aGVsbG8=')
+
+    async def queue():
+        outbox = Outbox(path=path, ttls={'sendMsg': 0.01})
+        outbox.put('sendImage', data={'to_user_name': 'wxid', 'file': media})
+        outbox.put('getMyInfo')
+        outbox.put('sendMsg', data={'content': 'late'})
+        # 模拟进程退出
+        for entry in outbox._entries:
+            entry.handle.cancel()
+        outbox._file.close()
+
+    async def restore():
+        outbox = Outbox(path=path)
+        # 恢复的幂等指令仍可合并
+        future = outbox.put('getMyInfo')
+        await asyncio.sleep(0.01)
+        send = FakeSend()
+        await outbox.flush(send, lambda: True)
+        return outbox, send, await future
+
+    run(queue())
+    with open(path, 'rb') as f:
+        assert f.read().count(b'aGVsbG8=') == 1
+    outbox, send, result = run(restore())
+    assert [cmd for cmd, _ in send.sent] == ['sendImage', 'getMyInfo']
+    file = send.sent[0][1]['file']
+    assert isinstance(file, Media) and file.data == b'aGVsbG8='
+    assert result['cmd'] == 'getMyInfo' and outbox.coalesced == 1
+    assert outbox.expired == 1
+
+
+def test_client_without_outbox_fails_fast(run):
+    async def send():
+        client = make_client()
+        assert client.outbox is None
+        with pytest.raises(ConnectionClosed):
+            await asyncio.wait_for(client.get_my_info(), 1)
+
+    run(send())
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import random
+
+from padchat.reconnect import CircuitState, ReconnectPolicy
+
+
+def test_failures_reset_only_after_login():
+    policy = ReconnectPolicy(failure_threshold=3)
+    policy.failure()
+    policy.failure()
+    # 连接成功但登录前再次中断，继续累计
+    policy.connected()
+    assert policy.failures == 2
+    policy.disconnected()
+    assert policy.failures == 3 and policy.state == CircuitState.open
+
+    policy.next_delay()
+    assert policy.state == CircuitState.half_open
+    policy.connected()
+    policy.logged_in()
+    assert policy.failures == 0 and policy.state == CircuitState.closed
+    # 登录后的断线不计为失败
+    policy.disconnected()
+    assert policy.failures == 0
+
+
+def test_reset_timeout_jittered():
+    random.seed(1)
+    delays = set()
+    for _ in range(20):
+        policy = ReconnectPolicy(failure_threshold=1, reset_timeout=100,
+                                 jitter=0.5, max_rate=None)
+        policy.failure()
+        delays.add(policy.next_delay())
+        assert policy.state == CircuitState.half_open
+    assert len(delays) == 20
+    assert all(50 <= delay <= 100 for delay in delays)
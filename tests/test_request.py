@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+
+import pytest
+
+from padchat.exceptions import ConnectionClosed, RequestTimeout
+from padchat.request import MsgQueue, TimerWheel
+
+
+def test_timer_wheel_expires_and_removes(run):
+    expired = []
+
+    async def wait():
+        wheel = TimerWheel(expired.append, tick=0.01)
+        wheel.add('a', 0.01)
+        slot = wheel.add('b', 0.01)
+        wheel.add('c', 0.05)
+        wheel.remove('b', slot)
+        await asyncio.sleep(0.03)
+        first = list(expired)
+        await asyncio.sleep(0.05)
+        return wheel, first
+
+    wheel, first = run(wait())
+    assert first == ['a']
+    assert expired == ['a', 'c'] and len(wheel) == 0
+
+
+def test_msg_queue_timeout(run):
+    async def wait():
+        queue = MsgQueue(timeout=0.02, max_inflight=1, tick=0.01)
+        future = asyncio.get_event_loop().create_future()
+        await queue.acquire()
+        queue.store('1', 'getMyInfo', future)
+        with pytest.raises(RequestTimeout):
+            await future
+        # 超时后释放名额
+        await asyncio.wait_for(queue.acquire(), 1)
+        return queue
+
+    queue = run(wait())
+    assert len(queue) == 0 and queue.pop('1') is None
+
+
+def test_msg_queue_cancel_releases_slot(run):
+    async def wait():
+        queue = MsgQueue(timeout=None, max_inflight=1)
+        future = asyncio.get_event_loop().create_future()
+        await queue.acquire()
+        queue.store('1', 'getMyInfo', future)
+
+        async def caller():
+            return await future
+        task = asyncio.ensure_future(caller())
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.sleep(0)
+        await asyncio.wait_for(queue.acquire(), 1)
+        return queue
+
+    queue = run(wait())
+    assert '1' not in queue and len(queue) == 0
+
+
+def test_msg_queue_fail_all(run):
+    async def wait():
+        queue = MsgQueue(max_inflight=2)
+        futures = [asyncio.get_event_loop().create_future() for _ in range(2)]
+        for cmd_id, future in enumerate(futures):
+            await queue.acquire()
+            queue.store(cmd_id, 'syncMsg', future)
+        assert queue.fail_all(ConnectionClosed('closed')) == 2
+        for future in futures:
+            with pytest.raises(ConnectionClosed):
+                await future
+        await asyncio.wait_for(queue.acquire(), 1)
+        await asyncio.wait_for(queue.acquire(), 1)
+
+    run(wait())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+
+import pytest
+
+from padchat.constant import Priority
+from padchat.scheduler import SendScheduler, TokenBucket
+
+
+def test_token_bucket_refill():
+    bucket = TokenBucket(rate=10, capacity=2)
+    now = bucket.updated
+    bucket.consume(now)
+    bucket.consume(now)
+    assert bucket.delay(now) == pytest.approx(0.1)
+    assert bucket.delay(now + 0.05) == pytest.approx(0.05)
+    assert bucket.delay(now + 0.11) == 0
+    assert bucket.is_full(now + 1) and bucket.tokens == 2
+
+
+def test_lanes_release_by_priority(run):
+    async def send():
+        scheduler = SendScheduler(rate=100, burst=1)
+        order = []
+        assert scheduler.acquire('getMyInfo').done()
+        waiters = [
+            ('sendMsg', scheduler.acquire('sendMsg')),
+            ('getContact', scheduler.acquire('getContact')),
+            ('syncMsg', scheduler.acquire('syncMsg')),
+            ('sendImage', scheduler.acquire('sendImage',
+                                            priority=Priority.high)),
+        ]
+        for cmd, future in waiters:
+            future.add_done_callback(lambda _, cmd=cmd: order.append(cmd))
+        await asyncio.gather(*[future for _, future in waiters])
+        return scheduler, order
+
+    scheduler, order = run(send())
+    assert order == ['syncMsg', 'sendImage', 'getContact', 'sendMsg']
+    assert scheduler.stats()['delayed'] == 4
+
+
+def test_recipient_limit_does_not_block_others(run):
+    async def send():
+        scheduler = SendScheduler(recipient_rate=1, recipient_burst=1)
+        assert scheduler.acquire('sendMsg', 'wxid_a').done()
+        blocked = scheduler.acquire('sendMsg', 'wxid_a')
+        other = scheduler.acquire('sendMsg', 'wxid_b')
+        await asyncio.wait_for(other, 0.1)
+        return blocked.done()
+
+    assert run(send()) is False
+
+
+def test_cancelled_waiter_consumes_no_tokens(run):
+    async def send():
+        scheduler = SendScheduler(rate=20, burst=1)
+        scheduler.acquire('getMyInfo')
+        cancelled = [scheduler.acquire('sendMsg') for _ in range(5)]
+        live = scheduler.acquire('sendMsg')
+        for future in cancelled:
+            future.cancel()
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        await live
+        return loop.time() - start, scheduler
+
+    elapsed, scheduler = run(send())
+    # 只等待一个令牌，而不是6个
+    assert elapsed < 0.1
+    assert scheduler.granted == 2 and scheduler.depth == 0
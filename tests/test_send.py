@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import asyncio
+
+import pytest
+
+from padchat.exceptions import ConnectionClosed
+
+
+def test_write_failure_fails_request(run, connect):
+    async def send():
+        client = await connect()
+        assert (await client.get_my_info()).get('success') is True
+
+        def write_message(data):
+            future = asyncio.get_event_loop().create_future()
+            future.set_exception(IOError('stream closed'))
+            return future
+        client._ws_connection.write_message = write_message
+        # 非幂等指令不重新排队，直接失败
+        with pytest.raises(ConnectionClosed):
+            await client.send_msg('wxid_friend', 'hi')
+        return len(client._msg_queue)
+
+    assert run(send()) == 0
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+from padchat.metrics import MetricsRegistry
+from padchat.supervisor import PadchatSupervisor
+
+
+def _rendered(account, value):
+    registry = MetricsRegistry()
+    registry.counter('padchat_cmd_total', '指令数量',
+                     ('account', 'cmd')).inc(account, 'sendMsg', amount=value)
+    registry.gauge('padchat_cmd_inflight', '等待回应的指令数量').set(value)
+    registry.histogram('padchat_handler_seconds', '处理函数耗时',
+                       buckets=(1,)).observe(0.5)
+    return registry.render()
+
+
+def test_worker_metrics_merged():
+    supervisor = PadchatSupervisor('ws://localhost', workers=2, profiles=[])
+    supervisor._workers[0].stats = {'metrics': _rendered('wxid_a', 1)}
+    supervisor._workers[1].stats = {'metrics': _rendered('wxid_b', 2)}
+    lines = supervisor.render_metrics().splitlines()
+    assert lines.count('# TYPE padchat_cmd_total counter') == 1
+    assert 'padchat_cmd_total{worker="0",account="wxid_a",cmd="sendMsg"} 1' \
+        in lines
+    assert 'padchat_cmd_total{worker="1",account="wxid_b",cmd="sendMsg"} 2' \
+        in lines
+    assert 'padchat_cmd_inflight{worker="1"} 2' in lines
+    assert 'padchat_handler_seconds_bucket{worker="0",le="1"} 1' in lines
+    # 同一指标的数据行在同一组中
+    start = lines.index('# TYPE padchat_cmd_inflight gauge')
+    assert lines[start + 1:start + 3] == ['padchat_cmd_inflight{worker="0"} 1',
+                                          'padchat_cmd_inflight{worker="1"} 2']
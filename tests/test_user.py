@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+# Author: Ben Chen
+import pickle
+
+from padchat.user import User, UserProfile
+
+
+def _profile(tmp_path, legacy=None):
+    class Profile(UserProfile):
+        legacy_file = str(tmp_path / 'profile')
+
+    if legacy is not None:
+        with open(Profile.legacy_file, 'wb') as f:
+            pickle.dump(legacy, f)
+    return Profile(str(tmp_path / 'profile.db'))
+
+
+def test_profile_saved_before_login_is_updated(tmp_path):
+    profile = _profile(tmp_path)
+    profile.save(User('wxid_a'), 'data-1', 'token-1')
+    profile.save(User('wxid_a'), 'data-2', 'token-2')
+    assert len(profile) == 1
+    # 登录后得到uin，更新同一条记录
+    profile.save(User('wxid_a', uin=1, nick_name='a'), 'data-3', 'token-3')
+    profile.save(User('wxid_b', uin=2), 'data-4', 'token-4')
+    assert len(profile) == 2
+    saved = profile.get(uin=1)
+    assert saved['user'].wx_id == 'wxid_a' and saved['token'] == 'token-3'
+    assert profile['nick_name']['a']['wx_data'] == 'data-3'
+    assert profile.delete(1) and len(profile) == 1
+
+
+def test_legacy_pickle_migrated_once(tmp_path):
+    legacy = [
+        {'user': User('wxid_a', uin=1, nick_name='a'), 'wx_data': 'data-a',
+         'token': 'token-a'},
+        {'user': User('wxid_b'), 'wx_data': 'data-b', 'token': 'token-b'},
+        {'user': User('wxid_a', uin=1, nick_name='a2'), 'wx_data': 'data-a2',
+         'token': 'token-a2'},
+    ]
+    profile = _profile(tmp_path, legacy)
+    assert len(profile) == 2
+    assert profile.get(uin=1)['token'] == 'token-a2'
+    assert profile.get(wx_id='wxid_b')['wx_data'] == 'data-b'
+    assert [i['user'].wx_id for i in profile.load()] == ['wxid_a', 'wxid_b']
+    # 再次打开不重复导入
+    UserProfile._initialized.discard(profile.profile_file)
+    assert len(_profile(tmp_path)) == 2